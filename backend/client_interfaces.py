@@ -1,6 +1,7 @@
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
 from dataclasses import dataclass
 from py_ts_interfaces import Interface
+from constants import INPUT_KEYS
 
 
 @dataclass
@@ -19,3 +20,30 @@ class InputDTO(Interface):
     keys_down: List[str]
     keys_pressed: Optional[List[str]]
     keys_released: Optional[List[str]]
+
+
+class CompactInput(NamedTuple):
+    """Input as bitmasks of constants.InputKey, sent by clients as a list [seq, down, pressed, released]"""
+    seq: int
+    down: int
+    pressed: int = 0
+    released: int = 0
+
+    @classmethod
+    def from_dto(cls, data: InputDTO) -> 'CompactInput':
+        return cls(0, _key_bits(data.keys_down), _key_bits(data.keys_pressed), _key_bits(data.keys_released))
+
+    @classmethod
+    def from_list(cls, values: List) -> 'CompactInput':
+        """Return input sent as list [seq, down, pressed, released] of ints. Raises ValueError if malformed."""
+
+        if len(values) != len(cls._fields) or not all(type(value) is int for value in values):
+            raise ValueError(f'Malformed compact input {values!r}')
+        return cls(*values)
+
+
+def _key_bits(keys: Optional[List[str]]) -> int:
+    bits = 0
+    for key in keys or ():
+        bits |= INPUT_KEYS.get(key, 0)
+    return bits
@@ -1,8 +1,12 @@
-from typing import Sequence, List, Set
+from typing import TYPE_CHECKING, Any, Sequence, List, Optional, Set, Tuple
 from dataclasses import dataclass, is_dataclass, field
 from Box2D import b2World, b2Body, b2Vec2
-from constants import MatchState
+from constants import ALL_CATEGORIES, CollisionCategory, InputKey, MatchState
 from ecs.base_component import Component, Sync
+from shapes import Shape, get_body_shape
+
+if TYPE_CHECKING:
+    from spatial_hash import SpatialHash
 
 
 @dataclass
@@ -55,6 +59,22 @@ class Box2DWorld(Component):
     component_name = 'box2d_world'
     sync = Sync.NO_SYNC
     world: b2World
+    # fixed timestep of the world and the fraction of it simulated time is behind real time
+    timestep: float = 0.0
+    alpha: float = 0.0
+    # solver iterations (velocity, position) of the last step
+    iterations: Tuple[int, int] = (0, 0)
+
+
+@dataclass
+class SpatialIndex(Component):
+    """Grid of entity positions of a room, for systems asking what is near a point"""
+    component_name = 'spatial_index'
+    sync = Sync.NO_SYNC
+    index: 'SpatialHash'
+
+
+_STALE = object()
 
 
 @dataclass
@@ -62,16 +82,45 @@ class Box2DBody(Component):
     component_name = 'box2d_body'
     sync = Sync.LONG
     body: b2Body
+    _shape: Any = field(default=_STALE, init=False, repr=False, compare=False)
 
     def __register_entity__(self, entity_id: str):
         self.body.userData = entity_id
+        self.invalidate_shape()
+
+    @property
+    def shape(self) -> Optional[Shape]:
+        """Return serialized shape of the body, cached until invalidated"""
+        if self._shape is _STALE:
+            self._shape = get_body_shape(self.body)
+        return self._shape
+
+    def invalidate_shape(self):
+        """Serialize shape again on next use. Call after changing fixtures of the body."""
+        self._shape = _STALE
 
 
 @dataclass
 class Collidable(Component):
+    """Entity keeps track of the entities it touches whose fixtures have a category in `categories`"""
     component_name = 'collidable'
     sync = Sync.NO_SYNC
     collides_with: Set[str] = field(default_factory=set)
+    categories: int = ALL_CATEGORIES
+
+
+@dataclass
+class CollisionFilter(Component):
+    """Box2D filter applied to all fixtures of the entity's body.
+
+    Fixtures collide if the category of each is in the mask of the other, unless they share a
+    group: a positive one makes them always collide, a negative one never.
+    """
+    component_name = 'collision_filter'
+    sync = Sync.NO_SYNC
+    category: int = CollisionCategory.WORLD
+    mask: int = ALL_CATEGORIES
+    group: int = 0
 
 
 @dataclass
@@ -114,6 +163,16 @@ class Input(Component):
     def Nil(cls):
         return cls(move_left=False, move_right=False, jump=False)
 
+    @classmethod
+    def from_bits(cls, keys_down: int):
+        """Create from a bitmask of constants.InputKey, pressing both directions moves neither way"""
+        move_left = bool(keys_down & InputKey.LEFT)
+        move_right = bool(keys_down & InputKey.RIGHT)
+        return cls(
+            move_left=move_left and not move_right,
+            move_right=move_right and not move_left,
+            jump=bool(keys_down & InputKey.UP))
+
 
 COMPONENTS = list(filter(lambda cls: is_dataclass(cls) and issubclass(cls, Component), locals().values()))
 SHORT_SYNC_COMPONENTS = list(filter(lambda cls: cls.sync == Sync.SHORT, COMPONENTS))
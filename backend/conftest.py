@@ -1,8 +1,22 @@
+import logging
+import timeit
 import pytest
 from ecs.context import Context
+from ecs.archetype import ArchetypeContext
 from repository import repository_factory
 
 
+@pytest.fixture(params=[Context, ArchetypeContext])
+def empty_context(request):
+    return request.param(repository_factory())
+
+
 @pytest.fixture
-def empty_context():
-    return Context(repository_factory())
+def measure():
+    """Return function timing a callable, returning (and logging) best seconds per call"""
+
+    def measure(fun, label: str = '', number: int = 10, repeat: int = 5) -> float:
+        seconds = min(timeit.repeat(fun, number=number, repeat=repeat)) / number
+        logging.info(f'{label or fun.__name__}: {seconds * 1e6:.1f} us')
+        return seconds
+    return measure
@@ -1,4 +1,4 @@
-from enum import Enum
+from enum import Enum, IntFlag
 from Box2D import b2_dynamicBody, b2_kinematicBody, b2_staticBody
 MatchState = Enum('MatchState', ['NOT_STARTED', 'STARTED', 'PAUSE', 'ENDED'])
 
@@ -8,8 +8,46 @@ UP = 'ArrowUp'
 ENTER = 'Enter'
 
 
+class InputKey(IntFlag):
+    """Bits of keys in compact inputs"""
+    LEFT = 0x1
+    RIGHT = 0x2
+    UP = 0x4
+    ENTER = 0x8
+
+
+INPUT_KEYS = {LEFT: InputKey.LEFT, RIGHT: InputKey.RIGHT, UP: InputKey.UP, ENTER: InputKey.ENTER}
+
+
 BOX2D_VEL_ITERS = 25
 BOX2D_POS_ITERS = 50
+BOX2D_MIN_VEL_ITERS = 8
+BOX2D_MIN_POS_ITERS = 3
+# contacts between awake bodies at which the adaptive solver uses the most iterations
+CONTACTS_FOR_MAX_ITERS = 20
+# seconds one physics step of a room may take
+PHYSICS_STEP_BUDGET = 0.002
+# two fixed steps per tick at the 12 Hz tick rate. Steps of a whole tick let stacks collapse, smaller
+# steps multiply the physics cost of a tick (see the physics system benchmarks)
+PHYSICS_TIMESTEP = 1 / 24
+PHYSICS_MAX_SUBSTEPS = 4
+# frames between checks of all bodies for ones woken without touching an awake body
+PHYSICS_AWAKE_SCAN_INTERVAL = 60
+
+# short sync quantization (meters, meters per second, radians) and frames between keyframes
+SYNC_POSITION_PRECISION = 0.01
+SYNC_VELOCITY_PRECISION = 0.05
+SYNC_ANGLE_PRECISION = 0.005
+SYNC_KEYFRAME_INTERVAL = 120
+# half width and height of the area around its player a client gets short syncs of
+INTEREST_HALF_EXTENTS = (12.0, 8.0)
+# inputs a client may send per second, and in a burst, before further ones are dropped
+INPUT_RATE_LIMIT = 60
+INPUT_BURST = 30
+# fraction of ticks, events and emits metrics are recorded for, 0 turns recording off
+METRICS_SAMPLE_RATE = 0.1
+# side of the square cells SpatialHash buckets entity positions in
+SPATIAL_HASH_CELL_SIZE = 2.0
 
 
 class BodyType(int, Enum):
@@ -18,6 +56,17 @@ class BodyType(int, Enum):
     DYNAMIC = b2_dynamicBody
 
 
+class CollisionCategory(IntFlag):
+    """Box2D fixture category bits. WORLD is Box2D's default category, the one of walls and floor."""
+    WORLD = 0x0001
+    PLAYER = 0x0002
+    BALL = 0x0004
+    BOX = 0x0008
+
+
+ALL_CATEGORIES = 0xFFFF
+
+
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:9000',
     'http://localhost:5000',
@@ -0,0 +1,239 @@
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Mapping, Optional, Set, Tuple, Type
+from itertools import repeat
+from .base_component import Component, NullComponent
+from .context import Context, T, U
+from .exc import UnknownComponentError
+
+
+class Archetype:
+    """Entities sharing the exact same set of components, stored as one column per component.
+
+    Rows are addressed by entity index (see EntityIndex), entity ids are kept alongside for output.
+    """
+
+    def __init__(self, signature: FrozenSet[str]):
+        self.signature = signature
+        self.indices: List[int] = []
+        self.entity_ids: List[str] = []
+        self.columns: Dict[str, List[Component]] = {component_name: [] for component_name in signature}
+        self._rows: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __contains__(self, index: int) -> bool:
+        return index in self._rows
+
+    def get(self, index: int, component_name: str) -> Component:
+        return self.columns[component_name][self._rows[index]]
+
+    def set(self, index: int, component_name: str, component: Component):
+        self.columns[component_name][self._rows[index]] = component
+
+    def append(self, index: int, entity_id: str, components: Mapping[str, Component]):
+        self._rows[index] = len(self.indices)
+        self.indices.append(index)
+        self.entity_ids.append(entity_id)
+        for component_name, column in self.columns.items():
+            column.append(components[component_name])
+
+    def pop(self, index: int) -> Dict[str, Component]:
+        """Remove entity and return its components. The last row is swapped in to keep columns dense."""
+
+        row = self._rows.pop(index)
+        last = len(self.indices) - 1
+        components = {component_name: column[row] for component_name, column in self.columns.items()}
+
+        if row != last:
+            moved_index = self.indices[last]
+            self.indices[row] = moved_index
+            self.entity_ids[row] = self.entity_ids[last]
+            self._rows[moved_index] = row
+            for column in self.columns.values():
+                column[row] = column[last]
+
+        self.indices.pop()
+        self.entity_ids.pop()
+        for column in self.columns.values():
+            column.pop()
+        return components
+
+    def columns_for(self, component_names: Iterable[str]) -> List[Iterable[Component]]:
+        """Return columns for given components, NullComponents for the ones this archetype lacks"""
+
+        return [
+            self.columns[component_name] if component_name in self.columns else repeat(NullComponent(component_name))
+            for component_name in component_names
+        ]
+
+
+class ArchetypeContext(Context[T]):
+    """Context storing entities grouped by archetype instead of one dict per component.
+
+    The repository only declares the known component columns; any initial data in it is
+    imported on creation and the dicts are not kept up to date afterwards.
+    """
+
+    def __init__(self, repository: T, default_consumer=True):
+        self._archetypes: Dict[FrozenSet[str], Archetype] = {}
+        self._entity_archetypes: List[Optional[Archetype]] = []
+        self._matching_archetypes: Dict[FrozenSet[str], List[Archetype]] = {}
+        super().__init__(repository, default_consumer)
+
+    def get_entities_with(self, *components: Type[Component], some=False) -> Set[str]:
+        """Return ids of entities with given components"""
+
+        component_names = [component.component_name for component in components]
+        if some:
+            return set(
+                entity_id
+                for archetype in self._archetypes.values() if archetype.signature.intersection(component_names)
+                for entity_id in archetype.entity_ids
+            )
+        return set(
+            entity_id
+            for archetype in self._get_matching_archetypes(component_names)
+            for entity_id in archetype.entity_ids
+        )
+
+    def all(self, *required_components: Type[Component],
+            optional_components: List[Type[Component]] = []) -> List[Tuple]:
+        """Return list of (entity_id, component1, component2, ...) for given classes"""
+
+        result: List[Tuple] = []
+        for archetype, component_names in self._get_rows_query(required_components, optional_components):
+            result.extend(zip(archetype.entity_ids, *archetype.columns_for(component_names)))
+        return result
+
+    def all_dict(self, *required_components: Type[Component],
+                 optional_components: List[Type[Component]] = []) -> Dict[str, Tuple]:
+        """Return list of (entity_id, component1, component2, ...) for given classes"""
+
+        result: Dict[str, Tuple] = {}
+        for archetype, component_names in self._get_rows_query(required_components, optional_components):
+            result.update(zip(archetype.entity_ids, zip(*archetype.columns_for(component_names))))
+        return result
+
+    def get_maybe(self, entity_id: str, component: Type[Component]) -> Component:
+        """Return component dataclass safely (return NullComponent if not found)"""
+
+        component_name = component.component_name
+        if component_name not in self.repository:
+            raise KeyError(component_name)
+
+        index = self.index.get(entity_id)
+        archetype = self._get_entity_archetype(index)
+        if archetype is None or component_name not in archetype.columns:
+            return NullComponent(component_name)
+        return archetype.get(index, component_name)  # type:ignore
+
+    def get_definitely(self, entity_id: str, component: Type[U]) -> U:
+        """Return compoent dataclass. Raises if not found."""
+
+        index = self.index.get(entity_id)
+        archetype = self._get_entity_archetype(index)
+        if archetype is None:
+            raise KeyError(entity_id)
+        return archetype.get(index, component.component_name)  # type:ignore
+
+    def get_many(self, entity_ids: Iterable[str], component: Type[U]) -> List[Optional[U]]:
+        """Return component dataclasses for given entities, None for entities without one"""
+
+        component_name = component.component_name
+        if component_name not in self.repository:
+            raise UnknownComponentError(f'Repository does not have a key for {component_name}')
+
+        result: List[Optional[U]] = []
+        get_index = self.index.get
+        for entity_id in entity_ids:
+            index = get_index(entity_id)
+            archetype = self._get_entity_archetype(index)
+            if archetype is None or component_name not in archetype.columns:
+                result.append(None)
+            else:
+                result.append(archetype.get(index, component_name))  # type:ignore
+        return result
+
+    def _get_rows_query(self, required_components, optional_components) -> Iterator[Tuple[Archetype, List[str]]]:
+        required_names = [component.component_name for component in required_components]
+        component_names = required_names + [component.component_name for component in optional_components]
+
+        for archetype in self._get_matching_archetypes(required_names):
+            if not archetype:
+                continue
+            unknown = [component_name for component_name in component_names if component_name not in self.repository]
+            if unknown:
+                raise UnknownComponentError(f'Repository does not have a key for {unknown[0]}')
+            yield archetype, component_names
+
+    def _get_matching_archetypes(self, component_names: Iterable[str]) -> List[Archetype]:
+        key = frozenset(component_names)
+        matching = self._matching_archetypes.get(key)
+        if matching is None:
+            matching = [archetype for signature, archetype in self._archetypes.items() if key <= signature]
+            self._matching_archetypes[key] = matching
+        return matching
+
+    def _get_entity_archetype(self, index: Optional[int]) -> Optional[Archetype]:
+        if index is None or index >= len(self._entity_archetypes):
+            return None
+        return self._entity_archetypes[index]
+
+    def _set_entity_archetype(self, index: int, archetype: Optional[Archetype]):
+        missing = index + 1 - len(self._entity_archetypes)
+        if missing > 0:
+            self._entity_archetypes.extend([None] * missing)
+        self._entity_archetypes[index] = archetype
+
+    def _get_archetype(self, signature: FrozenSet[str]) -> Archetype:
+        archetype = self._archetypes.get(signature)
+        if archetype is None:
+            archetype = self._archetypes[signature] = Archetype(signature)
+            for key, matching in self._matching_archetypes.items():
+                if key <= signature:
+                    matching.append(archetype)
+        return archetype
+
+    def _init_entities(self, repository: T):
+        entity_components: Dict[str, List[Component]] = {}
+        for data in repository.values():
+            for entity_id, component in data.items():
+                entity_components.setdefault(entity_id, []).append(component)
+
+        for entity_id, components in entity_components.items():
+            self._update_components(entity_id, tuple(components))
+
+    def _add_entity_with_components(self, entity_id: str, components: Tuple[Component, ...]):
+        # membership is implied by the archetype the entity is stored in
+        pass
+
+    def _has_component(self, entity_id: str, component_name: str) -> bool:
+        archetype = self._get_entity_archetype(self.index.get(entity_id))
+        return archetype is not None and component_name in archetype.columns
+
+    def _update_components(self, entity_id: str, components: Tuple[Component, ...]):
+        updated = {}
+        for component in components:
+            if component.component_name not in self.repository:
+                raise KeyError(component.component_name)
+            updated[component.component_name] = component
+
+        index = self.index.add(entity_id)
+        archetype = self._get_entity_archetype(index)
+        if archetype is not None and archetype.signature.issuperset(updated):
+            for component_name, component in updated.items():
+                archetype.set(index, component_name, component)
+            return
+
+        if archetype is not None:
+            updated = {**archetype.pop(index), **updated}
+        new_archetype = self._get_archetype(frozenset(updated))
+        new_archetype.append(index, entity_id, updated)
+        self._set_entity_archetype(index, new_archetype)
+
+    def _remove_components(self, entity_id: str):
+        index = self.index.get(entity_id)
+        archetype = self._get_entity_archetype(index)
+        if archetype is not None:
+            archetype.pop(index)  # type:ignore
+            self._set_entity_archetype(index, None)  # type:ignore
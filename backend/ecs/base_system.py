@@ -1,4 +1,4 @@
-from typing import Protocol
+from typing import Callable, Dict, Iterable, List, Protocol
 from abc import abstractmethod
 from enum import Enum
 from .context import Context
@@ -35,3 +35,20 @@ class System(Protocol):
 
     def on_player_leave(self, sid: str):
         raise NotImplementedError
+
+
+def dispatch_table(systems: Iterable[System]) -> Dict[ExternalEvent, List[Callable]]:
+    """Return bound handlers of each event, leaving out the System defaults that only raise"""
+
+    systems = list(systems)
+    table: Dict[ExternalEvent, List[Callable]] = {}
+    for event in ExternalEvent:
+        method_name = f'on_{event.value}'
+        default = getattr(System, method_name)
+        handlers: List[Callable] = []
+        for system in systems:
+            handler = getattr(system, method_name, None)
+            if handler is not None and getattr(handler, '__func__', None) is not default:
+                handlers.append(handler)
+        table[event] = handlers
+    return table
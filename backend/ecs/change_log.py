@@ -0,0 +1,67 @@
+from typing import Deque, Dict, Generic, Hashable, List, TypeVar
+from collections import deque
+from itertools import islice
+
+V = TypeVar('V')
+
+
+class ChangeLog(Generic[V]):
+    """Append-only log of changes, read by consumers through their own sequence cursors.
+
+    Reading never removes entries other consumers have not read yet. Entries are dropped
+    once every cursor has passed them.
+    """
+
+    def __init__(self):
+        self._entries: Deque[V] = deque()
+        self._offset = 0
+        self._cursors: Dict[Hashable, int] = {}
+
+    def __contains__(self, consumer: Hashable) -> bool:
+        return consumer in self._cursors
+
+    def __len__(self) -> int:
+        """Return number of entries not yet read by every consumer"""
+        return len(self._entries)
+
+    @property
+    def head(self) -> int:
+        """Sequence number the next entry will get"""
+        return self._offset + len(self._entries)
+
+    def add_consumer(self, consumer: Hashable):
+        """Register consumer. Only entries appended after registration are visible to it."""
+
+        self._cursors.setdefault(consumer, self.head)
+
+    def remove_consumer(self, consumer: Hashable):
+        del self._cursors[consumer]
+        self._compact()
+
+    def cursor(self, consumer: Hashable) -> int:
+        return self._cursors[consumer]
+
+    def append(self, entry: V) -> int:
+        """Append entry and return its sequence number"""
+
+        if not self._cursors:
+            self._offset += 1
+        else:
+            self._entries.append(entry)
+        return self.head - 1
+
+    def read(self, consumer: Hashable, advance=True) -> List[V]:
+        """Return entries appended since the cursor of consumer, optionally moving the cursor past them"""
+
+        cursor = self._cursors[consumer]
+        entries = list(islice(self._entries, cursor - self._offset, None))
+        if advance and entries:
+            self._cursors[consumer] = self.head
+            self._compact()
+        return entries
+
+    def _compact(self):
+        oldest = min(self._cursors.values(), default=self.head)
+        while self._offset < oldest:
+            self._entries.popleft()
+            self._offset += 1
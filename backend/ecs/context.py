@@ -1,20 +1,40 @@
-from typing import DefaultDict, Tuple, Set, List, Dict, TypeVar, Mapping, Generic, Type, Union, overload
+from typing import DefaultDict, FrozenSet, Hashable, Iterable, Tuple, Set, List, Dict, TypeVar, Mapping, Generic, Type
+from typing import Optional, Union, overload
 from collections import defaultdict
 from .base_component import Component, NullComponent
 from .exc import UnknownComponentError
+from .query import Query
+from .entity_index import EntityIndex
+from .dirty import DirtyFlags
+from .change_log import ChangeLog
+from .exc import UnknownConsumerError
 
 T = TypeVar('T', bound=Mapping[str, Mapping[str, Component]])
 U = TypeVar('U', bound=Component)
+DEFAULT_CONSUMER = 'default'
 
 
 class Context(Generic[T]):
-    def __init__(self, repository: T):
+    """Entities and their components.
+
+    Changes are read by consumers. Reading with consumer=None reads as the default consumer,
+    which is only registered with default_consumer=True. A registered consumer that never reads
+    removed entities keeps them from being dropped, so owners that only use named consumers
+    should pass False.
+    """
+
+    def __init__(self, repository: T, default_consumer=True):
         self.entities: DefaultDict[str, Set[str]] = defaultdict(set)
         self.repository = repository
-        self._updated_entities: DefaultDict[str, Set[str]] = defaultdict(set)
-        self._removed_entities: Set[str] = set()
+        self.index = EntityIndex()
+        self._updated_entities = DirtyFlags()
+        self._removed_entities: ChangeLog[str] = ChangeLog()
+        if default_consumer:
+            self.add_consumer(DEFAULT_CONSUMER)
         self._ignore_updated_entities: Set[str] = set()
         self._counter = 0
+        self._queries: Dict[FrozenSet[str], Query] = {}
+        self._queries_by_component: DefaultDict[str, List[Query]] = defaultdict(list)
 
         self._init_entities(repository)
 
@@ -33,12 +53,14 @@ class Context(Generic[T]):
     def upsert(self, entity_id: str, *components: Component) -> str:
         """Create or update entity with given id"""
 
+        self.index.add(entity_id)
         try:
             self._update_components(entity_id, components)
         except KeyError as err:
             raise UnknownComponentError(f'Repository does not have a key for {err}')
 
         self._add_entity_with_components(entity_id, components)
+        self._update_queries(entity_id, components)
         self.mark_entity_updated(entity_id, *components)
 
         for component in components:
@@ -63,37 +85,60 @@ class Context(Generic[T]):
             return set.union(*entity_ids_list)
         return set.intersection(*entity_ids_list)
 
-    def get_all_updated_entities(self, reset=True) -> Set[str]:
-        """Return ids of entities with any updated flag"""
+    def query(self, *components: Type[Component]) -> Query:
+        """Return query of entities with given components, kept up to date on upsert and remove"""
 
-        entity_ids_list = self._updated_entities.values()
-        if entity_ids_list:
-            updated = set.union(*entity_ids_list)
-        else:
-            return set()
+        key = frozenset(component.component_name for component in components)
+        query = self._queries.get(key)
+        if query is None:
+            query = self._queries[key] = Query(key, self.get_entities_with(*components))
+            for component_name in key:
+                self._queries_by_component[component_name].append(query)
+        return query
 
-        if reset:
-            self._updated_entities.clear()
+    def add_consumer(self, consumer: Hashable, removed=True):
+        """Register consumer with its own updated flags and removed entities cursor.
 
-        return updated
+        Consumers (e.g. short sync, long sync, a client catching up) only see changes made after
+        they were added, and reading with reset=True never hides changes from other consumers.
+        With removed=False the consumer only gets updated flags, for consumers that never read
+        removed entities.
+        """
 
-    def get_updated_entities_for(self, *components: Type[Component], reset=True) -> Set[str]:
-        """Return ids of entities with updated flag for any of given components"""
+        self._updated_entities.add_consumer(consumer)
+        if removed:
+            self._removed_entities.add_consumer(consumer)
 
-        entity_ids_list = [self._updated_entities[component.component_name] for component in components]
-        updated = set.union(*entity_ids_list)
-        if reset:
-            for component in components:
-                self._updated_entities[component.component_name] -= updated
-        return updated
+    def remove_consumer(self, consumer: Hashable):
+        self._updated_entities.remove_consumer(consumer)
+        if consumer in self._removed_entities:
+            self._removed_entities.remove_consumer(consumer)
+
+    def get_all_updated_entities(self, reset=True, consumer: Hashable = None) -> Set[str]:
+        """Return ids of entities with any updated flag"""
 
-    def get_removed_entities(self, reset=True) -> Set[str]:
-        """Return ids of entities that have been removed"""
+        updated = self._updated_entities.collect_all(self._get_consumer(consumer), reset)
+        return self._to_entity_ids(updated)
 
-        removed = self._removed_entities.copy()
-        if reset:
-            self._removed_entities = set()
-        return removed
+    def get_updated_entities_for(self, *components: Type[Component], reset=True,
+                                 consumer: Hashable = None) -> Set[str]:
+        """Return ids of entities with updated flag for any of given components.
+
+        Resetting only clears the flags of the given consumer, others still see the updates.
+        """
+
+        component_names = [component.component_name for component in components]
+        updated = self._updated_entities.collect(self._get_consumer(consumer), component_names, reset)
+        return self._to_entity_ids(updated)
+
+    def get_removed_entities(self, reset=True, consumer: Hashable = None) -> Set[str]:
+        """Return ids of entities that have been removed (and not recreated) since last reset of consumer"""
+
+        consumer = self._get_consumer(consumer)
+        if consumer not in self._removed_entities:
+            raise UnknownConsumerError(f'Consumer {consumer} does not read removed entities')
+        removed = self._removed_entities.read(consumer, advance=reset)
+        return set(entity_id for entity_id in removed if entity_id not in self.index)
 
     @overload
     def singleton(self, component: Type[Component], field: str):
@@ -115,7 +160,7 @@ class Context(Generic[T]):
             optional_components: List[Type[Component]] = []) -> List[Tuple]:
         """Return list of (entity_id, component1, component2, ...) for given classes"""
 
-        entities = self.get_entities_with(*required_components)
+        entities = self.query(*required_components).entities
         return [
             tuple((
                 entity_id,
@@ -128,7 +173,7 @@ class Context(Generic[T]):
                  optional_components: List[Type[Component]] = []) -> Dict[str, Tuple]:
         """Return list of (entity_id, component1, component2, ...) for given classes"""
 
-        entities = self.get_entities_with(*required_components)
+        entities = self.query(*required_components).entities
         return {
             entity_id: tuple((
                 *self.components(entity_id, *required_components),
@@ -165,18 +210,32 @@ class Context(Generic[T]):
 
         return self.repository[component.component_name][entity_id]  # type:ignore
 
+    def get_many(self, entity_ids: Iterable[str], component: Type[U]) -> List[Optional[U]]:
+        """Return component dataclasses for given entities, None for entities without one"""
+
+        try:
+            get = self.repository[component.component_name].get
+        except KeyError as err:
+            raise UnknownComponentError(f'Repository does not have a key for {err}')
+        return [get(entity_id) for entity_id in entity_ids]  # type:ignore
+
     def get_updated(self, entity_id: str, *components: Type[Component],
-                    reset=True) -> Tuple[Union[Component, None], ...]:
+                    reset=True, consumer: Hashable = None) -> Tuple[Union[Component, None], ...]:
         """Return only updated component dataclasses for given entity and classes"""
 
+        consumer = self._get_consumer(consumer)
+        index = self.index.get(entity_id)
+        if index is None:
+            return tuple(None for component in components)
+
+        component_names = [component.component_name for component in components]
         been_updated = tuple(
-            entity_id in self._updated_entities[component.component_name]
-            for component in components
+            self._updated_entities.is_marked(consumer, index, component_name)
+            for component_name in component_names
         )
         zipped = zip(components, been_updated)
         if reset:
-            for component in components:
-                self._updated_entities[component.component_name].discard(entity_id)
+            self._updated_entities.unmark(consumer, index, component_names)
 
         return tuple(
             self.get_definitely(entity_id, component) if is_updated else None
@@ -184,12 +243,14 @@ class Context(Generic[T]):
         )
 
     def mark_entity_updated(self, entity_id: str, *components: Union[Type[Component], Component]):
-        """Marks entity updated to be retrieved for get_updated_nnn"""
+        """Marks entity updated to be retrieved for get_updated_nnn. Entities that do not exist are skipped."""
         if entity_id in self._ignore_updated_entities:
             return
 
-        for component in components:
-            self._updated_entities[component.component_name].add(entity_id)
+        index = self.index.get(entity_id)
+        if index is None:
+            return
+        self._updated_entities.mark(index, (component.component_name for component in components))
 
     def ignore_entity_updates(self, entity_id: str):
         """Marks entity to be ignored in get_updated and get_updated_entities_for"""
@@ -197,13 +258,16 @@ class Context(Generic[T]):
         self._ignore_updated_entities.add(entity_id)
 
     def remove_entity(self, entity_id: str):
-        for component_name in self.entities.keys():
-            self._updated_entities[component_name].discard(entity_id)
-            self.entities[component_name].discard(entity_id)
-            self.repository[component_name].pop(entity_id, None)  # type:ignore
+        index = self.index.get(entity_id)
+        if index is not None:
+            self._updated_entities.clear(index)
+        self._remove_components(entity_id)
+        for query in self._queries.values():
+            query.entities.discard(entity_id)
+        self.index.remove(entity_id)
 
         if entity_id not in self._ignore_updated_entities:
-            self._removed_entities.add(entity_id)
+            self._removed_entities.append(entity_id)
 
     def _new_id(self) -> str:
         entity_id = str(self._counter)
@@ -213,11 +277,39 @@ class Context(Generic[T]):
     def _init_entities(self, repository: T):
         for component, data in self.repository.items():
             self.entities[component] = set(data.keys())
+            for entity_id in data:
+                self.index.add(entity_id)
 
     def _add_entity_with_components(self, entity_id: str, components: Tuple[Component, ...]):
         for component in components:
             self.entities[component.component_name].add(entity_id)
 
+    def _get_consumer(self, consumer: Hashable) -> Hashable:
+        if consumer is None:
+            consumer = DEFAULT_CONSUMER
+        if consumer not in self._updated_entities:
+            raise UnknownConsumerError(f'Consumer {consumer} has not been added')
+        return consumer
+
+    def _to_entity_ids(self, indices: Iterable[int]) -> Set[str]:
+        entity_id = self.index.entity_id
+        return {entity_id(index) for index in indices}
+
+    def _update_queries(self, entity_id: str, components: Tuple[Component, ...]):
+        for component in components:
+            for query in self._queries_by_component.get(component.component_name, ()):
+                if entity_id not in query.entities and all(
+                        self._has_component(entity_id, component_name) for component_name in query.component_names):
+                    query.entities.add(entity_id)
+
+    def _has_component(self, entity_id: str, component_name: str) -> bool:
+        return entity_id in self.entities.get(component_name, ())
+
     def _update_components(self, entity_id: str, components: Tuple[Component, ...]):
         for component in components:
             self.repository[component.component_name][entity_id] = component  # type: ignore
+
+    def _remove_components(self, entity_id: str):
+        for component_name, entity_ids in self.entities.items():
+            entity_ids.discard(entity_id)
+            self.repository[component_name].pop(entity_id, None)  # type:ignore
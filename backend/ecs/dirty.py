@@ -0,0 +1,118 @@
+from typing import Dict, Hashable, Iterable, Iterator, List
+import re
+
+MAX_CONSUMERS = 8
+_NONZERO = re.compile(b'[^\x00]')
+
+
+def iter_indices(flags: bytes) -> Iterator[int]:
+    """Return indices of nonzero bytes"""
+    return (match.start() for match in _NONZERO.finditer(flags))
+
+
+class DirtyFlags:
+    """Updated flags for (entity index, component) pairs, kept separately for each consumer.
+
+    Each component has a bytearray with one byte per entity index and each consumer owns one
+    bit of that byte, so marking is a single byte write no matter how many consumers there are,
+    and a consumer collecting (and clearing) its flags never touches the flags of the others.
+    """
+
+    def __init__(self):
+        self._flags: Dict[str, bytearray] = {}
+        self._consumer_bits: Dict[Hashable, int] = {}
+        self._all_bits = 0
+        self._select_tables: Dict[int, bytes] = {}
+        self._clear_tables: Dict[int, bytes] = {}
+
+    def __contains__(self, consumer: Hashable) -> bool:
+        return consumer in self._consumer_bits
+
+    def add_consumer(self, consumer: Hashable):
+        """Register consumer. Only marks made after registration are visible to it."""
+
+        if consumer in self._consumer_bits:
+            return
+        free_bits = [1 << i for i in range(MAX_CONSUMERS) if not self._all_bits & 1 << i]
+        if not free_bits:
+            raise OverflowError(f'At most {MAX_CONSUMERS} consumers are supported')
+
+        bit = free_bits[0]
+        self._consumer_bits[consumer] = bit
+        self._all_bits |= bit
+        self._select_tables[bit] = bytes(1 if value & bit else 0 for value in range(256))
+        self._clear_tables[bit] = bytes(value & ~bit for value in range(256))
+
+    def remove_consumer(self, consumer: Hashable):
+        bit = self._consumer_bits.pop(consumer)
+        self._all_bits &= ~bit
+        for component_name, flags in self._flags.items():
+            self._flags[component_name] = flags.translate(self._clear_tables[bit])
+
+    def mark(self, index: int, component_names: Iterable[str]):
+        """Set flags of all consumers for entity index and components"""
+
+        all_bits = self._all_bits
+        for component_name in component_names:
+            flags = self._get_flags(component_name, index)
+            flags[index] = all_bits
+
+    def is_marked(self, consumer: Hashable, index: int, component_name: str) -> bool:
+        flags = self._flags.get(component_name)
+        return flags is not None and index < len(flags) and bool(flags[index] & self._consumer_bits[consumer])
+
+    def unmark(self, consumer: Hashable, index: int, component_names: Iterable[str]):
+        """Clear flags of consumer for entity index and components"""
+
+        keep = ~self._consumer_bits[consumer]
+        for component_name in component_names:
+            flags = self._flags.get(component_name)
+            if flags is not None and index < len(flags):
+                flags[index] &= keep
+
+    def clear(self, index: int):
+        """Clear flags of every consumer and component for entity index"""
+
+        for flags in self._flags.values():
+            if index < len(flags):
+                flags[index] = 0
+
+    def collect(self, consumer: Hashable, component_names: Iterable[str], reset=True) -> List[int]:
+        """Return entity indices flagged for any of given components, optionally clearing them"""
+
+        bit = self._consumer_bits[consumer]
+        select = self._select_tables[bit]
+        clear = self._clear_tables[bit]
+
+        selected = []
+        for component_name in component_names:
+            flags = self._flags.get(component_name)
+            if not flags:
+                continue
+            selected.append(flags.translate(select))
+            if reset:
+                self._flags[component_name] = flags.translate(clear)
+
+        if not selected:
+            return []
+        if len(selected) == 1:
+            return list(iter_indices(selected[0]))
+
+        length = max(len(flags) for flags in selected)
+        union = 0
+        for flags in selected:
+            union |= int.from_bytes(flags, 'little')
+        return list(iter_indices(union.to_bytes(length, 'little')))
+
+    def collect_all(self, consumer: Hashable, reset=True) -> List[int]:
+        """Return entity indices flagged for any component, optionally clearing them"""
+
+        return self.collect(consumer, list(self._flags.keys()), reset)
+
+    def _get_flags(self, component_name: str, index: int) -> bytearray:
+        flags = self._flags.get(component_name)
+        if flags is None:
+            flags = self._flags[component_name] = bytearray()
+        if index >= len(flags):
+            flags.extend(bytes(max(index + 1, 2 * len(flags)) - len(flags)))
+        return flags
@@ -0,0 +1,103 @@
+from typing import Deque, Dict, List, Optional
+from collections import deque
+
+INDEX_BITS = 24
+INDEX_MASK = (1 << INDEX_BITS) - 1
+
+
+class EntityIndex:
+    """Bidirectional mapping between entity ids (socket sids, level names) and dense integer indices.
+
+    Indices of removed entities are reused, oldest first. Each reuse bumps the generation of the
+    index so that a handle (index and generation packed into one int) of a removed entity never
+    matches the entity that reuses its index.
+    """
+
+    def __init__(self):
+        self._indices: Dict[str, int] = {}
+        self._entity_ids: List[Optional[str]] = []
+        self._generations: List[int] = []
+        self._free: Deque[int] = deque()
+
+    def __len__(self) -> int:
+        """Return number of allocated indices, including free ones"""
+        return len(self._entity_ids)
+
+    def live(self) -> int:
+        """Return number of entities holding an index"""
+        return len(self._indices)
+
+    def __contains__(self, entity_id: str) -> bool:
+        return entity_id in self._indices
+
+    def __getitem__(self, entity_id: str) -> int:
+        """Return index for entity id. Raises KeyError if it has none."""
+        return self._indices[entity_id]
+
+    def add(self, entity_id: str) -> int:
+        """Return index for entity id, allocating one if needed"""
+
+        index = self._indices.get(entity_id)
+        if index is not None:
+            return index
+
+        if self._free:
+            index = self._free.popleft()
+            self._entity_ids[index] = entity_id
+        else:
+            index = len(self._entity_ids)
+            if index > INDEX_MASK:
+                raise OverflowError('Out of entity indices')
+            self._entity_ids.append(entity_id)
+            self._generations.append(0)
+
+        self._indices[entity_id] = index
+        return index
+
+    def get(self, entity_id: str) -> Optional[int]:
+        """Return index for entity id or None if it has none"""
+        return self._indices.get(entity_id)
+
+    def entity_id(self, index: int) -> str:
+        """Return entity id for index. Raises KeyError if index is free."""
+
+        entity_id = self._entity_ids[index]
+        if entity_id is None:
+            raise KeyError(index)
+        return entity_id
+
+    def handle(self, entity_id: str) -> int:
+        """Return generation-tagged handle for entity id. Raises KeyError if not found."""
+
+        index = self._indices[entity_id]
+        return self._generations[index] << INDEX_BITS | index
+
+    def is_alive(self, handle: int) -> bool:
+        """Return whether handle still refers to the entity it was created for"""
+
+        index = handle & INDEX_MASK
+        return (
+            index < len(self._entity_ids)
+            and self._entity_ids[index] is not None
+            and self._generations[index] == handle >> INDEX_BITS
+        )
+
+    def remove(self, entity_id: str) -> Optional[int]:
+        """Release index of entity id for reuse and return it"""
+
+        index = self._indices.pop(entity_id, None)
+        if index is not None:
+            self._entity_ids[index] = None
+            self._generations[index] += 1
+            self._free.append(index)
+        return index
+
+
+def index_of(handle: int) -> int:
+    """Return index part of a handle"""
+    return handle & INDEX_MASK
+
+
+def generation_of(handle: int) -> int:
+    """Return generation part of a handle"""
+    return handle >> INDEX_BITS
@@ -5,3 +5,7 @@ class ContextError(Exception):
 
 class UnknownComponentError(ContextError):
     pass
+
+
+class UnknownConsumerError(ContextError):
+    pass
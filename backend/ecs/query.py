@@ -0,0 +1,18 @@
+from typing import FrozenSet, Iterable, Iterator, Set
+
+
+class Query:
+    """Ids of entities having all given components. Maintained by Context, do not modify."""
+
+    def __init__(self, component_names: FrozenSet[str], entities: Iterable[str] = ()):
+        self.component_names = component_names
+        self.entities: Set[str] = set(entities)
+
+    def __contains__(self, entity_id: str) -> bool:
+        return entity_id in self.entities
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.entities)
+
+    def __len__(self) -> int:
+        return len(self.entities)
@@ -0,0 +1,59 @@
+import pytest
+from ecs import test_context
+from ecs.archetype import Archetype, ArchetypeContext
+from ecs.test_context import Foo, Bar, MyRepository, empty_repository  # noqa: F401
+
+
+@pytest.fixture(autouse=True)
+def archetype_context(monkeypatch):
+    """Run the Context test suite against ArchetypeContext"""
+    monkeypatch.setattr(test_context, 'Context', ArchetypeContext)
+
+
+class TestArchetypeContext(test_context.TestContext):
+    def test_upsert_moves_entity_to_new_archetype(self, empty_repository):
+        c = ArchetypeContext(repository=empty_repository)
+        c.upsert('1', Foo(1))
+        c.upsert('2', Foo(2))
+        c.upsert('1', Bar(3))
+
+        assert c.get_entities_with(Foo) == {'1', '2'}
+        assert c.get_entities_with(Foo, Bar) == {'1'}
+        assert c.components('1', Foo, Bar) == (Foo(1), Bar(3))
+        assert c.all(Foo, Bar) == [('1', Foo(1), Bar(3))]
+
+    def test_upsert_existing_component_updates_in_place(self, empty_repository):
+        c = ArchetypeContext(repository=empty_repository)
+        c.upsert('1', Foo(1), Bar(2))
+        c.upsert('1', Foo(3))
+
+        assert c.components('1', Foo, Bar) == (Foo(3), Bar(2))
+        assert len(c._archetypes) == 1
+
+    def test_remove_entity_keeps_rows_consistent(self, empty_repository):
+        c = ArchetypeContext(repository=empty_repository)
+        for i in range(4):
+            c.upsert(str(i), Foo(i))
+        c.remove_entity('1')
+
+        assert c.all_dict(Foo) == {'0': (Foo(0),), '2': (Foo(2),), '3': (Foo(3),)}
+
+    def test_init_imports_repository_data(self):
+        c = ArchetypeContext(repository=MyRepository(foo={'1': Foo(1)}, bar={'1': Bar(2)}, singlefoo={}))
+
+        assert c.components('1', Foo, Bar) == (Foo(1), Bar(2))
+
+
+class TestArchetype:
+    def test_pop_swaps_last_row(self):
+        archetype = Archetype(frozenset(['foo']))
+        archetype.append(0, 'a', {'foo': Foo(1)})
+        archetype.append(1, 'b', {'foo': Foo(2)})
+        archetype.append(2, 'c', {'foo': Foo(3)})
+
+        assert archetype.pop(0) == {'foo': Foo(1)}
+        assert archetype.entity_ids == ['c', 'b']
+        assert archetype.indices == [2, 1]
+        assert archetype.columns['foo'] == [Foo(3), Foo(2)]
+        assert archetype.get(2, 'foo') == Foo(3)
+        assert 0 not in archetype
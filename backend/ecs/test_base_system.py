@@ -0,0 +1,35 @@
+from unittest.mock import Mock
+from ecs.base_system import System, ExternalEvent, dispatch_table
+
+
+class FrameSystem(System):
+    def __init__(self, context):
+        self.context = context
+
+    def on_update_frame(self, dt):
+        pass
+
+
+class PlainSystem:
+    def __init__(self, context):
+        self.context = context
+
+    def on_input(self, sid, data):
+        pass
+
+
+class TestDispatchTable:
+    def test_only_overridden_handlers(self):
+        frame_system = FrameSystem(Mock())
+        plain_system = PlainSystem(Mock())
+
+        table = dispatch_table([frame_system, plain_system])
+        assert table[ExternalEvent.UPDATE_FRAME] == [frame_system.on_update_frame]
+        assert table[ExternalEvent.INPUT] == [plain_system.on_input]
+        assert table[ExternalEvent.UPDATE] == []
+
+    def test_handlers_keep_system_order(self):
+        first, second = FrameSystem(Mock()), FrameSystem(Mock())
+
+        assert dispatch_table([first, second])[ExternalEvent.UPDATE_FRAME] == [
+            first.on_update_frame, second.on_update_frame]
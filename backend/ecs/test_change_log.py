@@ -0,0 +1,68 @@
+from ecs.change_log import ChangeLog
+
+
+class TestChangeLog:
+    def test_read_since_cursor(self):
+        log: ChangeLog[str] = ChangeLog()
+        log.add_consumer('short')
+        log.append('a')
+        log.append('b')
+
+        assert log.read('short') == ['a', 'b']
+        assert log.read('short') == []
+
+        log.append('c')
+        assert log.read('short', advance=False) == ['c']
+        assert log.read('short') == ['c']
+
+    def test_consumers_have_independent_cursors(self):
+        log: ChangeLog[str] = ChangeLog()
+        log.add_consumer('short')
+        log.add_consumer('long')
+        log.append('a')
+
+        assert log.read('short') == ['a']
+        log.append('b')
+
+        assert log.read('long') == ['a', 'b']
+        assert log.read('short') == ['b']
+
+    def test_consumer_added_later_only_sees_later_entries(self):
+        log: ChangeLog[str] = ChangeLog()
+        log.add_consumer('short')
+        log.append('a')
+        log.add_consumer('client')
+        log.append('b')
+
+        assert log.read('client') == ['b']
+
+    def test_compacts_entries_read_by_every_consumer(self):
+        log: ChangeLog[str] = ChangeLog()
+        log.add_consumer('short')
+        log.add_consumer('long')
+        log.append('a')
+        log.append('b')
+
+        log.read('short')
+        assert len(log) == 2
+
+        log.read('long')
+        assert len(log) == 0
+        assert log.head == 2
+
+    def test_remove_consumer_compacts(self):
+        log: ChangeLog[str] = ChangeLog()
+        log.add_consumer('short')
+        log.add_consumer('client')
+        log.append('a')
+        log.read('short')
+
+        log.remove_consumer('client')
+        assert len(log) == 0
+
+    def test_append_without_consumers_is_dropped(self):
+        log: ChangeLog[str] = ChangeLog()
+
+        assert log.append('a') == 0
+        assert log.append('b') == 1
+        assert len(log) == 0
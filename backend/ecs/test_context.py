@@ -4,7 +4,7 @@ from unittest.mock import MagicMock, ANY
 from operator import itemgetter
 from ecs.context import Context
 from ecs.base_component import Component, NullComponent
-from ecs.exc import UnknownComponentError
+from ecs.exc import UnknownComponentError, UnknownConsumerError
 from dataclasses import dataclass
 
 
@@ -319,3 +319,129 @@ class TestContext:
         c.remove_entity('3')
 
         assert c.get_removed_entities() == set()
+
+    def test_query(self, empty_repository):
+        c = Context(repository=empty_repository)
+        c.upsert('1', Foo(1))
+        c.upsert('2', Foo(2), Bar(2))
+
+        query = c.query(Foo, Bar)
+        assert query.entities == {'2'}
+        assert c.query(Bar, Foo) is query
+
+    def test_query_is_updated_on_upsert(self, empty_repository):
+        c = Context(repository=empty_repository)
+        c.upsert('1', Foo(1))
+        query = c.query(Foo, Bar)
+
+        c.upsert('1', Bar(1))
+        c.upsert('2', Bar(2))
+
+        assert '1' in query
+        assert '2' not in query
+
+    def test_query_is_updated_on_remove_entity(self, empty_repository):
+        c = Context(repository=empty_repository)
+        c.upsert('1', Foo(1))
+        query = c.query(Foo)
+
+        c.remove_entity('1')
+
+        assert len(query) == 0
+
+    def test_entity_index(self, empty_repository):
+        c = Context(repository=empty_repository)
+        c.upsert('a', Foo(1))
+        c.upsert('b', Foo(2))
+
+        assert c.index.get('b') == 1
+        c.remove_entity('a')
+        assert c.index.get('a') is None
+
+        c.upsert('c', Foo(3))
+        assert c.index.get('c') == 0
+        assert c.get_entities_with(Foo) == {'b', 'c'}
+        assert c.get_all_updated_entities() == {'b', 'c'}
+
+    def test_marking_unknown_entity_does_not_hide_its_removal(self, empty_repository):
+        c = Context(repository=empty_repository)
+        c.upsert('a', Foo(1))
+        c.remove_entity('a')
+
+        c.mark_entity_updated('a', Foo)
+
+        assert 'a' not in c.index
+        assert c.get_all_updated_entities() == set()
+        assert c.get_removed_entities() == {'a'}
+
+    def test_entities_of_initial_repository_have_indices(self):
+        c = Context(repository={Foo.component_name: {'a': Foo(1)}})
+        c.mark_entity_updated('a', Foo)
+
+        assert c.get_updated_entities_for(Foo) == {'a'}
+
+    def test_get_updated_entities_for_consumer(self, empty_repository):
+        c = Context(repository=empty_repository)
+        c.add_consumer('short')
+        c.add_consumer('long')
+        c.upsert('1', Foo(1))
+
+        assert c.get_updated_entities_for(Foo, consumer='short') == {'1'}
+        assert c.get_updated_entities_for(Foo, consumer='short') == set()
+        assert c.get_updated_entities_for(Foo, consumer='long') == {'1'}
+        assert c.get_all_updated_entities() == {'1'}
+
+    def test_get_updated_entities_for_unknown_consumer(self, empty_repository):
+        c = Context(repository=empty_repository)
+
+        with pytest.raises(UnknownConsumerError):
+            c.get_updated_entities_for(Foo, consumer='nonexistent')
+
+    def test_get_removed_entities_for_consumer(self, empty_repository):
+        c = Context(repository=empty_repository)
+        c.add_consumer('short')
+        c.add_consumer('long')
+        c.upsert('1', Foo(1))
+        c.remove_entity('1')
+
+        assert c.get_removed_entities(consumer='short') == {'1'}
+        assert c.get_removed_entities(consumer='short') == set()
+        assert c.get_removed_entities(consumer='long', reset=False) == {'1'}
+        assert c.get_removed_entities(consumer='long') == {'1'}
+        assert c.get_removed_entities() == {'1'}
+
+    def test_consumer_without_removed_entities(self, empty_repository):
+        c = Context(repository=empty_repository, default_consumer=False)
+        c.add_consumer('flags', removed=False)
+        c.add_consumer('sync')
+        c.upsert('1', Foo(1))
+        c.remove_entity('1')
+
+        assert c.get_removed_entities(consumer='sync') == {'1'}
+        assert len(c._removed_entities) == 0
+        with pytest.raises(UnknownConsumerError):
+            c.get_removed_entities(consumer='flags')
+        with pytest.raises(UnknownConsumerError):
+            c.get_removed_entities()
+        c.remove_consumer('flags')
+
+    def test_get_removed_entities_does_not_return_recreated(self, empty_repository):
+        c = Context(repository=empty_repository)
+        c.upsert('1', Foo(1))
+        c.remove_entity('1')
+        c.upsert('1', Foo(2))
+
+        assert c.get_removed_entities() == set()
+
+    def test_get_many(self, empty_repository):
+        c = Context(repository=empty_repository)
+        c.upsert('1', Foo(1))
+        c.upsert('2', Bar(2))
+
+        assert c.get_many(['2', '1', 'nonexistent'], Foo) == [None, Foo(1), None]
+
+    def test_get_many_nonexistent_class(self, empty_repository):
+        c = Context(repository=empty_repository)
+
+        with pytest.raises(UnknownComponentError):
+            c.get_many(['1'], Fake)
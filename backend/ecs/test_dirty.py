@@ -0,0 +1,66 @@
+import pytest
+from ecs.dirty import DirtyFlags, MAX_CONSUMERS, iter_indices
+
+
+@pytest.fixture
+def flags():
+    flags = DirtyFlags()
+    flags.add_consumer('short')
+    flags.add_consumer('long')
+    return flags
+
+
+class TestDirtyFlags:
+    def test_iter_indices(self):
+        assert list(iter_indices(bytes([0, 1, 0, 4, 2]))) == [1, 3, 4]
+
+    def test_collect(self, flags):
+        flags.mark(3, ['foo'])
+        flags.mark(1, ['foo', 'bar'])
+        flags.mark(7, ['bar'])
+
+        assert flags.collect('short', ['foo']) == [1, 3]
+        assert flags.collect('short', ['foo']) == []
+        assert flags.collect('short', ['foo', 'bar'], reset=False) == [1, 7]
+        assert flags.collect('short', ['nonexistent']) == []
+
+    def test_collect_does_not_clear_other_consumers(self, flags):
+        flags.mark(2, ['foo'])
+
+        assert flags.collect_all('short') == [2]
+        assert flags.collect_all('short') == []
+        assert flags.collect_all('long') == [2]
+
+    def test_unmark_and_is_marked(self, flags):
+        flags.mark(2, ['foo', 'bar'])
+        flags.unmark('short', 2, ['foo'])
+
+        assert not flags.is_marked('short', 2, 'foo')
+        assert flags.is_marked('short', 2, 'bar')
+        assert flags.is_marked('long', 2, 'foo')
+        assert not flags.is_marked('long', 100, 'foo')
+
+    def test_clear(self, flags):
+        flags.mark(2, ['foo', 'bar'])
+        flags.clear(2)
+
+        assert flags.collect_all('short') == []
+        assert flags.collect_all('long') == []
+
+    def test_consumer_added_later_only_sees_later_marks(self, flags):
+        flags.mark(1, ['foo'])
+        flags.add_consumer('late')
+        flags.mark(2, ['foo'])
+
+        assert flags.collect_all('late') == [2]
+
+    def test_too_many_consumers(self):
+        flags = DirtyFlags()
+        for i in range(MAX_CONSUMERS):
+            flags.add_consumer(i)
+
+        with pytest.raises(OverflowError):
+            flags.add_consumer('one too many')
+
+        flags.remove_consumer(0)
+        flags.add_consumer('reuses bit')
@@ -0,0 +1,36 @@
+import pytest
+from ecs.entity_index import EntityIndex, index_of, generation_of
+
+
+class TestEntityIndex:
+    def test_add_returns_dense_indices(self):
+        index = EntityIndex()
+
+        assert index.add('floor') == 0
+        assert index.add('player1') == 1
+        assert index.add('floor') == 0
+        assert index.entity_id(1) == 'player1'
+        assert index.get('player1') == 1
+        assert index.get('nonexistent') is None
+
+    def test_remove_reuses_index_with_new_generation(self):
+        index = EntityIndex()
+        index.add('player1')
+        old_handle = index.handle('player1')
+
+        assert index.remove('player1') == 0
+        assert 'player1' not in index
+        with pytest.raises(KeyError):
+            index.entity_id(0)
+
+        assert index.add('player2') == 0
+        new_handle = index.handle('player2')
+        assert index_of(new_handle) == index_of(old_handle)
+        assert generation_of(new_handle) == generation_of(old_handle) + 1
+        assert index.is_alive(new_handle)
+        assert not index.is_alive(old_handle)
+
+    def test_remove_nonexistent(self):
+        index = EntityIndex()
+
+        assert index.remove('nonexistent') is None
@@ -0,0 +1,90 @@
+from typing import Callable, Dict, Tuple, Union
+from time import monotonic
+import client_interfaces as ci
+from constants import INPUT_RATE_LIMIT, INPUT_BURST
+
+
+class CommandQueue:
+    """Inputs of the players of one room, buffered until the room's next tick.
+
+    Inputs are kept as CompactInput. Inputs of a player collapse into one: its keys down and
+    sequence number are the ones of the latest input, while keys pressed and released add up so
+    that short presses (e.g. releasing ENTER) are not lost.
+    Each player may push `rate` inputs per second with bursts of up to `burst`, further ones are
+    dropped except for their key releases, so that keys do not stay down until the next accepted input.
+    Compact inputs with a sequence number not above the last one seen of their player are stale (e.g.
+    replayed) and dropped; JSON inputs have sequence number 0 and are never stale.
+    """
+
+    def __init__(self, rate: float = INPUT_RATE_LIMIT, burst: float = INPUT_BURST,
+                 clock: Callable[[], float] = monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.pending: Dict[str, ci.CompactInput] = {}
+        self.dropped = 0
+        self.stale = 0
+        self._clock = clock
+        # highest sequence number seen, per player
+        self._last_seq: Dict[str, int] = {}
+        # tokens left and when they were counted, per player
+        self._allowance: Dict[str, Tuple[float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def push(self, sid: str, data: Union[ci.CompactInput, ci.InputDTO]) -> bool:
+        """Buffer input of player sid, return whether it was accepted"""
+
+        if isinstance(data, ci.InputDTO):
+            data = ci.CompactInput.from_dto(data)
+        elif data.seq:
+            if data.seq <= self._last_seq.get(sid, 0):
+                self.stale += 1
+                return False
+            self._last_seq[sid] = data.seq
+        if not self._allow(sid):
+            self.dropped += 1
+            if data.released:
+                self._release(sid, data)
+            return False
+        pending = self.pending.get(sid)
+        if pending is None or not (pending.pressed or pending.released):
+            self.pending[sid] = data
+        else:
+            self.pending[sid] = ci.CompactInput(
+                data.seq, data.down, pending.pressed | data.pressed, pending.released | data.released)
+        return True
+
+    def take(self) -> Dict[str, ci.CompactInput]:
+        """Return collapsed input of every player that sent one since the last call"""
+
+        pending = self.pending
+        self.pending = {}
+        return pending
+
+    def forget(self, sid: str):
+        self.pending.pop(sid, None)
+        self._allowance.pop(sid, None)
+        self._last_seq.pop(sid, None)
+
+    def _release(self, sid: str, data: ci.CompactInput):
+        """Merge the key releases of dropped input data into the pending input of player sid"""
+
+        pending = self.pending.get(sid)
+        if pending is None:
+            # keys held before data, as its presses are dropped
+            self.pending[sid] = ci.CompactInput(data.seq, data.down & ~data.pressed, 0, data.released)
+        else:
+            self.pending[sid] = pending._replace(
+                down=pending.down & ~data.released, released=pending.released | data.released)
+
+    def _allow(self, sid: str) -> bool:
+        now = self._clock()
+        tokens, counted = self._allowance.get(sid, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - counted) * self.rate)
+        if tokens < 1:
+            self._allowance[sid] = (tokens, now)
+            return False
+        self._allowance[sid] = (tokens - 1, now)
+        return True
+
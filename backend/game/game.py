@@ -1,22 +1,48 @@
 import logging
-from typing import List, Dict, Type, Set, Callable
-from ecs.base_system import System, ExternalEvent
+from time import perf_counter
+from typing import Iterable, Iterator, List, Dict, Type, Callable, Optional, Union
+from ecs.base_system import System, ExternalEvent, dispatch_table
 from ecs.context import Context
+from ecs.base_component import Sync
 import client_interfaces as ci
 import server_interfaces as si
 from systems.dependency_graph import resolve_dependency_order
 from repository import repository_factory
 import serializer
+from components import Box2DWorld, LONG_SYNC_COMPONENTS, SHORT_SYNC_COMPONENTS
+from interest import InterestManager
+from metrics import Metrics, Sample
+from server.scheduler import Tick
+from .commands import CommandQueue
 from .exc import GameError
 
 
 class Game:
-    def __init__(self, systems_classes: List[Type[System]], repository_factory: Callable = repository_factory):
+    def __init__(
+            self,
+            systems_classes: List[Type[System]],
+            repository_factory: Callable = repository_factory,
+            context_class: Optional[Type[Context]] = None,
+            short_sync_encoder: Optional[Callable[[], serializer.ShortSyncEncoder]] = None,
+            interest_manager: Optional[Callable[[Context], InterestManager]] = None,
+            metrics: Optional[Metrics] = None):
         self.systems: Dict[str, List[System]] = {}
+        self.handlers: Dict[str, Dict[ExternalEvent, List[Callable]]] = {}
+        self.commands: Dict[str, CommandQueue] = {}
         self.contexts: Dict[str, Context] = {}
         self.rooms: Dict[str, si.RoomMeta] = {}
+        # room of every player, the players of a room are in its RoomMeta
+        self.player_rooms: Dict[str, str] = {}
+        self.short_sync_encoders: Dict[str, serializer.ShortSyncEncoder] = {}
+        self.interest_managers: Dict[str, InterestManager] = {}
         self._systems_classes = resolve_dependency_order(systems_classes)
         self._repository_factory = repository_factory
+        self._context_class = context_class
+        self._short_sync_encoder = short_sync_encoder
+        self._interest_manager = interest_manager
+        self.metrics = metrics
+        if metrics:
+            metrics.add_collector(self._collect_metrics)
 
     def join_room(
             self,
@@ -35,32 +61,54 @@ class Game:
             raise GameError('You are already in a room', 400)
 
         room.players.append(sid)
+        self.player_rooms[sid] = room.id
         logging.info(f'{sid} joined {room.id}')
         callback_enter_room(room.id)
+        # inputs sent before the join apply before it
+        self.apply_commands(room.id)
         self.trigger_event(ExternalEvent.PLAYER_JOIN, room.id, sid)
         self.sync_full(room.id, sid, callback_emit)
+        if room.id in self.short_sync_encoders:
+            self.short_sync_encoders[room.id].request_keyframe()
+        if room.id in self.interest_managers:
+            self.interest_managers[room.id].add_client(sid)
 
         return si.JoinRoomDTO(room=room)
 
     def leave_room(self, sid: str, room_id: str):
         room = self.rooms.get(room_id)
         if room and sid in room.players:
+            self.commands[room_id].forget(sid)
+            self.apply_commands(room_id)
             self.trigger_event(ExternalEvent.PLAYER_LEAVE, room_id, sid)
             room.players.remove(sid)
+            del self.player_rooms[sid]
             self.contexts[room_id].remove_entity(sid)
+            if room_id in self.interest_managers:
+                self.interest_managers[room_id].remove_client(sid)
             logging.info(f'{sid} left room {room_id}')
 
+    def room_of(self, sid: str) -> Optional[str]:
+        """Return id of the room player sid is in, None if not in a room"""
+        return self.player_rooms.get(sid)
+
     def get_rooms(self) -> si.GetRoomsDTO:
         rooms = [room for room in self.rooms.values() if not room.private]
         response = si.GetRoomsDTO(rooms=rooms)
         return response
 
-    def create_room(self, sid: str, data: ci.CreateRoomDTO, callback_enter_room: Callable) -> si.CreateRoomDTO:
+    def create_room(
+            self,
+            sid: str,
+            data: ci.CreateRoomDTO,
+            callback_enter_room: Callable,
+            room_id: Optional[str] = None) -> si.CreateRoomDTO:
         if self._is_in_a_room(sid):
             raise GameError('You are already in a room')
 
-        room = self._create_room(data)
+        room = self._create_room(data, room_id)
         room.players = [sid]
+        self.player_rooms[sid] = room.id
 
         callback_enter_room(room.id)
         self.trigger_event(ExternalEvent.GAME_INIT, room.id, room)
@@ -68,51 +116,151 @@ class Game:
 
         return si.CreateRoomDTO(room=room)
 
-    def _create_room(self, data: ci.CreateRoomDTO) -> si.RoomMeta:
-        room = si.RoomMeta(id=self._new_id(), players=[], max_players=4, level='beach', **data.__dict__)
-        context = Context(repository=self._repository_factory())
+    def _create_room(self, data: ci.CreateRoomDTO, room_id: Optional[str] = None) -> si.RoomMeta:
+        room = si.RoomMeta(id=room_id or self._new_id(), players=[], max_players=4, level='beach', **data.__dict__)
+        context_class = self._context_class or Context
+        context = context_class(repository=self._repository_factory(), default_consumer=False)
+        context.add_consumer(Sync.SHORT)
+        context.add_consumer(Sync.LONG)
 
         self.rooms[room.id] = room
         self.contexts[room.id] = context
         self.systems[room.id] = [cls(context) for cls in self._systems_classes]
+        self.handlers[room.id] = dispatch_table(self.systems[room.id])
+        self.commands[room.id] = CommandQueue()
+        if self._short_sync_encoder:
+            self.short_sync_encoders[room.id] = self._short_sync_encoder()
+        if self._interest_manager:
+            self.interest_managers[room.id] = self._interest_manager(context)
         logging.info('created room')
         return room
 
-    def input(self, sid: str, room_id: str, data: ci.InputDTO):
-        self.trigger_event(ExternalEvent.INPUT, room_id, sid, data)
+    def input(self, sid: str, room_id: str, data: Union[ci.CompactInput, ci.InputDTO]):
+        """Buffer input until the next tick of the room"""
+        self.commands[room_id].push(sid, data)
+
+    def apply_commands(self, room_id: str):
+        """Pass buffered inputs to the systems of the room, one per player"""
+        handlers = self.handlers[room_id][ExternalEvent.INPUT]
+        commands = self.commands[room_id].take()
+        measured = bool(commands) and self._sample()
+        for sid, data in commands.items():
+            if self.player_rooms.get(sid) != room_id:
+                # left the room after sending it
+                continue
+            if measured:
+                self._call_measured(room_id, ExternalEvent.INPUT, handlers, sid, data)
+                continue
+            for handler in handlers:
+                handler(sid, data)
 
     def trigger_event(self, event: ExternalEvent, room_id: str, *args, **kwargs):
-        method_name = f'on_{event.value}'
-        for system in self.systems[room_id]:
-            try:
-                getattr(system, method_name)(*args, **kwargs)
-            except NotImplementedError:
-                pass
+        handlers = self.handlers[room_id][event]
+        if self._sample():
+            self._call_measured(room_id, event, handlers, *args, **kwargs)
+            return
+        for handler in handlers:
+            handler(*args, **kwargs)
 
     def update_short(self, dt: float, callback_emit: Callable, sort: bool = False):
-        for room_id, context in self.contexts.items():
-            self.trigger_event(ExternalEvent.UPDATE_FRAME, room_id, dt)
-
-            updates = serializer.create_short_sync(context, sort)
-            callback_emit(updates, room_id)
+        for room_id in self.contexts:
+            self.update_room_short(room_id, dt, callback_emit, sort)
 
     def update_long(self, callback_emit: Callable, sort: bool = False):
-        for room_id, context in self.contexts.items():
-            self.trigger_event(ExternalEvent.UPDATE, room_id)
+        for room_id in self.contexts:
+            self.update_room_long(room_id, callback_emit, sort)
+
+    def update_rooms(self, ticks: Iterable[Tick], callback_short: Callable, callback_long: Callable,
+                     sort: bool = False):
+        """Update rooms of due ticks in turn"""
+
+        for tick in ticks:
+            if tick.long:
+                self.update_room_long(tick.room_id, callback_long, sort)
+            else:
+                self.update_room_short(tick.room_id, tick.dt, callback_short, sort)
+
+    def update_room_short(self, room_id: str, dt: float, callback_emit: Callable, sort: bool = False):
+        context = self.contexts[room_id]
+        self.apply_commands(room_id)
+        self.trigger_event(ExternalEvent.UPDATE_FRAME, room_id, dt)
+
+        measured = self._sample()
+        dirty = self._dirty_count(context, Sync.SHORT) if measured else 0
+        start = perf_counter()
+        interest = self.interest_managers.get(room_id)
+        if interest:
+            # each client gets the part of the room around its player
+            syncs = interest.encode(self.rooms[room_id].players, sort, consumer=Sync.SHORT)
+            if measured:
+                self._observe_sync(room_id, 'short', start, dirty, syncs.values())
+            for sid, updates in syncs.items():
+                callback_emit(updates, room_id, sid)
+            return
+
+        encoder = self.short_sync_encoders.get(room_id)
+        if encoder:
+            updates = encoder.encode(context, sort, consumer=Sync.SHORT)
+        else:
+            updates = serializer.create_short_sync(context, sort, consumer=Sync.SHORT)
+        if measured:
+            self._observe_sync(room_id, 'short', start, dirty, [updates])
+        callback_emit(updates, room_id)
+
+    def update_room_long(self, room_id: str, callback_emit: Callable, sort: bool = False):
+        context = self.contexts[room_id]
+        self.apply_commands(room_id)
+        self.trigger_event(ExternalEvent.UPDATE, room_id)
 
-            updates = serializer.create_long_sync(context, sort)
-            callback_emit(updates, room_id)
+        measured = self._sample()
+        dirty = self._dirty_count(context, Sync.LONG) if measured else 0
+        start = perf_counter()
+        updates = serializer.create_long_sync(context, sort, consumer=Sync.LONG)
+        if measured:
+            self._observe_sync(room_id, 'long', start, dirty, [updates])
+        callback_emit(updates, room_id)
 
     def sync_full(self, room_id: str, sid: str, callback_emit: Callable, sort: bool = False):
         context = self.contexts[room_id]
         updates = serializer.create_full_sync(context, sort)
         callback_emit(updates, room_id)
 
-    def _get_players(self) -> Set[str]:
-        return set(player_id for room in self.rooms.values() for player_id in room.players)
+    def _sample(self) -> bool:
+        return self.metrics is not None and self.metrics.sample()
+
+    def _call_measured(self, room_id: str, event: ExternalEvent, handlers: List[Callable], *args, **kwargs):
+        for handler in handlers:
+            start = perf_counter()
+            handler(*args, **kwargs)
+            system = type(getattr(handler, '__self__', handler)).__name__
+            self.metrics.observe(  # type: ignore
+                'game_event_seconds', perf_counter() - start, room=room_id, system=system, event=event.value)
+
+    def _dirty_count(self, context: Context, sync: Sync) -> int:
+        components = SHORT_SYNC_COMPONENTS if sync == Sync.SHORT else LONG_SYNC_COMPONENTS
+        return len(context.get_updated_entities_for(*components, reset=False, consumer=sync))
+
+    def _observe_sync(self, room_id: str, sync: str, start: float, dirty: int, syncs: Iterable):
+        metrics: Metrics = self.metrics  # type: ignore
+        metrics.observe('sync_create_seconds', perf_counter() - start, room=room_id, sync=sync)
+        metrics.observe('sync_dirty_entities', dirty, room=room_id, sync=sync)
+        for updates in syncs:
+            metrics.observe('sync_entities', len(updates.updates), room=room_id, sync=sync)
+
+    def _collect_metrics(self) -> Iterator[Sample]:
+        for room_id, context in self.contexts.items():
+            labels = {'room': room_id}
+            yield 'room_players', labels, len(self.rooms[room_id].players)
+            yield 'room_entities', labels, context.index.live()
+            if Box2DWorld.component_name in context.repository:
+                world = context.get_many([Box2DWorld.component_name], Box2DWorld)[0]
+                if world:
+                    velocity_iterations, position_iterations = world.iterations
+                    yield 'box2d_velocity_iterations', labels, velocity_iterations
+                    yield 'box2d_position_iterations', labels, position_iterations
 
     def _new_id(self) -> str:
         return f'room{len(self.rooms.values())}'
 
-    def _is_in_a_room(self, sid: str):
-        return sid in self._get_players()
+    def _is_in_a_room(self, sid: str) -> bool:
+        return sid in self.player_rooms
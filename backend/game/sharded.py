@@ -0,0 +1,409 @@
+import logging
+import multiprocessing
+import threading
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NoReturn, Optional, Set, Tuple, Union
+from multiprocessing.connection import Connection
+from eventlet.hubs import trampoline
+from eventlet.semaphore import Semaphore
+from ecs.base_system import ExternalEvent
+import client_interfaces as ci
+import server_interfaces as si
+from server.custom_json import COMPACT_SEPARATORS, RawJSON, dumps
+from server.scheduler import Tick
+from metrics import Metrics, Snapshot
+from .exc import GameError
+from .game import Game
+
+LOAD_SMOOTHING = 0.1
+
+# payload, room id and sid of the only client it is for, if any
+Payloads = List[Tuple[str, str, Optional[str]]]
+
+
+class ShardWorker:
+    """Runs a Game in a shard process. Sync payloads are encoded here, so the front process only relays them."""
+
+    def __init__(self, game: Game):
+        self.game = game
+
+    def create_room(self, sid: str, data: ci.CreateRoomDTO, room_id: str) -> si.CreateRoomDTO:
+        return self.game.create_room(sid, data, _ignore, room_id)
+
+    def create_debug_room(self, data: ci.CreateRoomDTO, room_id: str) -> si.RoomMeta:
+        return self.game._create_room(data, room_id)
+
+    def join_room(self, sid: str, data: ci.JoinRoomDTO) -> Tuple[si.JoinRoomDTO, Payloads]:
+        payloads: Payloads = []
+        response = self.game.join_room(sid, data, _ignore, _collect(payloads))
+        return response, payloads
+
+    def leave_room(self, sid: str, room_id: str):
+        self.game.leave_room(sid, room_id)
+
+    def input(self, sid: str, room_id: str, data: Union[ci.CompactInput, ci.InputDTO]):
+        self.game.input(sid, room_id, data)
+
+    def trigger_event(self, event: ExternalEvent, room_id: str, *args, **kwargs):
+        self.game.trigger_event(event, room_id, *args, **kwargs)
+
+    def update_short(self, dt: float, sort: bool) -> Tuple[Payloads, float]:
+        payloads: Payloads = []
+        start = perf_counter()
+        self.game.update_short(dt, _collect(payloads), sort)
+        return payloads, perf_counter() - start
+
+    def update_long(self, sort: bool) -> Tuple[Payloads, float]:
+        payloads: Payloads = []
+        start = perf_counter()
+        self.game.update_long(_collect(payloads), sort)
+        return payloads, perf_counter() - start
+
+    def update_room_short(self, room_id: str, dt: float, sort: bool) -> Tuple[Payloads, float]:
+        payloads: Payloads = []
+        start = perf_counter()
+        self.game.update_room_short(room_id, dt, _collect(payloads), sort)
+        return payloads, perf_counter() - start
+
+    def update_room_long(self, room_id: str, sort: bool) -> Tuple[Payloads, float]:
+        payloads: Payloads = []
+        start = perf_counter()
+        self.game.update_room_long(room_id, _collect(payloads), sort)
+        return payloads, perf_counter() - start
+
+    def update_rooms(self, ticks: List[Tick], sort: bool) -> Tuple[List[Payloads], float]:
+        """Update rooms of due ticks in turn and return the payloads of each tick"""
+
+        tick_payloads: List[Payloads] = []
+        start = perf_counter()
+        for tick in ticks:
+            payloads: Payloads = []
+            if tick.long:
+                self.game.update_room_long(tick.room_id, _collect(payloads), sort)
+            else:
+                self.game.update_room_short(tick.room_id, tick.dt, _collect(payloads), sort)
+            tick_payloads.append(payloads)
+        return tick_payloads, perf_counter() - start
+
+    def sync_full(self, room_id: str, sid: str, sort: bool) -> Payloads:
+        payloads: Payloads = []
+        self.game.sync_full(room_id, sid, _collect(payloads), sort)
+        return payloads
+
+    def metrics(self) -> Optional[Snapshot]:
+        metrics = self.game.metrics
+        return metrics.snapshot() if metrics else None
+
+
+def _ignore(*args):
+    pass
+
+
+def _collect(payloads: Payloads) -> Callable:
+    def callback(updates, room_id: str, sid: Optional[str] = None):
+        payloads.append((dumps(updates, separators=COMPACT_SEPARATORS), room_id, sid))
+    return callback
+
+
+def run_shard(connection: Connection, game_factory: Callable[[], Game]):
+    """Serve requests of the front process until it closes the connection"""
+
+    worker = ShardWorker(game_factory())
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        reply, method, args = message
+        try:
+            result: Tuple = ('ok', getattr(worker, method)(*args))
+        except GameError as err:
+            result = ('error', err.message, err.code)
+        except Exception as err:
+            logging.error(err, exc_info=True)
+            result = ('error', str(err), 500)
+        if reply:
+            connection.send(result)
+        elif result[0] == 'error':
+            logging.error(f'{method} failed in shard: {result[1]}')
+
+
+class Shard:
+    """Front process end of a shard process.
+
+    A green shard waits for replies in the eventlet hub, so other greenthreads run while the shard
+    works, and its lock is a green one. When the pipe to the shard process breaks, e.g. because the
+    process died, the shard is marked not alive, on_lost is called with it and GameError raised.
+    """
+
+    def __init__(self, mp_context, game_factory: Callable[[], Game], green: bool = False,
+                 on_lost: Callable[['Shard'], None] = lambda shard: None):
+        self.connection, child_connection = mp_context.Pipe()
+        self.process = mp_context.Process(target=run_shard, args=(child_connection, game_factory), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.room_ids: Set[str] = set()
+        self.load = 0.0
+        self.green = green
+        self.alive = True
+        self.lock: Any = Semaphore() if green else threading.Lock()
+        self._on_lost = on_lost
+
+    def call(self, method: str, *args) -> Any:
+        with self.lock:
+            self.send((True, method, args))
+            return self.receive()
+
+    def notify(self, method: str, *args):
+        with self.lock:
+            self.send((False, method, args))
+
+    def send(self, message: Tuple):
+        try:
+            self.connection.send(message)
+        except OSError as err:
+            self._lost(err)
+
+    def receive(self) -> Any:
+        try:
+            if self.green:
+                trampoline(self.connection.fileno(), read=True)
+            status, *result = self.connection.recv()
+        except (EOFError, OSError) as err:
+            self._lost(err)
+        if status == 'error':
+            raise GameError(*result)
+        return result[0]
+
+    def add_load(self, seconds: float):
+        self.load += LOAD_SMOOTHING * (seconds - self.load)
+
+    def close(self):
+        with self.lock:
+            if self.alive:
+                try:
+                    self.connection.send(None)
+                except OSError:
+                    self.alive = False
+        if not self.alive:
+            self.process.kill()
+        self.process.join()
+
+    def _lost(self, err: BaseException) -> NoReturn:
+        if self.alive:
+            self.alive = False
+            logging.error(f'lost game shard process {self.process.pid}: {err!r}')
+            self._on_lost(self)
+        raise GameError('Game shard is gone', 503)
+
+
+class ShardedGame:
+    """Game spreading its rooms over worker processes, each running its own Game.
+
+    Offers the Game interface the server uses. Requests are forwarded to the shard owning the
+    room and sync payloads the shards encoded are passed to callbacks as RawJSON. New rooms go
+    to the shard with the lowest recent update time. Servers running on eventlet pass green=True
+    so that waiting for a shard does not block the hub. Metrics the games of the shards record are
+    fetched from them when `metrics` renders. When the process of a shard is lost, its rooms and
+    their players are dropped and the other shards keep running.
+    """
+
+    def __init__(self, game_factory: Callable[[], Game], shards: int, start_method: str = 'spawn',
+                 green: bool = False, metrics: Optional[Metrics] = None):
+        if shards < 1:
+            raise ValueError('At least one shard is needed')
+        mp_context = multiprocessing.get_context(start_method)
+        self.rooms: Dict[str, si.RoomMeta] = {}
+        self.player_rooms: Dict[str, str] = {}
+        self._lost_shards: List[Shard] = []
+        self._shards = [Shard(mp_context, game_factory, green, self._forget_shard) for _ in range(shards)]
+        self._room_shards: Dict[str, Shard] = {}
+        self._room_count = 0
+        if metrics:
+            metrics.add_source(self._collect_metrics)
+
+    def close(self):
+        for shard in self._shards + self._lost_shards:
+            shard.close()
+
+    def join_room(
+            self,
+            sid: str,
+            data: ci.JoinRoomDTO,
+            callback_enter_room: Callable,
+            callback_emit: Callable) -> si.JoinRoomDTO:
+        shard = self._room_shards.get(data.room_id)
+        if not shard:
+            raise GameError('Room does not exist', 404)
+        elif self._is_in_a_room(sid) and sid not in self.rooms[data.room_id].players:
+            raise GameError('You are already in a room', 400)
+
+        response, payloads = shard.call('join_room', sid, data)
+        self.rooms[response.room.id] = response.room
+        self.player_rooms[sid] = response.room.id
+        callback_enter_room(response.room.id)
+        self._emit(payloads, callback_emit)
+        return response
+
+    def leave_room(self, sid: str, room_id: str):
+        room = self.rooms.get(room_id)
+        if room and sid in room.players:
+            room.players.remove(sid)
+            del self.player_rooms[sid]
+            self._room_shards[room_id].notify('leave_room', sid, room_id)
+
+    def room_of(self, sid: str) -> Optional[str]:
+        return self.player_rooms.get(sid)
+
+    def get_rooms(self) -> si.GetRoomsDTO:
+        rooms = [room for room in self.rooms.values() if not room.private]
+        return si.GetRoomsDTO(rooms=rooms)
+
+    def create_room(self, sid: str, data: ci.CreateRoomDTO, callback_enter_room: Callable) -> si.CreateRoomDTO:
+        if self._is_in_a_room(sid):
+            raise GameError('You are already in a room')
+
+        shard = self._place_room()
+        response = shard.call('create_room', sid, data, self._new_id())
+        self._add_room(response.room, shard)
+        self.player_rooms[sid] = response.room.id
+        callback_enter_room(response.room.id)
+        return response
+
+    def _create_room(self, data: ci.CreateRoomDTO, room_id: Optional[str] = None) -> si.RoomMeta:
+        shard = self._place_room()
+        room = shard.call('create_debug_room', data, room_id or self._new_id())
+        self._add_room(room, shard)
+        return room
+
+    def input(self, sid: str, room_id: str, data: Union[ci.CompactInput, ci.InputDTO]):
+        self._room_shards[room_id].notify('input', sid, room_id, data)
+
+    def trigger_event(self, event: ExternalEvent, room_id: str, *args, **kwargs):
+        if kwargs:
+            raise TypeError('Events forwarded to shards take positional arguments only')
+        self._room_shards[room_id].call('trigger_event', event, room_id, *args)
+
+    def update_short(self, dt: float, callback_emit: Callable, sort: bool = False):
+        self._update_all(callback_emit, 'update_short', dt, sort)
+
+    def update_long(self, callback_emit: Callable, sort: bool = False):
+        self._update_all(callback_emit, 'update_long', sort)
+
+    def update_rooms(self, ticks: Iterable[Tick], callback_short: Callable, callback_long: Callable,
+                     sort: bool = False):
+        """Update rooms of due ticks, all shards in parallel"""
+
+        shard_ticks: Dict[Shard, List[Tick]] = {}
+        for tick in ticks:
+            shard = self._room_shards.get(tick.room_id)
+            if shard:
+                # rooms of lost shards are gone
+                shard_ticks.setdefault(shard, []).append(tick)
+        results = self._call_in_parallel('update_rooms', {shard: (ticks, sort) for shard, ticks in shard_ticks.items()})
+        for shard, tick_payloads in results:
+            for tick, payloads in zip(shard_ticks[shard], tick_payloads):
+                self._emit(payloads, callback_long if tick.long else callback_short)
+
+    def update_room_short(self, room_id: str, dt: float, callback_emit: Callable, sort: bool = False):
+        self._update_room(room_id, callback_emit, 'update_room_short', room_id, dt, sort)
+
+    def update_room_long(self, room_id: str, callback_emit: Callable, sort: bool = False):
+        self._update_room(room_id, callback_emit, 'update_room_long', room_id, sort)
+
+    def sync_full(self, room_id: str, sid: str, callback_emit: Callable, sort: bool = False):
+        payloads = self._room_shards[room_id].call('sync_full', room_id, sid, sort)
+        self._emit(payloads, callback_emit)
+
+    def _update_all(self, callback_emit: Callable, method: str, *args):
+        shards = [shard for shard in self._shards if shard.room_ids]
+        for _, payloads in self._call_in_parallel(method, {shard: args for shard in shards}):
+            self._emit(payloads, callback_emit)
+
+    def _call_in_parallel(self, method: str, shard_args: Dict[Shard, Tuple]) -> List[Tuple[Shard, Any]]:
+        """Send method to every given shard before waiting for any, and return results of the ones that succeeded.
+
+        The method returns its result along with the seconds it took, which are added to the load of the shard.
+        """
+
+        # locks are taken in the same order by every caller
+        shards = [shard for shard in self._shards if shard in shard_args]
+        results = []
+        for shard in shards:
+            shard.lock.acquire()
+        try:
+            sent = []
+            for shard in shards:
+                try:
+                    shard.send((True, method, shard_args[shard]))
+                except GameError:
+                    continue
+                sent.append(shard)
+            for shard in sent:
+                try:
+                    result, seconds = shard.receive()
+                except GameError as err:
+                    logging.error(f'{method} failed in shard: {err}')
+                    continue
+                shard.add_load(seconds)
+                results.append((shard, result))
+        finally:
+            for shard in shards:
+                shard.lock.release()
+        return results
+
+    def _update_room(self, room_id: str, callback_emit: Callable, method: str, *args):
+        shard = self._room_shards[room_id]
+        payloads, seconds = shard.call(method, *args)
+        shard.add_load(seconds)
+        self._emit(payloads, callback_emit)
+
+    def _emit(self, payloads: Payloads, callback_emit: Callable):
+        for payload, room_id, sid in payloads:
+            if sid is None:
+                callback_emit(RawJSON(payload), room_id)
+            else:
+                callback_emit(RawJSON(payload), room_id, sid)
+
+    def _forget_shard(self, shard: Shard):
+        """Drop a shard whose process is gone, along with its rooms and their players"""
+
+        logging.error(f'dropping rooms {sorted(shard.room_ids)} of lost game shard')
+        self._shards.remove(shard)
+        self._lost_shards.append(shard)
+        for room_id in shard.room_ids:
+            del self._room_shards[room_id]
+            room = self.rooms.pop(room_id, None)
+            for sid in room.players if room else ():
+                self.player_rooms.pop(sid, None)
+        shard.room_ids.clear()
+
+    def _collect_metrics(self) -> Iterator[Snapshot]:
+        for shard in list(self._shards):
+            try:
+                snapshot = shard.call('metrics')
+            except GameError:
+                continue
+            if snapshot is not None:
+                yield snapshot
+
+    def _place_room(self) -> Shard:
+        if not self._shards:
+            raise GameError('No game shard is left', 503)
+        return min(self._shards, key=lambda shard: (shard.load, len(shard.room_ids)))
+
+    def _add_room(self, room: si.RoomMeta, shard: Shard):
+        self.rooms[room.id] = room
+        self._room_shards[room.id] = shard
+        shard.room_ids.add(room.id)
+
+    def _new_id(self) -> str:
+        room_id = f'room{self._room_count}'
+        self._room_count += 1
+        return room_id
+
+    def _is_in_a_room(self, sid: str) -> bool:
+        return sid in self.player_rooms
@@ -0,0 +1,84 @@
+import client_interfaces as ci
+from constants import InputKey
+from game.commands import CommandQueue
+
+LEFT, RIGHT, UP, ENTER = InputKey.LEFT, InputKey.RIGHT, InputKey.UP, InputKey.ENTER
+
+
+def keys(down, pressed=0, released=0, seq=0):
+    return ci.CompactInput(seq, down, pressed, released)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCommandQueue:
+    def test_inputs_of_a_player_collapse(self):
+        queue = CommandQueue()
+        queue.push('a', keys(LEFT, pressed=LEFT, seq=1))
+        queue.push('a', keys(0, released=LEFT, seq=2))
+        queue.push('a', keys(UP, pressed=UP, released=ENTER, seq=3))
+        queue.push('b', keys(RIGHT))
+
+        assert queue.take() == {
+            'a': keys(UP, pressed=LEFT | UP, released=LEFT | ENTER, seq=3),
+            'b': keys(RIGHT),
+        }
+        assert queue.take() == {}
+
+    def test_json_inputs_are_converted(self):
+        queue = CommandQueue()
+        queue.push('a', ci.InputDTO(keys_down=['ArrowLeft', 'ArrowUp'], keys_pressed=None, keys_released=['Enter']))
+
+        assert queue.take() == {'a': keys(LEFT | UP, released=ENTER)}
+
+    def test_floods_are_dropped(self):
+        clock = FakeClock()
+        queue = CommandQueue(rate=10, burst=3, clock=clock)
+
+        assert [queue.push('a', keys(0)) for _ in range(4)] == [True, True, True, False]
+        assert queue.push('b', keys(0))
+        clock.now = 0.1
+        assert queue.push('a', keys(UP))
+        assert not queue.push('a', keys(0))
+        assert queue.dropped == 2
+        assert queue.take()['a'] == keys(UP)
+
+    def test_releases_of_dropped_inputs_are_kept(self):
+        queue = CommandQueue(rate=10, burst=1, clock=FakeClock())
+        assert queue.push('a', keys(LEFT | UP, pressed=LEFT | UP))
+        assert not queue.push('a', keys(UP | RIGHT, pressed=RIGHT, released=LEFT))
+        assert queue.take()['a'] == keys(UP, pressed=LEFT | UP, released=LEFT)
+
+        assert not queue.push('a', keys(ENTER, pressed=ENTER, released=UP, seq=2))
+        assert queue.take() == {'a': keys(0, released=UP, seq=2)}
+        assert queue.dropped == 2
+
+    def test_stale_inputs_are_dropped(self):
+        queue = CommandQueue()
+        assert queue.push('a', keys(LEFT, pressed=LEFT, seq=2))
+        assert not queue.push('a', keys(0, released=LEFT, seq=1))
+        assert not queue.push('a', keys(0, released=LEFT, seq=2))
+        assert queue.push('b', keys(UP, seq=1))
+        assert queue.push('a', keys(0, seq=0))
+        assert queue.push('a', keys(0, seq=0))
+
+        assert queue.stale == 2
+        assert queue.take()['a'] == keys(0, pressed=LEFT)
+
+    def test_forget(self):
+        queue = CommandQueue(rate=10, burst=1)
+        queue.push('a', keys(0))
+        queue.forget('a')
+
+        assert len(queue) == 0
+        assert queue.push('a', keys(0))
+        queue.forget('a')
+        assert queue.push('a', keys(0, seq=1))
+        queue.forget('a')
+        assert queue.push('a', keys(0, seq=1))
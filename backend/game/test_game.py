@@ -1,9 +1,15 @@
 import pytest
-from unittest.mock import Mock, patch
+from Box2D import b2Vec2
+from unittest.mock import Mock, call, patch
 from game.exc import GameError
 from game.game import Game
-from ecs.base_system import ExternalEvent
-from components import Position, Box2DBody
+from ecs.base_system import ExternalEvent, System
+from ecs.base_component import Sync
+from components import Position, Box2DBody, SpatialIndex
+from serializer import ShortSyncEncoder
+from systems import SYSTEMS
+from constants import InputKey
+from interest import InterestManager
 import server_interfaces as si
 import client_interfaces as ci
 
@@ -39,7 +45,7 @@ class TestGame:
             game.create_room(self.sid, ci.CreateRoomDTO('my room', private=False), Mock())
 
         mock_repository_factory.assert_called_with()
-        mock_context.assert_called_with(repository=mock_repository_factory.return_value)
+        mock_context.assert_called_with(repository=mock_repository_factory.return_value, default_consumer=False)
         mock_system.assert_called_with(mock_context.return_value)
 
     def test_create_room_calls_callback(self):
@@ -92,6 +98,47 @@ class TestGame:
         with pytest.raises(GameError, match='You are already in a room'):
             game.join_room(self.sid, ci.JoinRoomDTO(room_id=room_id), Mock(), Mock())
 
+    def test_room_of_players(self):
+        game = Game([])
+        room_id = game.create_room('player1', ci.CreateRoomDTO(name='my room', private=False), Mock()).room.id
+        game.join_room('player2', ci.JoinRoomDTO(room_id), Mock(), Mock())
+        assert game.room_of('player1') == game.room_of('player2') == room_id
+
+        game.leave_room('player2', room_id)
+        assert game.room_of('player2') is None
+        game.create_room('player2', ci.CreateRoomDTO(name='my room 2', private=False), Mock())
+        assert game.room_of('player2') == 'room1'
+
+    def test_inputs_apply_once_per_tick(self):
+        mock_system = Mock(spec=['on_input'])
+        game = Game([mock_system])
+        room_id = game.create_room(self.sid, ci.CreateRoomDTO(name='my room', private=False), Mock()).room.id
+        on_input = mock_system.return_value.on_input
+
+        game.input(self.sid, room_id, ci.InputDTO(['ArrowLeft'], None, None))
+        game.input(self.sid, room_id, ci.InputDTO([], None, ['Enter']))
+        on_input.assert_not_called()
+
+        game.update_room_short(room_id, 1, Mock())
+        on_input.assert_called_once_with(self.sid, ci.CompactInput(0, 0, 0, InputKey.ENTER))
+
+    def test_inputs_of_players_that_left_are_dropped(self):
+        mock_system = Mock(spec=['on_input'])
+        game = Game([mock_system])
+        room_id = game.create_room(self.sid, ci.CreateRoomDTO(name='my room', private=False), Mock()).room.id
+        game.join_room('other', ci.JoinRoomDTO(room_id), Mock(), Mock())
+        on_input = mock_system.return_value.on_input
+
+        game.input('other', room_id, ci.InputDTO(['ArrowLeft'], None, None))
+        game.input(self.sid, room_id, ci.InputDTO(['ArrowRight'], None, None))
+        game.leave_room('other', room_id)
+        # inputs sent before a leave apply before it
+        on_input.assert_called_once_with(self.sid, ci.CompactInput(0, InputKey.RIGHT))
+
+        game.input('other', room_id, ci.InputDTO(['ArrowLeft'], None, None))
+        game.update_room_long(room_id, Mock())
+        on_input.assert_called_once()
+
     def test_trigger_event(self):
         mock_system = Mock(spec=['on_update'], name='system')
         game = Game([mock_system], dict)
@@ -114,6 +161,46 @@ class TestGame:
         updates = callback.call_args_list[0][0][0].updates
         assert updates == [si.ShortEntityData(id='0', position=[0.0, 0.0], velocity=None)]
 
+    def test_update_short_with_encoder_sends_keyframe_on_join(self):
+        game = Game([Mock(spec=[])], short_sync_encoder=ShortSyncEncoder)
+        room_id = game.create_room(self.sid, ci.CreateRoomDTO(name='my room 1', private=False), Mock()).room.id
+        game.contexts[room_id].upsert('0', Position.at([0, 0]))
+        game.update_short(1, Mock())
+
+        callback = Mock()
+        game.update_short(1, callback)
+        assert callback.call_args_list[0][0][0].updates == []
+
+        game.join_room('other', ci.JoinRoomDTO(room_id), Mock(), Mock())
+        game.update_short(1, callback)
+        updates = callback.call_args_list[1][0][0].updates
+        assert updates == [si.ShortEntityData(id='0', position=[0.0, 0.0])]
+
+    def test_update_short_with_interest_manager_emits_to_each_player(self):
+        game = Game([Mock(spec=[])], interest_manager=InterestManager)
+        room_id = game.create_room(self.sid, ci.CreateRoomDTO(name='my room 1', private=False), Mock()).room.id
+        game.join_room('other', ci.JoinRoomDTO(room_id), Mock(), Mock())
+        game.contexts[room_id].upsert('0', Position.at([0, 0]))
+
+        callback = Mock()
+        game.update_short(1, callback)
+        dto = si.ShortSyncDTO(updates=[si.ShortEntityData(id='0', position=[0.0, 0.0])], remove=[])
+        assert callback.call_args_list == [call(dto, room_id, self.sid), call(dto, room_id, 'other')]
+
+        game.leave_room('other', room_id)
+        assert list(game.interest_managers[room_id].visible) == [self.sid]
+
+    def test_update_room_short_updates_only_given_room(self):
+        mock_system = Mock(spec=['on_update_frame'])
+        game = Game([mock_system])
+        room_id = game.create_room(self.sid, ci.CreateRoomDTO(name='my room 1', private=False), Mock()).room.id
+        game.create_room('other', ci.CreateRoomDTO(name='my room 2', private=False), Mock())
+        callback = Mock()
+
+        game.update_room_short(room_id, 1, callback)
+        callback.assert_called_once_with(si.ShortSyncDTO(updates=[], remove=[]), room_id)
+        mock_system.return_value.on_update_frame.assert_called_once_with(1)
+
     def test_update_short_does_not_reset_other_components_updates(self):
         body = Mock(awake=True, position=(1, 2), fixtures=[])
         game = Game([Mock(spec=[])])
@@ -122,7 +209,70 @@ class TestGame:
         game.contexts['room0'].upsert('0', Position.at([0, 0]), Box2DBody(body))
 
         game.update_short(1, Mock())
-        assert game.contexts['room0'].get_all_updated_entities() == {'0'}
+        assert game.contexts['room0'].get_all_updated_entities(consumer=Sync.LONG) == {'0'}
+
+    def test_removed_entities_are_dropped_once_both_syncs_read_them(self):
+        game = Game(SYSTEMS)
+        game.create_room(self.sid, ci.CreateRoomDTO(name='my room 1', private=False), Mock())
+        context = game.contexts['room0']
+
+        for i in range(20):
+            game.join_room(f'player{i}', ci.JoinRoomDTO('room0'), Mock(), Mock())
+            game.leave_room(f'player{i}', 'room0')
+        game.update_room_short('room0', 1 / 60, Mock())
+        assert len(context._removed_entities) > 0
+
+        game.update_room_long('room0', Mock())
+        assert len(context._removed_entities) == 0
+
+    def test_spatial_index_follows_moving_and_removed_bodies(self):
+        game = Game(SYSTEMS)
+        game.create_room(self.sid, ci.CreateRoomDTO(name='my room 1', private=False), Mock())
+        game.join_room('player2', ci.JoinRoomDTO('room0'), Mock(), Mock())
+        context = game.contexts['room0']
+        index = context.singleton(SpatialIndex, field='index')
+        game.update_room_short('room0', 1 / 60, Mock())
+
+        body = context.component(self.sid, Box2DBody).body
+        start = tuple(body.position)
+        assert self.sid in index.query_radius(start, 0.1)
+
+        body.position = b2Vec2(start[0] + 3, start[1])
+        context.mark_entity_updated(self.sid, Box2DBody)
+        game.update_room_short('room0', 1 / 60, Mock())
+        assert self.sid not in index.query_radius(start, 0.1)
+        assert self.sid in index.query_radius(tuple(body.position), 0.1)
+
+        game.leave_room(self.sid, 'room0')
+        game.update_room_short('room0', 1 / 60, Mock())
+        assert self.sid not in index
+        assert 'player2' in index
+
+    def test_update_long_includes_updates_sent_in_short_sync(self):
+        game = Game([Mock(spec=[])])
+        game.create_room(self.sid, ci.CreateRoomDTO(name='my room 1', private=False), Mock())
+        callback = Mock()
+
+        game.contexts['room0'].upsert('0', Position.at([0, 0]))
+        game.update_short(1, Mock())
+        game.update_long(callback)
+
+        updates = callback.call_args_list[0][0][0].updates
+        assert [update.id for update in updates] == ['0']
+
+    def test_update_short_and_long_both_include_removed(self):
+        game = Game([Mock(spec=[])])
+        game.create_room(self.sid, ci.CreateRoomDTO(name='my room 1', private=False), Mock())
+        callback_short = Mock()
+        callback_long = Mock()
+
+        game.contexts['room0'].upsert('0', Position.at([0, 0]))
+        game.contexts['room0'].remove_entity('0')
+        game.update_short(1, callback_short)
+        game.update_long(callback_long)
+
+        assert callback_short.call_args_list[0][0][0].remove == ['0']
+        assert callback_long.call_args_list[0][0][0].remove == ['0']
 
     def test_update_long(self):
         body = Mock(awake=True, position=(1, 2), fixtures=[])
@@ -141,3 +291,75 @@ class TestGame:
             velocity=None,
             shape=None
         )]
+
+
+def trigger_event_by_name(systems, event, *args):
+    """Dispatch looking up handlers on every call, kept for comparison"""
+    method_name = f'on_{event.value}'
+    for system in systems:
+        try:
+            getattr(system, method_name)(*args)
+        except NotImplementedError:
+            pass
+
+
+def is_in_a_room_by_scan(game, sid):
+    """Membership check scanning players of every room, kept for comparison"""
+    return sid in set(player_id for room in game.rooms.values() for player_id in room.players)
+
+
+@pytest.mark.benchmark
+class TestGameBenchmark:
+    def test_is_in_a_room(self, measure):
+        game = Game([], dict)
+        for i in range(2500):
+            room_id = game.create_room(f'{i}-0', ci.CreateRoomDTO(name='room', private=False), Mock()).room.id
+            for j in range(1, 4):
+                game.join_room(f'{i}-{j}', ci.JoinRoomDTO(room_id), Mock(), Mock())
+
+        assert is_in_a_room_by_scan(game, '0-0') and game._is_in_a_room('0-0')
+        measure(lambda: is_in_a_room_by_scan(game, 'newcomer'), '10000 players, scan', number=10)
+        measure(lambda: game._is_in_a_room('newcomer'), '10000 players, index', number=10000)
+
+    def test_input_flood(self, measure):
+        """Four players sending five inputs per tick"""
+        game = Game(SYSTEMS)
+        room_id = game.create_room('p0', ci.CreateRoomDTO(name='my room', private=False), Mock()).room.id
+        for i in range(1, 4):
+            game.join_room(f'p{i}', ci.JoinRoomDTO(room_id), Mock(), Mock())
+        game.commands[room_id].rate = game.commands[room_id].burst = float('inf')
+        inputs = [
+            (f'p{i}', ci.CompactInput(0, InputKey.LEFT if frame % 2 else 0))
+            for frame in range(5) for i in range(4)]
+
+        def immediate():
+            for sid, data in inputs:
+                game.trigger_event(ExternalEvent.INPUT, room_id, sid, data)
+
+        def queued():
+            for sid, data in inputs:
+                game.input(sid, room_id, data)
+            game.apply_commands(room_id)
+
+        measure(immediate, 'inputs dispatched on arrival', number=1000)
+        measure(queued, 'inputs queued and collapsed', number=1000)
+
+    def test_trigger_update_frame(self, measure):
+        class Handles(System):
+            def __init__(self, context):
+                pass
+
+            def on_update_frame(self, dt):
+                pass
+
+        class Ignores(System):
+            def __init__(self, context):
+                pass
+
+        game = Game([Handles, Ignores, Ignores, Handles, Ignores], dict)
+        room = game._create_room(ci.CreateRoomDTO(name='my room', private=False))
+        systems = game.systems[room.id]
+
+        measure(lambda: trigger_event_by_name(systems, ExternalEvent.UPDATE_FRAME, 0.1), 'by name', number=10000)
+        measure(lambda: game.trigger_event(ExternalEvent.UPDATE_FRAME, room.id, 0.1), 'dispatch table',
+                number=10000)
@@ -0,0 +1,163 @@
+import json
+import eventlet
+import pytest
+from functools import partial
+from unittest.mock import Mock
+from game.exc import GameError
+from game.game import Game
+from game.sharded import ShardedGame
+from metrics import Metrics
+from repository import repository_factory
+from server.custom_json import RawJSON
+from server.scheduler import Tick
+from systems import SYSTEMS
+import client_interfaces as ci
+
+
+@pytest.fixture(scope='module')
+def game():
+    game = ShardedGame(partial(Game, SYSTEMS, repository_factory), shards=2)
+    yield game
+    game.close()
+
+
+def emitted(callback: Mock):
+    for (payload, room_id), _ in callback.call_args_list:
+        assert isinstance(payload, RawJSON)
+        yield json.loads(payload), room_id
+
+
+class TestShardedGame:
+    def test_rooms_are_spread_over_shards(self, game):
+        room1 = game.create_room('a1', ci.CreateRoomDTO(name='room 1', private=False), Mock()).room
+        room2 = game.create_room('a2', ci.CreateRoomDTO(name='room 2', private=True), Mock()).room
+
+        assert room1.id != room2.id
+        assert game._room_shards[room1.id] is not game._room_shards[room2.id]
+        assert [room.id for room in game.get_rooms().rooms] == [room1.id]
+
+    def test_join_room_relays_full_sync(self, game):
+        room_id = game.create_room('b1', ci.CreateRoomDTO(name='room', private=False), Mock()).room.id
+        callback_enter_room = Mock()
+        callback_emit = Mock()
+
+        response = game.join_room('b2', ci.JoinRoomDTO(room_id), callback_enter_room, callback_emit)
+
+        assert response.room.players == ['b1', 'b2']
+        assert game.rooms[room_id].players == ['b1', 'b2']
+        assert game.room_of('b2') == room_id
+        callback_enter_room.assert_called_once_with(room_id)
+        [(full_sync, sync_room_id)] = emitted(callback_emit)
+        assert sync_room_id == room_id
+        assert {'b1', 'b2'} <= {update['id'] for update in full_sync['updates']}
+
+    def test_errors_of_shards_are_raised(self, game):
+        room_id = game.create_room('c1', ci.CreateRoomDTO(name='room', private=False), Mock()).room.id
+
+        with pytest.raises(GameError) as err:
+            game.join_room('c1', ci.JoinRoomDTO(room_id), Mock(), Mock())
+        assert err.value.code == 400
+        with pytest.raises(GameError) as err:
+            game.join_room('c2', ci.JoinRoomDTO('no such room'), Mock(), Mock())
+        assert err.value.code == 404
+
+    def test_updates_relay_payloads_of_every_room(self, game):
+        room_id = next(room.id for room in game.rooms.values() if 'a1' in room.players)
+        game.input('a1', room_id, ci.InputDTO(keys_down=['ArrowLeft'], keys_pressed=None, keys_released=None))
+        callback = Mock()
+
+        game.update_short(1 / 60, callback)
+        game.update_long(callback)
+
+        rooms_synced = {room_id for _, room_id in emitted(callback)}
+        assert rooms_synced == set(game.rooms)
+        assert all(shard.load > 0 for shard in game._shards)
+
+    def test_leave_room(self, game):
+        room_id = game.create_room('d1', ci.CreateRoomDTO(name='room', private=False), Mock()).room.id
+        game.leave_room('d1', room_id)
+
+        assert game.rooms[room_id].players == []
+        assert game.room_of('d1') is None
+        callback = Mock()
+        game.sync_full(room_id, 'd2', callback)
+        [(full_sync, _)] = emitted(callback)
+        assert 'd1' not in {update['id'] for update in full_sync['updates']}
+
+    def test_update_room(self, game):
+        room_id = game.create_room('e1', ci.CreateRoomDTO(name='room', private=False), Mock()).room.id
+        callback = Mock()
+
+        game.update_room_short(room_id, 1 / 60, callback)
+        game.update_room_long(room_id, callback)
+
+        assert [sync_room_id for _, sync_room_id in emitted(callback)] == [room_id, room_id]
+
+    def test_update_rooms_of_every_shard(self, game):
+        # a room of each shard
+        room_ids = list({shard: room_id for room_id, shard in game._room_shards.items()}.values())
+        assert len(room_ids) == 2
+        callback_short = Mock()
+        callback_long = Mock()
+
+        game.update_rooms([Tick(room_ids[0], False, 1 / 60), Tick(room_ids[1], True, 1 / 60)],
+                          callback_short, callback_long)
+
+        assert [room_id for _, room_id in emitted(callback_short)] == [room_ids[0]]
+        assert [room_id for _, room_id in emitted(callback_long)] == [room_ids[1]]
+
+
+def test_green_shard_lets_other_greenthreads_run():
+    game = ShardedGame(partial(Game, SYSTEMS, repository_factory), shards=1, green=True)
+    try:
+        ran = []
+        eventlet.spawn(ran.append, True)
+        game.create_room('a1', ci.CreateRoomDTO(name='room', private=False), Mock())
+
+        assert ran == [True]
+    finally:
+        game.close()
+
+
+def test_lost_shard_drops_its_rooms():
+    game = ShardedGame(partial(Game, SYSTEMS, repository_factory), shards=2)
+    try:
+        lost_room, kept_room = [
+            game.create_room(f'a{i}', ci.CreateRoomDTO(name='room', private=False), Mock()).room.id
+            for i in range(2)]
+        lost = game._room_shards[lost_room]
+        lost.process.kill()
+        lost.process.join()
+        callback_short = Mock()
+
+        game.update_rooms([Tick(lost_room, False, 1 / 60), Tick(kept_room, False, 1 / 60)],
+                          callback_short, Mock())
+
+        assert [room_id for _, room_id in emitted(callback_short)] == [kept_room]
+        assert list(game.rooms) == [kept_room]
+        assert game.room_of('a0') is None
+        game.update_rooms([Tick(lost_room, False, 1 / 60)], callback_short, Mock())
+        with pytest.raises(GameError):
+            lost.call('leave_room', 'a0', lost_room)
+        assert game.create_room('b', ci.CreateRoomDTO(name='room', private=False), Mock()).room.id in game.rooms
+    finally:
+        game.close()
+
+
+def test_metrics_of_shards_are_rendered():
+    metrics = Metrics(sample_rate=1)
+    game = ShardedGame(partial(Game, SYSTEMS, repository_factory, metrics=Metrics(sample_rate=1)), shards=2,
+                       metrics=metrics)
+    try:
+        room_ids = [
+            game.create_room(f'a{i}', ci.CreateRoomDTO(name='room', private=False), Mock()).room.id
+            for i in range(2)]
+        game.update_short(1 / 60, Mock())
+
+        text = metrics.render()
+        assert text.count('# HELP sync_create_seconds ') == 1
+        for room_id in room_ids:
+            assert f'sync_create_seconds_count{{room="{room_id}",sync="short"}} 1' in text
+            assert f'room_players{{room="{room_id}"}} 1' in text
+    finally:
+        game.close()
@@ -0,0 +1,126 @@
+from typing import Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+from math import isnan
+from Box2D import b2AABB, b2Fixture, b2QueryCallback, b2World
+from ecs.context import Context
+import server_interfaces as si
+from components import Box2DWorld, Position, SHORT_SYNC_COMPONENTS
+from constants import INTEREST_HALF_EXTENTS
+from serializer import ShortSyncBatch, ShortSyncEncoder, physics_lead, snapshot_short_sync
+
+
+class AreaQuery(b2QueryCallback):
+    """Collects entity ids of bodies with a fixture overlapping the queried AABB"""
+
+    def __init__(self):
+        b2QueryCallback.__init__(self)
+        self.entity_ids: Set[str] = set()
+
+    def ReportFixture(self, fixture: b2Fixture) -> bool:
+        self.entity_ids.add(fixture.body.userData)
+        return True
+
+
+def entities_in_area(world: b2World, center: Tuple[float, float], half_extents: Tuple[float, float]) -> Set[str]:
+    """Return entity ids of bodies overlapping the area, found with the broadphase of the world"""
+
+    query = AreaQuery()
+    x, y = center
+    half_width, half_height = half_extents
+    world.QueryAABB(query, b2AABB(lowerBound=(x - half_width, y - half_height),
+                                  upperBound=(x + half_width, y + half_height)))
+    return query.entity_ids
+
+
+class InterestManager:
+    """Creates short syncs of one room for each client, covering only the area around its player.
+
+    An entity is visible to a client when a fixture of its body overlaps the area of
+    `half_extents` around the player entity of the client. A client gets entities entering its
+    area whole, visible entities when they change and entities leaving its area once more with
+    zero velocity, so that it stops extrapolating them. Clients without a player entity, and all
+    clients of rooms without a physics world, see every entity.
+
+    With an encoder factory, each client gets its own ShortSyncEncoder.
+    """
+
+    def __init__(self, context: Context, half_extents: Tuple[float, float] = INTEREST_HALF_EXTENTS,
+                 encoder_factory: Optional[Callable[[], ShortSyncEncoder]] = None):
+        self.context = context
+        self.half_extents = half_extents
+        self.visible: Dict[str, Set[str]] = {}
+        self.encoders: Dict[str, ShortSyncEncoder] = {}
+        self._encoder_factory = encoder_factory
+        self._synced = [context.query(component) for component in SHORT_SYNC_COMPONENTS]
+
+    def add_client(self, sid: str):
+        self.visible[sid] = set()
+        if self._encoder_factory:
+            self.encoders[sid] = self._encoder_factory()
+
+    def remove_client(self, sid: str):
+        self.visible.pop(sid, None)
+        self.encoders.pop(sid, None)
+
+    def encode(self, sids: Iterable[str], sort=False, consumer: Hashable = None) -> Dict[str, si.ShortSyncDTO]:
+        """Create short sync for each client"""
+
+        context = self.context
+        if not SHORT_SYNC_COMPONENTS:
+            return {sid: si.ShortSyncDTO([], []) for sid in sids}
+
+        updated = context.get_updated_entities_for(*SHORT_SYNC_COMPONENTS, consumer=consumer)
+        removed = list(context.get_removed_entities(consumer=consumer))
+        lead = physics_lead(context)
+        world = self._get_world()
+
+        syncs: Dict[str, si.ShortSyncDTO] = {}
+        for sid in sids:
+            if sid not in self.visible:
+                self.add_client(sid)
+            visible = self._visible_to(sid, world)
+            previous = self.visible[sid]
+            entered = visible - previous
+            left = {entity_id for entity_id in previous - visible if self._is_synced(entity_id)}
+            self.visible[sid] = visible
+
+            encoder = self.encoders.get(sid)
+            keyframe = encoder.next_frame(context) if encoder else False
+            entity_ids: Iterable[str] = (visible if keyframe else (updated & visible) | entered) | left
+            if sort:
+                entity_ids = sorted(entity_ids)
+
+            batch = snapshot_short_sync(list(entity_ids), context, lead)
+            _stop(batch, left)
+            if encoder:
+                encoder.forget(entered | left, context)
+                batch = encoder.delta(batch, context, keyframe)
+            syncs[sid] = si.ShortSyncDTO(batch, removed)  # type: ignore
+        return syncs
+
+    def _visible_to(self, sid: str, world: Optional[b2World]) -> Set[str]:
+        position = self.context.get_many([sid], Position)[0]
+        if world is None or position is None:
+            return set().union(*self._synced)
+        return {
+            entity_id for entity_id in entities_in_area(world, tuple(position.position), self.half_extents)
+            if self._is_synced(entity_id)
+        }
+
+    def _is_synced(self, entity_id: str) -> bool:
+        return any(entity_id in query for query in self._synced)
+
+    def _get_world(self) -> Optional[b2World]:
+        if Box2DWorld.component_name not in self.context.repository:
+            return None
+        world = self.context.get_many([Box2DWorld.component_name], Box2DWorld)[0]
+        return world.world if world else None
+
+
+def _stop(batch: ShortSyncBatch, entity_ids: Set[str]):
+    """Zero velocities of given entities in batch"""
+
+    if not entity_ids:
+        return
+    for i, entity_id in enumerate(batch.ids):
+        if entity_id in entity_ids and not isnan(batch.velocities[2 * i]):
+            batch.velocities[2 * i] = batch.velocities[2 * i + 1] = 0.0
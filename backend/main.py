@@ -1,35 +1,61 @@
+import os
 import logging
+from functools import partial
 import eventlet
 import socketio
 import server.custom_json as custom_json
 from server.server import Server
 from game.game import Game
+from game.sharded import ShardedGame
+from serializer import ShortSyncEncoder
+from interest import InterestManager
+from metrics import Metrics
+from ecs.context import Context
+from ecs.archetype import ArchetypeContext
 from systems import SYSTEMS
 from repository import repository_factory
-from constants import CORS_ALLOWED_ORIGINS, ASSET_FILES
+from constants import CORS_ALLOWED_ORIGINS, ASSET_FILES, METRICS_SAMPLE_RATE
 logging.basicConfig(level=logging.INFO)
 
 
 def main():
     logging.info('server started')
+    context_class = ArchetypeContext if os.environ.get('ECS_STORAGE') == 'archetype' else Context
+    # clients only get short syncs of the area around their player
+    interest_manager = partial(InterestManager, encoder_factory=ShortSyncEncoder) \
+        if os.environ.get('AREA_OF_INTEREST') else None
+    game_factory = partial(Game, SYSTEMS, repository_factory, context_class, ShortSyncEncoder, interest_manager)
+    # metrics are recorded and served at /metrics, to requests bearing the token, only when a token is set
+    metrics_token = os.environ.get('METRICS_TOKEN')
+    sample_rate = float(os.environ.get('METRICS_SAMPLE_RATE', METRICS_SAMPLE_RATE))
+    metrics = Metrics(sample_rate, metrics_token) if metrics_token else None
+    shards = int(os.environ.get('GAME_SHARDS', 0))
+    # shard processes are started before monkey patching, replies of shards are waited for in the eventlet hub
+    # (rooms are measured in their shard, which the front process asks for its metrics when rendering them)
+    shard_factory = partial(game_factory, metrics=Metrics(sample_rate)) if metrics else game_factory
+    game = ShardedGame(shard_factory, shards, green=True, metrics=metrics) if shards \
+        else game_factory(metrics=metrics)
+
     eventlet.monkey_patch()
+    if os.environ.get('JSON_BACKEND') == 'orjson':
+        custom_json.use_orjson()
     sio = socketio.Server(
         async_mode='eventlet',
         json=custom_json,
         cors_allowed_origins=CORS_ALLOWED_ORIGINS)
     try:
-        app = socketio.WSGIApp(sio, static_files={
+        app = socketio.WSGIApp(sio, metrics.wsgi_app if metrics else None, static_files={
             '/': '../frontend/build/index.html',
             '/bundle.js': '../frontend/build/bundle.js',
             '/static': '../frontend/build',
             **ASSET_FILES  # type:ignore
         })
-        game = Game(SYSTEMS, repository_factory)
-
-        Server.serve(sio, app, game)
+        Server.serve(sio, app, game, metrics)
     finally:
         logging.error('stopped')
         sio.eio.disconnect()
+        if isinstance(game, ShardedGame):
+            game.close()
 
 
 if __name__ == '__main__':
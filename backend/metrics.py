@@ -0,0 +1,141 @@
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from bisect import bisect_left
+from hmac import compare_digest
+from random import random
+from constants import METRICS_SAMPLE_RATE
+
+Labels = Tuple[Tuple[str, str], ...]
+# metric name, labels and value, as reported by collectors
+Sample = Tuple[str, Dict[str, str], float]
+# histograms and collected samples of a Metrics, e.g. of a game shard
+Snapshot = Tuple[Dict[str, Dict[Labels, 'Histogram']], List[Sample]]
+
+SECONDS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+BYTES_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144)
+COUNT_BUCKETS = (0, 1, 4, 16, 64, 256, 1024, 4096)
+
+# type, help and buckets of every metric
+METRICS: Dict[str, Tuple[str, str, Sequence[float]]] = {
+    'game_event_seconds': ('histogram', 'Time a system took to handle an event', SECONDS_BUCKETS),
+    'sync_create_seconds': ('histogram', 'Time creating the sync updates of a room took', SECONDS_BUCKETS),
+    'sync_dirty_entities': ('histogram', 'Entities marked updated when a sync was created', COUNT_BUCKETS),
+    'sync_entities': ('histogram', 'Entities in the updates of a sync', COUNT_BUCKETS),
+    'sync_payload_bytes': ('histogram', 'Size of an emitted sync payload', BYTES_BUCKETS),
+    'room_players': ('gauge', 'Players in a room', ()),
+    'room_entities': ('gauge', 'Entities in a room', ()),
+    'box2d_velocity_iterations': ('gauge', 'Velocity iterations of the last step of a room', ()),
+    'box2d_position_iterations': ('gauge', 'Position iterations of the last step of a room', ()),
+    'scheduler_missed_deadlines_total': ('counter', 'Ticks that started more than a period late', ()),
+}
+
+
+class Histogram:
+    """Counts of observed values per bucket, with their sum"""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        # the last count is for values above every bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float, weight: float = 1):
+        """Count value weight times, e.g. 10 times for a value measured for a tenth of events"""
+        self.counts[bisect_left(self.bounds, value)] += weight
+        self.sum += value * weight
+        self.count += weight
+
+
+class Metrics:
+    """Histograms of tick measurements and values reported by collectors, rendered as Prometheus text.
+
+    Measuring is left to callers, who ask `sample()` first so that only a `sample_rate` fraction
+    of ticks, events and emits is measured. Observed values count 1 / sample_rate times, so that
+    histogram counts and sums estimate all of them. Collectors and sources of metrics recorded in
+    other processes are called when rendering. Metrics are only served to requests bearing `token`.
+    """
+
+    def __init__(self, sample_rate: float = METRICS_SAMPLE_RATE, token: Optional[str] = None):
+        self.sample_rate = sample_rate
+        self.token = token
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.collectors: List[Callable[[], Iterable[Sample]]] = []
+        self.sources: List[Callable[[], Iterable[Snapshot]]] = []
+        self._weight = 1 / sample_rate if 0 < sample_rate < 1 else 1
+
+    def sample(self) -> bool:
+        """Return whether to measure this time"""
+        return self.sample_rate > 0 and (self.sample_rate >= 1 or random() < self.sample_rate)
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = tuple(labels.items())
+        histograms = self.histograms.setdefault(name, {})
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(METRICS[name][2])
+        histogram.observe(value, self._weight)
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]):
+        self.collectors.append(collector)
+
+    def add_source(self, source: Callable[[], Iterable[Snapshot]]):
+        """Render snapshots source returns along with own metrics, e.g. the ones of game shards"""
+        self.sources.append(source)
+
+    def snapshot(self) -> Snapshot:
+        return self.histograms, [sample for collector in self.collectors for sample in collector()]
+
+    def render(self) -> str:
+        samples: Dict[str, List[str]] = {}
+        snapshots = [self.snapshot(), *(snapshot for source in self.sources for snapshot in source())]
+        for all_histograms, collected in snapshots:
+            for name, histograms in all_histograms.items():
+                lines = samples.setdefault(name, [])
+                for key, histogram in histograms.items():
+                    labels = dict(key)
+                    cumulative = 0
+                    for bound, count in zip((*histogram.bounds, '+Inf'), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_labels({**labels, "le": _number(bound)})} {_number(cumulative)}')
+                    lines.append(f'{name}_sum{_labels(labels)} {_number(histogram.sum)}')
+                    lines.append(f'{name}_count{_labels(labels)} {_number(histogram.count)}')
+            for name, labels, value in collected:
+                samples.setdefault(name, []).append(f'{name}{_labels(labels)} {_number(value)}')
+
+        text = []
+        for name, lines in samples.items():
+            kind, help_text, _ = METRICS[name]
+            text += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', *lines]
+        return '\n'.join(text) + '\n'
+
+    def wsgi_app(self, environ: Dict, start_response: Callable) -> List[bytes]:
+        """Serve rendered metrics at /metrics to requests with header `Authorization: Bearer <token>`"""
+
+        if environ.get('PATH_INFO') != '/metrics':
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'Not Found']
+        authorization = environ.get('HTTP_AUTHORIZATION', '')
+        if self.token is None or not compare_digest(authorization.encode(), f'Bearer {self.token}'.encode()):
+            start_response('401 Unauthorized', [('Content-Type', 'text/plain'), ('WWW-Authenticate', 'Bearer')])
+            return [b'Unauthorized']
+        body = self.render().encode()
+        start_response('200 OK', [
+            ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+            ('Content-Length', str(len(body)))])
+        return [body]
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + '}'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value) -> str:
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
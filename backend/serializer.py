@@ -1,38 +1,40 @@
-from typing import Union, Dict, cast
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple, overload
+from array import array
+from math import ceil, isnan, log10
 from ecs.context import Context
 import server_interfaces as si
-from Box2D import b2Body, b2Shape, b2CircleShape, b2PolygonShape
-from components import Box2DBody, Position, Velocity, Player, Angle
+from components import Box2DBody, Box2DWorld, Position, Velocity, Player, Angle
+from shapes import Shape, get_body_shape, serialize_b2Shape  # noqa: F401
 from components import SHORT_SYNC_COMPONENTS, LONG_SYNC_COMPONENTS
+from constants import (
+    SYNC_POSITION_PRECISION, SYNC_VELOCITY_PRECISION, SYNC_ANGLE_PRECISION, SYNC_KEYFRAME_INTERVAL)
 
-Shape = Union[si.RectShapeData, si.ArcShapeData]
 
-
-def create_short_sync(context: Context, sort=False) -> si.ShortSyncDTO:
+def create_short_sync(context: Context, sort=False, consumer: Hashable = None) -> si.ShortSyncDTO:
     """Create sync update for high-frequency update entities"""
     if not SHORT_SYNC_COMPONENTS:
         return si.ShortSyncDTO([], [])
 
-    entity_ids = context.get_updated_entities_for(*SHORT_SYNC_COMPONENTS)
+    entity_ids = context.get_updated_entities_for(*SHORT_SYNC_COMPONENTS, consumer=consumer)
     if sort:
         entity_ids = sorted(entity_ids)  # type: ignore
 
-    updates = [_create_short_sync(entity_id, context) for entity_id in entity_ids]
-    removed = list(context.get_removed_entities())
-    return si.ShortSyncDTO(updates, removed)
+    updates = snapshot_short_sync(list(entity_ids), context, physics_lead(context))
+    removed = list(context.get_removed_entities(consumer=consumer))
+    return si.ShortSyncDTO(updates, removed)  # type: ignore
 
 
-def create_long_sync(context: Context, sort=False) -> si.LongSyncDTO:
+def create_long_sync(context: Context, sort=False, consumer: Hashable = None) -> si.LongSyncDTO:
     """Create sync update for all updated entities"""
     if not LONG_SYNC_COMPONENTS:
         return si.LongSyncDTO([], [])
 
-    entity_ids = context.get_updated_entities_for(*LONG_SYNC_COMPONENTS)
+    entity_ids = context.get_updated_entities_for(*LONG_SYNC_COMPONENTS, consumer=consumer)
     if sort:
         entity_ids = sorted(entity_ids)  # type: ignore
 
     updates = [_create_long_sync(entity_id, context) for entity_id in entity_ids]
-    removed = list(context.get_removed_entities())
+    removed = list(context.get_removed_entities(consumer=consumer))
     return si.LongSyncDTO(updates, removed)
 
 
@@ -50,8 +52,232 @@ def create_full_sync(context: Context, sort=False) -> si.LongSyncDTO:
     return si.LongSyncDTO(updates, [])
 
 
-def _create_short_sync(entity_id: str, context: Context) -> si.ShortEntityData:
-    return si.ShortEntityData(**short_sync_data(entity_id, context))
+class ShortSyncBatch(Sequence[si.ShortEntityData]):
+    """Short sync data of many entities stored as flat columns, NaN marking a missing value.
+
+    Behaves like a list of ShortEntityData, but encodes to JSON without creating them.
+    A sparse batch leaves missing values out of the JSON instead of sending nulls.
+    """
+
+    def __init__(self, ids: List[str], indices: array, positions: array, velocities: array, angles: array,
+                 sparse=False):
+        self.ids = ids
+        self.indices = indices
+        self.positions = positions
+        self.velocities = velocities
+        self.angles = angles
+        self.sparse = sparse
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @overload
+    def __getitem__(self, i: int) -> si.ShortEntityData:
+        ...
+
+    @overload
+    def __getitem__(self, i: slice) -> List[si.ShortEntityData]:
+        ...
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return si.ShortEntityData(**self._row(i))
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (list, ShortSyncBatch)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({list(self)!r})'
+
+    def __json__(self) -> List[Dict]:
+        if self.sparse:
+            return [
+                {key: value for key, value in self._row(i).items() if value is not None}
+                for i in range(len(self.ids))
+            ]
+        return [self._row(i) for i in range(len(self.ids))]
+
+    def _row(self, i: int) -> Dict:
+        return {
+            'id': self.ids[i],
+            'position': _vector_or_none(self.positions, i),
+            'velocity': _vector_or_none(self.velocities, i),
+            'angle': None if isnan(self.angles[i]) else self.angles[i],
+        }
+
+
+def physics_lead(context: Context) -> float:
+    """Return seconds real time is ahead of the last fixed physics step.
+
+    Short syncs extrapolate positions by this lead along the velocity instead of interpolating
+    between the last two steps, so a body about to collide can be sent slightly past the contact.
+    """
+
+    if Box2DWorld.component_name not in context.repository:
+        return 0.0
+    world = context.get_maybe(Box2DWorld.component_name, Box2DWorld)
+    return world.alpha * world.timestep if world else 0.0  # type: ignore
+
+
+def snapshot_short_sync(entity_ids: List[str], context: Context, lead: float = 0.0) -> ShortSyncBatch:
+    """Read entity index, position, velocity and angle of given entities into flat columns in one pass.
+
+    Positions are extrapolated by `lead` seconds along the velocity of the entity. Entities that do
+    not exist are left out.
+    """
+
+    index = context.index
+    try:
+        indices = array('L', [index[entity_id] for entity_id in entity_ids])
+    except KeyError:
+        entity_ids = [entity_id for entity_id in entity_ids if entity_id in index]
+        indices = array('L', [index[entity_id] for entity_id in entity_ids])
+    nan = float('nan')
+    missing = (nan, nan)
+    positions = array('d')
+    velocities = array('d')
+    angles = array('d')
+
+    rows = zip(
+        context.get_many(entity_ids, Position),
+        context.get_many(entity_ids, Velocity),
+        context.get_many(entity_ids, Angle))
+    for position, velocity, angle in rows:
+        if position is None:
+            positions.extend(missing)
+        elif lead and velocity is not None:
+            positions.extend(position.position + lead * velocity.velocity)
+        else:
+            positions.extend(position.position)
+        velocities.extend(missing if velocity is None else velocity.velocity)
+        angles.append(nan if angle is None else angle.angle)
+
+    return ShortSyncBatch(entity_ids, indices, positions, velocities, angles)
+
+
+Quantized = Tuple[Optional[int], Optional[int], Optional[int], Optional[int], Optional[int]]
+
+
+class ShortSyncEncoder:
+    """Creates short syncs of one room with values quantized, leaving out values clients already have.
+
+    A value is sent when its quantized value differs from the one last sent to the room. Every
+    `keyframe_interval` frames, and on request (e.g. when a player joins), all values of every
+    short sync entity are sent so that clients can resync.
+    """
+
+    def __init__(self, position_precision: float = SYNC_POSITION_PRECISION,
+                 velocity_precision: float = SYNC_VELOCITY_PRECISION,
+                 angle_precision: float = SYNC_ANGLE_PRECISION,
+                 keyframe_interval: int = SYNC_KEYFRAME_INTERVAL):
+        self.precisions = (position_precision, position_precision,
+                           velocity_precision, velocity_precision, angle_precision)
+        self.keyframe_interval = keyframe_interval
+        self._decimals = [_decimals(precision) for precision in self.precisions]
+        self._sent: Dict[int, Quantized] = {}
+        self._frames_since_keyframe = 0
+        self._keyframe_requested = True
+
+    def request_keyframe(self):
+        self._keyframe_requested = True
+
+    def encode(self, context: Context, sort=False, consumer: Hashable = None) -> si.ShortSyncDTO:
+        """Create short sync for updated entities, or for all short sync entities on keyframes"""
+        if not SHORT_SYNC_COMPONENTS:
+            return si.ShortSyncDTO([], [])
+
+        entity_ids = context.get_updated_entities_for(*SHORT_SYNC_COMPONENTS, consumer=consumer)
+        keyframe = self.next_frame(context)
+        if keyframe:
+            entity_ids = context.get_entities_with(*SHORT_SYNC_COMPONENTS, some=True)
+        if sort:
+            entity_ids = sorted(entity_ids)  # type: ignore
+
+        updates = self.delta(snapshot_short_sync(list(entity_ids), context, physics_lead(context)), context, keyframe)
+        removed = list(context.get_removed_entities(consumer=consumer))
+        return si.ShortSyncDTO(updates, removed)  # type: ignore
+
+    def next_frame(self, context: Context) -> bool:
+        """Advance to the next frame and return whether everything is sent in it"""
+
+        keyframe = self._keyframe_requested or self._frames_since_keyframe + 1 >= self.keyframe_interval
+        if keyframe:
+            # values are kept by entity handle, so that recreated entities are sent whole
+            self._sent = {handle: sent for handle, sent in self._sent.items() if context.index.is_alive(handle)}
+            self._keyframe_requested = False
+            self._frames_since_keyframe = 0
+        else:
+            self._frames_since_keyframe += 1
+        return keyframe
+
+    def forget(self, entity_ids: Iterable[str], context: Context):
+        """Send all values of given entities the next time they are encoded"""
+
+        for entity_id in entity_ids:
+            if entity_id in context.index:
+                self._sent.pop(context.index.handle(entity_id), None)
+
+    def delta(self, batch: ShortSyncBatch, context: Context, keyframe: bool) -> ShortSyncBatch:
+        """Return values of batch that differ from the ones last sent, everything on keyframes"""
+        nan = float('nan')
+        precisions = self.precisions
+        decimals = self._decimals
+        ids: List[str] = []
+        indices = array('L')
+        columns = [array('d') for _ in precisions]
+
+        for i, entity_id in enumerate(batch.ids):
+            values = (batch.positions[2 * i], batch.positions[2 * i + 1],
+                      batch.velocities[2 * i], batch.velocities[2 * i + 1], batch.angles[i])
+            quantized: Quantized = tuple(  # type: ignore
+                None if isnan(value) else round(value / precision)
+                for value, precision in zip(values, precisions))
+
+            handle = context.index.handle(entity_id)
+            sent = self._sent.get(handle)
+            if sent is None or keyframe:
+                changed = [True] * 5
+            else:
+                changed = [q != s for q, s in zip(quantized, sent)]
+            # vectors are sent whole
+            changed[0] = changed[1] = changed[0] or changed[1]
+            changed[2] = changed[3] = changed[2] or changed[3]
+            if not any(changed):
+                continue
+
+            ids.append(entity_id)
+            indices.append(batch.indices[i])
+            for column, q, is_changed, precision, digits in zip(columns, quantized, changed, precisions, decimals):
+                column.append(nan if q is None or not is_changed else round(q * precision, digits))
+            if sent is not None:
+                # unsent values keep their old baseline, so that slow drift is sent eventually
+                quantized = tuple(q if is_changed else s for q, s, is_changed in zip(quantized, sent, changed))
+            self._sent[handle] = quantized
+
+        x, y, vx, vy, angles = columns
+        return ShortSyncBatch(ids, indices, _interleave(x, y), _interleave(vx, vy), angles, sparse=True)
+
+
+def _decimals(precision: float) -> int:
+    """Return number of decimals needed to print multiples of precision"""
+    return max(0, ceil(-log10(precision) - 1e-9))
+
+
+def _interleave(xs: array, ys: array) -> array:
+    result = array('d', bytes(8 * 2 * len(xs)))
+    result[0::2] = xs
+    result[1::2] = ys
+    return result
+
+
+def _vector_or_none(values: array, i: int) -> Optional[List[float]]:
+    x = values[2 * i]
+    if isnan(x):
+        return None
+    return [x, values[2 * i + 1]]
 
 
 def _create_long_sync(entity_id: str, context: Context) -> si.EntityData:
@@ -70,24 +296,6 @@ def short_sync_data(entity_id: str, context: Context) -> Dict:
 def long_sync_data(entity_id: str, context: Context) -> Dict:
     return {
         **short_sync_data(entity_id, context),
-        'shape': get_body_shape(context.get_maybe(entity_id, Box2DBody).body),  # type: ignore
+        'shape': context.get_maybe(entity_id, Box2DBody).shape,  # type: ignore
         'color': context.get_maybe(entity_id, Player).color,  # type: ignore
     }
-
-
-def get_body_shape(body: Union[b2Body, None]) -> Union[Shape, None]:
-    if body is None or len(body.fixtures) == 0:
-        return None
-    shape = body.fixtures[0].shape
-
-    return serialize_b2Shape(shape)
-
-
-def serialize_b2Shape(shape: b2Shape) -> Union[Shape, None]:
-    if isinstance(shape, b2CircleShape):
-        return cast(si.ArcShapeData, si.ArcShapeData.from_b2Circlehape(shape))
-
-    if isinstance(shape, b2PolygonShape):
-        return cast(si.PolygonShapeData, si.PolygonShapeData.from_b2PolygonShape(shape))
-
-    return None
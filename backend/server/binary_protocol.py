@@ -0,0 +1,103 @@
+import sys
+from typing import Dict, List, Set
+from dataclasses import dataclass
+from array import array
+from math import isnan
+import server_interfaces as si
+from serializer import ShortSyncBatch
+
+PROTOCOL_BINARY = 'binary'
+RECORD_LENGTH = 6
+
+
+@dataclass
+class BinaryShortSyncDTO:
+    """Short sync for clients that connected with the `protocol=binary` query parameter.
+
+    Updates are one socket.io binary attachment of little-endian float32 records
+    (entity index, x, y, vx, vy, angle), NaN marking a missing value. Entity indices are
+    below 2 ** 24 and therefore exact in float32. The id of an entity index is sent in
+    `ids` the first time the index is used, or again after the packer was reset.
+    """
+    updates: bytes
+    ids: Dict[str, str]
+    remove: List[str]
+
+
+def wants_binary(environ: Dict) -> bool:
+    """Return whether client asked for the binary protocol when connecting"""
+    query = environ.get('QUERY_STRING', '')
+    return f'protocol={PROTOCOL_BINARY}' in query.split('&')
+
+
+def pack_records(batch: ShortSyncBatch) -> bytes:
+    """Pack batch columns into float32 records"""
+
+    records = array('f', bytes(4 * RECORD_LENGTH * len(batch)))
+    records[0::RECORD_LENGTH] = array('f', batch.indices)
+    records[1::RECORD_LENGTH] = array('f', batch.positions[0::2])
+    records[2::RECORD_LENGTH] = array('f', batch.positions[1::2])
+    records[3::RECORD_LENGTH] = array('f', batch.velocities[0::2])
+    records[4::RECORD_LENGTH] = array('f', batch.velocities[1::2])
+    records[5::RECORD_LENGTH] = array('f', batch.angles)
+    if sys.byteorder == 'big':
+        records.byteswap()
+    return records.tobytes()
+
+
+def unpack_records(data: bytes) -> array:
+    records = array('f', data)
+    if sys.byteorder == 'big':
+        records.byteswap()
+    return records
+
+
+class ShortSyncPacker:
+    """Packs short syncs of one room, keeping track of entity ids already sent to its receivers"""
+
+    def __init__(self):
+        self._sent_ids: Dict[int, str] = {}
+
+    def reset(self):
+        """Send ids again, e.g. when a new receiver joins"""
+        self._sent_ids.clear()
+
+    def pack(self, dto: si.ShortSyncDTO) -> BinaryShortSyncDTO:
+        batch = dto.updates
+        if not isinstance(batch, ShortSyncBatch):
+            raise TypeError('Only short syncs created by serializer.create_short_sync can be packed')
+
+        ids = {}
+        for index, entity_id in zip(batch.indices, batch.ids):
+            if self._sent_ids.get(index) != entity_id:
+                self._sent_ids[index] = entity_id
+                ids[str(index)] = entity_id
+
+        removed: Set[str] = set(dto.remove)
+        if removed:
+            self._sent_ids = {
+                index: entity_id for index, entity_id in self._sent_ids.items() if entity_id not in removed}
+
+        return BinaryShortSyncDTO(pack_records(batch), ids, dto.remove)
+
+
+class ShortSyncUnpacker:
+    """Reverses ShortSyncPacker, mirrors the decoder in the frontend"""
+
+    def __init__(self):
+        self._ids: Dict[int, str] = {}
+
+    def unpack(self, dto: BinaryShortSyncDTO) -> si.ShortSyncDTO:
+        self._ids.update((int(index), entity_id) for index, entity_id in dto.ids.items())
+
+        records = unpack_records(dto.updates)
+        updates = []
+        for offset in range(0, len(records), RECORD_LENGTH):
+            index, x, y, vx, vy, angle = records[offset:offset + RECORD_LENGTH]
+            updates.append(si.ShortEntityData(
+                id=self._ids[int(index)],
+                position=None if isnan(x) else [x, y],
+                velocity=None if isnan(vx) else [vx, vy],
+                angle=None if isnan(angle) else angle,
+            ))
+        return si.ShortSyncDTO(updates, dto.remove)
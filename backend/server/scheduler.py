@@ -0,0 +1,116 @@
+from typing import Counter, Dict, Iterable, List, Optional, Tuple
+from dataclasses import dataclass
+import collections
+import heapq
+
+
+@dataclass
+class Tick:
+    room_id: str
+    long: bool
+    dt: float
+
+
+@dataclass
+class RoomSchedule:
+    room_id: str
+    period: float
+    long_interval: int
+    long_offset: int
+    deadline: float
+    last_tick: float
+    frame: int = 0
+    missed_deadlines: int = 0
+
+
+class RoomScheduler:
+    """Gives every room its own tick deadline and hands out due ticks in deadline order.
+
+    A room syncs long once every `long_interval` of its ticks and short on the others. Rooms get
+    different long sync frames, so long syncs of many rooms do not pile up on a single tick. A
+    tick more than one period late counts as a missed deadline and the room's schedule restarts
+    from now instead of catching up.
+    """
+
+    def __init__(self, ticks_per_second: int):
+        self.ticks_per_second = ticks_per_second
+        self.rooms: Dict[str, RoomSchedule] = {}
+        self.missed_deadlines = 0
+        self._heap: List[Tuple[float, int, str]] = []
+        self._sequence = 0
+        self._long_offsets: Counter[int] = collections.Counter()
+
+    def __len__(self) -> int:
+        return len(self.rooms)
+
+    def __contains__(self, room_id: str) -> bool:
+        return room_id in self.rooms
+
+    def add_room(self, room_id: str, now: float, ticks_per_second: Optional[int] = None):
+        if room_id in self.rooms:
+            return
+        ticks_per_second = ticks_per_second or self.ticks_per_second
+        long_offset = min(range(ticks_per_second), key=lambda offset: self._long_offsets[offset])
+        self._long_offsets[long_offset] += 1
+
+        period = 1 / ticks_per_second
+        self.rooms[room_id] = RoomSchedule(room_id, period, ticks_per_second, long_offset, now, now - period)
+        self._push(room_id, now)
+
+    def remove_room(self, room_id: str):
+        # entries left in the heap are skipped when popped
+        schedule = self.rooms.pop(room_id, None)
+        if schedule:
+            self._long_offsets[schedule.long_offset] -= 1
+
+    def sync_rooms(self, room_ids: Iterable[str], now: float):
+        """Schedule new rooms and drop removed ones"""
+
+        room_ids = list(room_ids)
+        for room_id in room_ids:
+            self.add_room(room_id, now)
+        for room_id in set(self.rooms).difference(room_ids):
+            self.remove_room(room_id)
+
+    def pop_due(self, now: float) -> List[Tick]:
+        """Return ticks due at time now, earliest deadline first, and schedule the next ones"""
+
+        ticks = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, room_id = heapq.heappop(self._heap)
+            schedule = self.rooms.get(room_id)
+            if schedule is None or schedule.deadline != deadline:
+                continue
+
+            ticks.append(Tick(
+                room_id,
+                schedule.frame % schedule.long_interval == schedule.long_offset,
+                now - schedule.last_tick))
+            schedule.frame += 1
+            schedule.last_tick = now
+
+            next_deadline = deadline + schedule.period
+            if next_deadline <= now:
+                schedule.missed_deadlines += 1
+                self.missed_deadlines += 1
+                next_deadline = now + schedule.period
+            schedule.deadline = next_deadline
+            self._push(room_id, next_deadline)
+        return ticks
+
+    def time_until_next(self, now: float) -> float:
+        """Return seconds until the earliest deadline"""
+
+        while self._heap and self._is_stale(self._heap[0]):
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return 1 / self.ticks_per_second
+        return max(0.0, self._heap[0][0] - now)
+
+    def _push(self, room_id: str, deadline: float):
+        self._sequence += 1
+        heapq.heappush(self._heap, (deadline, self._sequence, room_id))
+
+    def _is_stale(self, entry: Tuple[float, int, str]) -> bool:
+        schedule = self.rooms.get(entry[2])
+        return schedule is None or schedule.deadline != entry[0]
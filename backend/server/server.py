@@ -1,15 +1,22 @@
 import os
 from ecs.base_system import ExternalEvent
-from typing import Union, Dict, Callable, Optional
-from time import time
+from typing import DefaultDict, Union, Dict, Callable, Iterator, List, Optional, Set
+from collections import defaultdict
+from time import monotonic
 import logging
 import threading
 import eventlet
 import socketio
 from functools import partial
 import client_interfaces as ci
+import server_interfaces as si
 from server.decorators import returns_error_dto
+from server.binary_protocol import ShortSyncPacker, wants_binary
+from server.custom_json import COMPACT_SEPARATORS, RawJSON, dumps, shallow_asdict
+from server.scheduler import RoomScheduler, Tick
 from game.game import Game
+from game.sharded import ShardedGame
+from metrics import Metrics, Sample
 logging.basicConfig(level=logging.INFO)
 
 TICKS_PER_SECOND = 12
@@ -18,57 +25,120 @@ PORT = int(os.environ.get("PORT", 5000))
 
 class Server(socketio.Namespace):
     sio: socketio.Server
-    game: Game
+    game: Union[Game, ShardedGame]
 
-    def __init__(self, namespace: Union[str, None], sio: socketio.Server, game: Game):
+    def __init__(self, namespace: Union[str, None], sio: socketio.Server, game: Union[Game, ShardedGame],
+                 metrics: Optional[Metrics] = None):
         super().__init__(namespace=namespace)
         self.game = game
         self.sio = sio
-        self._last_update: Optional[float] = None
+        self.debug_room_id: Optional[str] = None
+        self.scheduler: Optional[RoomScheduler] = None
+        self.binary_clients: Set[str] = set()
+        # packers of short syncs sent to a whole room and of the ones sent to a single client
+        self._room_packers: DefaultDict[str, ShortSyncPacker] = defaultdict(ShortSyncPacker)
+        self._client_packers: DefaultDict[str, ShortSyncPacker] = defaultdict(ShortSyncPacker)
 
-        self.callback_short: Callable = partial(self.sio.emit, 'short_sync')
-        self.callback_long: Callable = partial(self.sio.emit, 'long_sync')
+        self.metrics = metrics
+        if metrics:
+            metrics.add_collector(self._collect_metrics)
+
+        self.callback_short: Callable = self.emit_short_sync
+        self.callback_long: Callable = self.emit_long_sync
 
     def _init_debug_room(self, name: str):
         room = self.game._create_room(ci.CreateRoomDTO(name, False))
         self.game.trigger_event(ExternalEvent.GAME_INIT, room.id, room)
+        self.debug_room_id = room.id
+
+    def run_scheduled(self, shutdown_flag: threading.Event, scheduler: RoomScheduler, debug=False,
+                      clock: Callable[[], float] = monotonic):
+        """Tick every room on its own schedule, skipping rooms without players other than the debug room"""
 
-    def sync(self, shutdown_flag: threading.Event, ticks_per_second, debug=False):
-        frame = 0
         if debug:
             self._init_debug_room('debug room')
 
         while not shutdown_flag.is_set():
-            self.tick(frame == 0)
-            self._last_update = time()
-            self.sio.sleep(1 / ticks_per_second)
-            frame = (frame + 1) % ticks_per_second
-
-    def tick(self, long: bool = True, sort: bool = False):
-        if long:
-            self.game.update_long(self.callback_long, sort)
-        else:
-            self.game.update_short(self._get_dt(), self.callback_short, sort)
+            now = clock()
+            if len(scheduler) != len(self.game.rooms):
+                scheduler.sync_rooms(self.game.rooms, now)
+                self._forget_removed_rooms()
+            # rooms of a lost game shard may be gone
+            ticks = [
+                tick for tick in scheduler.pop_due(now)
+                if tick.room_id in self.game.rooms
+                and (tick.room_id == self.debug_room_id or self.game.rooms[tick.room_id].players)]
+            if ticks:
+                self.tick_rooms(ticks)
+            self.sio.sleep(scheduler.time_until_next(clock()))
+
+    def tick_rooms(self, ticks: List[Tick], sort: bool = False):
+        self.game.update_rooms(ticks, self.callback_short, self.callback_long, sort)
 
     @classmethod
-    def serve(cls, sio: socketio.Server, app: socketio.WSGIApp, game: Game):
-        server = cls(None, sio, game)
+    def serve(cls, sio: socketio.Server, app: socketio.WSGIApp, game: Union[Game, ShardedGame],
+              metrics: Optional[Metrics] = None):
+        server = cls(None, sio, game, metrics)
         sio.register_namespace(server)
 
         shutdown_flag = threading.Event()
-        sio.start_background_task(server.sync, shutdown_flag, TICKS_PER_SECOND, True)
+        server.scheduler = RoomScheduler(TICKS_PER_SECOND)
+        sio.start_background_task(server.run_scheduled, shutdown_flag, server.scheduler, True)
         eventlet.wsgi.server(eventlet.listen(('', PORT)), app)
         logging.info('Shutting down')
         shutdown_flag.set()
 
+    def emit_short_sync(self, updates: si.ShortSyncDTO, room_id: str, sid: Optional[str] = None):
+        """Send short sync to room, or only to client sid, packed for clients that negotiated the binary protocol"""
+
+        measured = self._sample()
+        if sid is not None:
+            if sid in self.binary_clients and isinstance(updates, si.ShortSyncDTO):
+                payload = shallow_asdict(self._client_packers[sid].pack(updates))
+            else:
+                payload = updates
+            if measured:
+                payload = self._measure_payload(room_id, 'short', payload)
+            self.sio.emit('short_sync', payload, sid)
+            return
+
+        players = self.game.rooms[room_id].players
+        binary_sids = self.binary_clients.intersection(players)
+        if not isinstance(updates, si.ShortSyncDTO):
+            # updates already encoded by a game shard are sent as JSON to everyone
+            binary_sids = set()
+        payload = updates
+        if measured and len(binary_sids) < len(players):
+            payload = self._measure_payload(room_id, 'short', updates)
+        if not binary_sids:
+            self.sio.emit('short_sync', payload, room_id)
+            return
+
+        if len(binary_sids) < len(players):
+            self.sio.emit('short_sync', payload, room_id, skip_sid=list(binary_sids))
+        packed = shallow_asdict(self._room_packers[room_id].pack(updates))
+        if measured:
+            packed = self._measure_payload(room_id, 'short', packed)
+        for sid in binary_sids:
+            self.sio.emit('short_sync', packed, sid)
+
+    def emit_long_sync(self, updates: si.LongSyncDTO, room_id: str):
+        payload = self._measure_payload(room_id, 'long', updates) if self._sample() else updates
+        self.sio.emit('long_sync', payload, room_id)
+
     def on_connect(self, sid, environ):
-        pass
+        if wants_binary(environ):
+            self.binary_clients.add(sid)
 
     def on_disconnect(self, sid: str):
-        room_id = self._get_room_id(sid)
+        self.binary_clients.discard(sid)
+        self._client_packers.pop(sid, None)
+        room_id = self.game.room_of(sid)
         if not room_id:
             return
         self.game.leave_room(sid, room_id)
+        if not self.binary_clients.intersection(self.game.rooms[room_id].players):
+            self._room_packers.pop(room_id, None)
 
     @returns_error_dto
     def on_get_rooms(self, sid: str, data: None):
@@ -77,27 +147,68 @@ class Server(socketio.Namespace):
     @returns_error_dto
     def on_join_room(self, sid: str, data: Dict):
         callback = partial(self.sio.enter_room, sid)
-        return self.game.join_room(sid, ci.JoinRoomDTO(**data), callback, self.callback_long)
+        response = self.game.join_room(sid, ci.JoinRoomDTO(**data), callback, self.callback_long)
+        self._entered_room(sid, response.room.id)
+        return response
 
     @returns_error_dto
     def on_create_room(self, sid: str, data: Dict):
         callback = partial(self.sio.enter_room, sid)
-        return self.game.create_room(sid, ci.CreateRoomDTO(**data), callback)
+        response = self.game.create_room(sid, ci.CreateRoomDTO(**data), callback)
+        self._entered_room(sid, response.room.id)
+        return response
 
-    def on_input(self, sid: str, data: Dict):
-        room_id = self._get_room_id(sid)
+    def on_input(self, sid: str, data: Union[Dict, List]):
+        room_id = self.game.room_of(sid)
         if not room_id:
             return
+        if isinstance(data, list):
+            try:
+                compact = ci.CompactInput.from_list(data)
+            except ValueError:
+                logging.warning(f'{sid} sent malformed input')
+                return
+            return self.game.input(sid, room_id, compact)
         return self.game.input(sid, room_id, ci.InputDTO(**data))
 
-    def _get_dt(self) -> float:
-        if self._last_update:
-            return time() - self._last_update
-        else:
-            return 1 / 100
+    def _entered_room(self, sid: str, room_id: str):
+        if sid in self.binary_clients:
+            # the new client does not know any entity ids yet
+            self._room_packers[room_id].reset()
+            self._client_packers.pop(sid, None)
+
+    def _forget_removed_rooms(self):
+        for room_id in set(self._room_packers).difference(self.game.rooms):
+            del self._room_packers[room_id]
 
-    def _get_room_id(self, sid: str) -> Union[str, None]:
-        rooms = set(self.sio.rooms(sid)) - {sid}
-        if not rooms:
-            return None
-        return rooms.pop()  # type: ignore
+    def _sample(self) -> bool:
+        return self.metrics is not None and self.metrics.sample()
+
+    def _measure_payload(self, room_id: str, sync: str, payload):
+        """Observe the size of payload as sent, return what to emit in its place"""
+
+        if isinstance(payload, dict):
+            # packed short sync, records are a binary attachment
+            size = len(payload['updates']) + _ids_size(payload['ids'], payload['remove'])
+            protocol = 'binary'
+        else:
+            if not isinstance(payload, str):
+                # encoded once here, socket.io splices the encoded payload into the packet
+                payload = RawJSON(dumps(payload, separators=COMPACT_SEPARATORS))
+            size = len(payload)
+            protocol = 'json'
+        self.metrics.observe(  # type: ignore
+            'sync_payload_bytes', size, room=room_id, sync=sync, protocol=protocol)
+        return payload
+
+    def _collect_metrics(self) -> Iterator[Sample]:
+        if self.scheduler is not None:
+            yield 'scheduler_missed_deadlines_total', {}, self.scheduler.missed_deadlines
+
+
+def _ids_size(ids: Dict[str, str], remove: List[str]) -> int:
+    """Length of [ids, remove] as compact JSON, counted without encoding as entity ids need no escaping"""
+
+    size = 7 + sum(len(index) + len(entity_id) + 6 for index, entity_id in ids.items())
+    size += sum(len(entity_id) + 3 for entity_id in remove)
+    return size - bool(ids) - bool(remove)
@@ -0,0 +1,182 @@
+import pytest
+import server_interfaces as si
+from unittest.mock import Mock
+from Box2D import b2Vec2
+from components import Position, Velocity, Angle
+from serializer import create_short_sync
+from server.binary_protocol import BinaryShortSyncDTO, ShortSyncPacker, ShortSyncUnpacker, RECORD_LENGTH, wants_binary
+from server.server import Server, _ids_size
+from metrics import Metrics
+import server.custom_json as custom_json
+
+
+@pytest.fixture
+def context(empty_context):
+    return empty_context
+
+
+def approx_updates(updates):
+    return [
+        si.ShortEntityData(
+            id=update.id,
+            position=update.position and pytest.approx(list(update.position)),
+            velocity=update.velocity and pytest.approx(list(update.velocity)),
+            angle=update.angle if update.angle is None else pytest.approx(update.angle),
+        )
+        for update in updates
+    ]
+
+
+class TestBinaryProtocol:
+    def test_wants_binary(self):
+        assert wants_binary({'QUERY_STRING': 'EIO=4&transport=polling&protocol=binary'})
+        assert not wants_binary({'QUERY_STRING': 'EIO=4&transport=polling'})
+        assert not wants_binary({})
+
+    def test_round_trip(self, context):
+        context.upsert('a', Position(b2Vec2(1.5, -2)), Velocity(b2Vec2(0.25, 3)), Angle(0.1))
+        context.upsert('b', Position(b2Vec2(4, 5)))
+        context.upsert('c', Angle(-1))
+        dto = create_short_sync(context, sort=True)
+
+        packed = ShortSyncPacker().pack(dto)
+        assert len(packed.updates) == 4 * RECORD_LENGTH * 3
+
+        unpacked = ShortSyncUnpacker().unpack(packed)
+        assert unpacked.updates == approx_updates(dto.updates)
+        assert unpacked.remove == dto.remove
+
+    def test_ids_are_sent_once(self, context):
+        packer = ShortSyncPacker()
+        context.upsert('a', Position(b2Vec2(1, 1)))
+        first = packer.pack(create_short_sync(context))
+        context.upsert('a', Position(b2Vec2(2, 2)))
+        second = packer.pack(create_short_sync(context))
+
+        assert first.ids == {str(context.index.get('a')): 'a'}
+        assert second.ids == {}
+
+        packer.reset()
+        context.upsert('a', Position(b2Vec2(3, 3)))
+        assert packer.pack(create_short_sync(context)).ids == first.ids
+
+    def test_reused_index_is_announced(self, context):
+        packer = ShortSyncPacker()
+        unpacker = ShortSyncUnpacker()
+        context.upsert('a', Position(b2Vec2(1, 1)))
+        unpacker.unpack(packer.pack(create_short_sync(context)))
+        context.remove_entity('a')
+        context.upsert('b', Position(b2Vec2(2, 2)))
+
+        packed = packer.pack(create_short_sync(context))
+        assert packed.ids == {str(context.index.get('b')): 'b'}
+        assert [update.id for update in unpacker.unpack(packed).updates] == ['b']
+
+    def test_only_batches_can_be_packed(self):
+        with pytest.raises(TypeError):
+            ShortSyncPacker().pack(si.ShortSyncDTO([], []))
+
+
+class TestServerBinaryClients:
+    def test_short_sync_is_packed_for_binary_clients(self, context):
+        sio = Mock(name='sio')
+        game = Mock(name='game')
+        game.rooms = {'room': Mock(players=['json', 'binary'])}
+        server = Server(None, sio, game)
+        server.on_connect('json', {'QUERY_STRING': ''})
+        server.on_connect('binary', {'QUERY_STRING': 'protocol=binary'})
+
+        context.upsert('a', Position(b2Vec2(1, 1)))
+        dto = create_short_sync(context)
+        server.callback_short(dto, 'room')
+
+        json_call, binary_call = sio.emit.call_args_list
+        assert json_call.args == ('short_sync', dto, 'room')
+        assert json_call.kwargs == {'skip_sid': ['binary']}
+        event, packed, sid = binary_call.args
+        assert (event, sid) == ('short_sync', 'binary')
+        assert ShortSyncUnpacker().unpack(BinaryShortSyncDTO(**packed)).updates == approx_updates(dto.updates)
+
+    def test_short_sync_for_one_client(self, context):
+        sio = Mock(name='sio')
+        game = Mock(name='game')
+        game.rooms = {'room': Mock(players=['json', 'binary'])}
+        server = Server(None, sio, game)
+        server.on_connect('json', {'QUERY_STRING': ''})
+        server.on_connect('binary', {'QUERY_STRING': 'protocol=binary'})
+
+        context.upsert('a', Position(b2Vec2(1, 1)))
+        dto = create_short_sync(context)
+        server.callback_short(dto, 'room', 'json')
+        server.callback_short(dto, 'room', 'binary')
+
+        json_call, binary_call = sio.emit.call_args_list
+        assert json_call.args == ('short_sync', dto, 'json')
+        event, packed, sid = binary_call.args
+        assert (event, sid) == ('short_sync', 'binary')
+        assert ShortSyncUnpacker().unpack(BinaryShortSyncDTO(**packed)).updates == approx_updates(dto.updates)
+
+    def test_payload_sizes_are_measured(self, context):
+        sio = Mock(name='sio')
+        game = Mock(name='game')
+        game.rooms = {'room': Mock(players=['json', 'binary'])}
+        server = Server(None, sio, game, Metrics(sample_rate=1))
+        server.on_connect('json', {'QUERY_STRING': ''})
+        server.on_connect('binary', {'QUERY_STRING': 'protocol=binary'})
+
+        context.upsert('a', Position(b2Vec2(1, 1)))
+        updates = create_short_sync(context)
+        server.callback_short(updates, 'room')
+
+        histograms = server.metrics.histograms['sync_payload_bytes']
+        json_size = histograms[('room', 'room'), ('sync', 'short'), ('protocol', 'json')].sum
+        binary_size = histograms[('room', 'room'), ('sync', 'short'), ('protocol', 'binary')].sum
+        encoded = custom_json.dumps(updates, separators=(',', ':'))
+        assert json_size == len(encoded)
+        assert binary_size == 4 * RECORD_LENGTH + len('[{"0":"a"},[]]')
+        # the measured payload is sent as encoded for measuring
+        json_payload = sio.emit.call_args_list[0].args[1]
+        assert isinstance(json_payload, custom_json.RawJSON) and json_payload == encoded
+
+    @pytest.mark.parametrize('ids, remove', [({}, []), ({'0': 'a', '12': 'bc'}, []), ({'3': 'a'}, ['b', 'cd'])])
+    def test_ids_size(self, ids, remove):
+        assert _ids_size(ids, remove) == len(custom_json.dumps([ids, remove], separators=(',', ':')))
+
+    def test_disconnect_forgets_binary_client(self):
+        game = Mock(name='game')
+        game.room_of.return_value = None
+        server = Server(None, Mock(name='sio'), game)
+        server.on_connect('binary', {'QUERY_STRING': 'protocol=binary'})
+        server.on_disconnect('binary')
+        assert not server.binary_clients
+
+    def test_room_packer_is_dropped_with_last_binary_client(self, context):
+        game = Mock(name='game')
+        game.rooms = {'room': Mock(players=['binary'])}
+        game.room_of.return_value = 'room'
+        server = Server(None, Mock(name='sio'), game)
+        server.on_connect('binary', {'QUERY_STRING': 'protocol=binary'})
+
+        context.upsert('a', Position(b2Vec2(1, 1)))
+        server.callback_short(create_short_sync(context), 'room')
+        assert 'room' in server._room_packers
+
+        game.rooms['room'].players = []
+        server.on_disconnect('binary')
+        assert 'room' not in server._room_packers
+
+    def test_client_and_room_with_the_same_id_use_separate_packers(self, context):
+        game = Mock(name='game')
+        game.rooms = {'room': Mock(players=['room', 'other'])}
+        server = Server(None, Mock(name='sio'), game)
+        server.on_connect('room', {'QUERY_STRING': 'protocol=binary'})
+        server.on_connect('other', {'QUERY_STRING': 'protocol=binary'})
+
+        context.upsert('a', Position(b2Vec2(1, 1)))
+        dto = create_short_sync(context)
+        server.callback_short(dto, 'room', 'room')
+        server.callback_short(dto, 'room')
+
+        # the room packer has not announced the id to the room yet
+        packed = server.sio.emit.call_args.args[1]
+        assert packed['ids'] == {'0': 'a'}
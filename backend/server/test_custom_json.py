@@ -0,0 +1,73 @@
+import json
+import pytest
+from Box2D import b2Vec2
+import server_interfaces as si
+import server.custom_json as custom_json
+from server.custom_json import COMPACT_SEPARATORS, EnhancedJSONEncoder, RawJSON, encoder_for
+from components import Position, Velocity, Angle
+from serializer import create_short_sync, create_full_sync
+
+
+@pytest.fixture
+def context(empty_context):
+    for i in range(3):
+        empty_context.upsert(str(i), Position(b2Vec2(i / 3, -i)), Velocity(b2Vec2(0.1, 1e-5)), Angle(i * 0.7))
+    return empty_context
+
+
+def reference_dumps(data, **kwargs):
+    return json.dumps(data, cls=EnhancedJSONEncoder, **kwargs)
+
+
+class TestCustomJson:
+    @pytest.mark.parametrize('kwargs', [{}, {'separators': COMPACT_SEPARATORS}, {'sort_keys': True}])
+    def test_output_is_identical(self, context, kwargs):
+        data = [
+            create_full_sync(context, sort=True),
+            create_short_sync(context, sort=True),
+            si.ShortSyncDTO([si.ShortEntityData('a', b2Vec2(1, 2), None, 0.5)], []),
+            si.ErrorDTO(True, 500, 'message'),
+            {'vector': b2Vec2(0.1, 0.2)},
+        ]
+        for value in data:
+            assert custom_json.dumps(value, **kwargs) == reference_dumps(value, **kwargs)
+
+    def test_raw_json_is_spliced_into_top_level_list(self):
+        payload = RawJSON('{"updates":[],"remove":["a"]}')
+
+        assert custom_json.dumps(['short_sync', payload], separators=COMPACT_SEPARATORS) == \
+            '["short_sync",{"updates":[],"remove":["a"]}]'
+        assert custom_json.loads(custom_json.dumps({'payload': payload})) == {'payload': payload}
+
+    def test_encoders_are_cached(self):
+        encoder = encoder_for(si.ShortEntityData)
+        assert encoder is encoder_for(si.ShortEntityData)
+        assert encoder(si.ShortEntityData('a', angle=1)) == {'id': 'a', 'position': None, 'velocity': None, 'angle': 1}
+
+    def test_unsupported_type_raises(self):
+        assert encoder_for(object) is None
+        with pytest.raises(TypeError):
+            custom_json.dumps(object())
+
+    @pytest.mark.skipif(custom_json.orjson is None, reason='orjson is not installed')
+    def test_orjson_output_is_equivalent(self, context):
+        # decodes to the same values, but it is not byte-identical: floats may be formatted differently
+        data = create_full_sync(context, sort=True)
+        custom_json.use_orjson()
+        try:
+            encoded = custom_json.dumps(data, separators=COMPACT_SEPARATORS)
+            assert json.loads(encoded) == json.loads(reference_dumps(data))
+            assert custom_json.dumps([1e-05], separators=COMPACT_SEPARATORS) == '[0.00001]'
+        finally:
+            custom_json.use_orjson(False)
+
+
+@pytest.mark.benchmark
+class TestCustomJsonBenchmark:
+    @pytest.mark.parametrize('count', [100, 1000])
+    def test_dumps(self, measure, count):
+        updates = [si.ShortEntityData(str(i), b2Vec2(i, i), b2Vec2(1, 1), 0.5) for i in range(count)]
+        data = si.ShortSyncDTO(updates, [])
+
+        measure(lambda: reference_dumps(data, separators=COMPACT_SEPARATORS), f'{count} entities, EnhancedJSONEncoder')
+        measure(lambda: custom_json.dumps(data, separators=COMPACT_SEPARATORS), f'{count} entities, cached encoders')
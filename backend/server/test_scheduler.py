@@ -0,0 +1,57 @@
+import pytest
+from server.scheduler import RoomScheduler, Tick
+
+
+@pytest.fixture
+def scheduler():
+    return RoomScheduler(ticks_per_second=4)
+
+
+class TestRoomScheduler:
+    def test_rooms_tick_at_their_own_rate(self, scheduler):
+        scheduler.add_room('slow', now=0)
+        scheduler.add_room('fast', now=0, ticks_per_second=8)
+
+        ticked = [tick.room_id for now in [0, 0.125, 0.25, 0.375, 0.5] for tick in scheduler.pop_due(now)]
+        assert ticked.count('fast') == 5
+        assert ticked.count('slow') == 3
+
+    def test_due_ticks_are_in_deadline_order(self, scheduler):
+        scheduler.add_room('a', now=0.1)
+        scheduler.add_room('b', now=0)
+
+        assert [tick.room_id for tick in scheduler.pop_due(0.1)] == ['b', 'a']
+        assert scheduler.time_until_next(0.1) == pytest.approx(0.15)
+
+    def test_long_syncs_are_spread_over_frames(self, scheduler):
+        for room_id in 'abcd':
+            scheduler.add_room(room_id, now=0)
+
+        long_frames = {}
+        for frame in range(4):
+            for tick in scheduler.pop_due(frame / 4):
+                if tick.long:
+                    long_frames.setdefault(frame, []).append(tick.room_id)
+        assert long_frames == {0: ['a'], 1: ['b'], 2: ['c'], 3: ['d']}
+
+    def test_dt_is_time_since_last_tick(self, scheduler):
+        scheduler.add_room('a', now=0)
+        scheduler.pop_due(0)
+
+        assert scheduler.pop_due(0.3) == [Tick('a', False, pytest.approx(0.3))]
+
+    def test_missed_deadlines(self, scheduler):
+        scheduler.add_room('a', now=0)
+        scheduler.pop_due(0)
+
+        assert len(scheduler.pop_due(1)) == 1
+        assert scheduler.missed_deadlines == 1
+        assert scheduler.rooms['a'].missed_deadlines == 1
+        assert scheduler.time_until_next(1) == pytest.approx(0.25)
+
+    def test_sync_rooms(self, scheduler):
+        scheduler.add_room('a', now=0)
+        scheduler.sync_rooms(['b'], now=0)
+
+        assert 'a' not in scheduler
+        assert [tick.room_id for tick in scheduler.pop_due(0)] == ['b']
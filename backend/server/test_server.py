@@ -1,5 +1,11 @@
 from unittest.mock import Mock, call, ANY
+import pytest
+import client_interfaces as ci
+import server.custom_json as custom_json
+from game.game import Game
+from systems import SYSTEMS
 from server.server import Server
+from server.scheduler import RoomScheduler, Tick
 
 
 def fake_flag(set_after: int, initial_value=False, set_value=True):
@@ -9,32 +15,85 @@ def fake_flag(set_after: int, initial_value=False, set_value=True):
     return fake_event
 
 
-class TestServerSync:
-    def test_sync_calls_2_per_second(self):
+class TestServerScheduled:
+    def test_run_scheduled_ticks_rooms_with_players(self):
         game = Mock(name='game')
+        game.rooms = {'room0': Mock(players=['sid']), 'room1': Mock(players=[])}
         server = Server(None, Mock(name='sio'), game)
-        shutdown_flag = fake_flag(set_after=4)
-        server.sync(shutdown_flag, ticks_per_second=2)
-
-        assert len(game.method_calls) == 4
-        game.assert_has_calls([
-            call.update_long(ANY, False),
-            call.update_short(ANY, ANY, False),
-            call.update_long(ANY, False),
-            call.update_short(ANY, ANY, False),
-        ])
-
-    def test_sync_calls_5_per_second(self):
+        clock = iter([0, 0, 0.5, 0.5]).__next__
+
+        server.run_scheduled(fake_flag(set_after=2), RoomScheduler(ticks_per_second=2), clock=clock)
+
+        assert game.method_calls == [
+            call.update_rooms([Tick('room0', True, 0.5)], ANY, ANY, False),
+            call.update_rooms([Tick('room0', False, 0.5)], ANY, ANY, False),
+        ]
+
+    def test_run_scheduled_ticks_debug_room(self):
+        game = Mock(name='game')
+        game._create_room.return_value.id = 'debug'
+        game.rooms = {'debug': Mock(players=[])}
+        server = Server(None, Mock(name='sio'), game)
+        clock = iter([0, 0]).__next__
+
+        server.run_scheduled(fake_flag(set_after=1), RoomScheduler(ticks_per_second=2), debug=True, clock=clock)
+
+        game.update_rooms.assert_called_once_with([Tick('debug', True, 0.5)], ANY, ANY, False)
+
+    def test_run_scheduled_skips_rooms_that_are_gone(self):
+        game = Mock(name='game')
+        game.rooms = {'room0': Mock(players=['sid'])}
+
+        def lose_shard(*args):
+            # room0 went with a lost shard while room1 was created
+            game.rooms = {'room1': Mock(players=['other'])}
+
+        game.update_rooms.side_effect = lose_shard
+        server = Server(None, Mock(name='sio'), game)
+        clock = iter([0, 0, 0.5, 0.5]).__next__
+
+        server.run_scheduled(fake_flag(set_after=2), RoomScheduler(ticks_per_second=2), clock=clock)
+
+        game.update_rooms.assert_called_once_with([Tick('room0', True, 0.5)], ANY, ANY, False)
+
+
+class TestServerRouting:
+    def test_input_is_routed_to_room_of_player(self):
+        game = Mock(name='game')
+        game.room_of.side_effect = {'sid': 'room0'}.get
+        server = Server(None, Mock(name='sio'), game)
+
+        server.on_input('sid', {'keys_down': ['ArrowLeft'], 'keys_pressed': None, 'keys_released': None})
+        server.on_input('stranger', {'keys_down': [], 'keys_pressed': None, 'keys_released': None})
+
+        game.input.assert_called_once_with('sid', 'room0', ANY)
+
+    def test_compact_input(self):
         game = Mock(name='game')
+        game.room_of.return_value = 'room0'
         server = Server(None, Mock(name='sio'), game)
-        shutdown_flag = fake_flag(set_after=5)
-        server.sync(shutdown_flag, ticks_per_second=5)
-
-        assert len(game.method_calls) == 5
-        game.assert_has_calls([
-            call.update_long(ANY, False),
-            call.update_short(ANY, ANY, False),
-            call.update_short(ANY, ANY, False),
-            call.update_short(ANY, ANY, False),
-            call.update_short(ANY, ANY, False)
-        ])
+
+        server.on_input('sid', [7, 1, 1, 0])
+        server.on_input('sid', [7, 'left', 1, 0])
+        server.on_input('sid', [7, 1])
+
+        game.input.assert_called_once_with('sid', 'room0', ci.CompactInput(7, 1, 1, 0))
+
+
+@pytest.mark.benchmark
+class TestServerBenchmark:
+    def test_input_decoding(self, measure):
+        game = Game(SYSTEMS)
+        server = Server(None, Mock(name='sio'), game)
+        room_id = game.create_room('sid', ci.CreateRoomDTO(name='my room', private=False), Mock()).room.id
+        game.commands[room_id].rate = game.commands[room_id].burst = float('inf')
+        json_input = {'keys_down': ['ArrowLeft', 'ArrowUp'], 'keys_pressed': ['ArrowUp'], 'keys_released': None}
+        compact_input = [1, 5, 4, 0]
+
+        # applying queued inputs is the same for both, once per tick
+        def receive(data):
+            server.on_input('sid', data)
+
+        measure(lambda: receive(json_input), f'json input, {len(custom_json.dumps(json_input))} bytes', number=1000)
+        measure(lambda: receive(compact_input), f'compact input, {len(custom_json.dumps(compact_input))} bytes',
+                number=1000)
@@ -8,6 +8,7 @@ from game.game import Game
 import client_interfaces as ci
 import server_interfaces as si
 from server.server import Server
+from server.scheduler import Tick
 from repository import repository_factory
 from systems import SYSTEMS
 from Box2D import b2Vec2
@@ -79,7 +80,7 @@ class TestServerE2E:
         game.join_room.assert_called_once()
         assert game.join_room.mock_calls[0].args[0] == 'player2'
 
-        server.tick(sort=True)
+        server.tick_rooms([Tick('room0', long=True, dt=0)], sort=True)
 
         sio.emit.assert_has_calls(
             [
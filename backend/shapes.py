@@ -0,0 +1,23 @@
+from typing import Union, cast
+from Box2D import b2Body, b2Shape, b2CircleShape, b2PolygonShape
+import server_interfaces as si
+
+Shape = Union[si.RectShapeData, si.ArcShapeData]
+
+
+def get_body_shape(body: Union[b2Body, None]) -> Union[Shape, None]:
+    if body is None or len(body.fixtures) == 0:
+        return None
+    shape = body.fixtures[0].shape
+
+    return serialize_b2Shape(shape)
+
+
+def serialize_b2Shape(shape: b2Shape) -> Union[Shape, None]:
+    if isinstance(shape, b2CircleShape):
+        return cast(si.ArcShapeData, si.ArcShapeData.from_b2Circlehape(shape))
+
+    if isinstance(shape, b2PolygonShape):
+        return cast(si.PolygonShapeData, si.PolygonShapeData.from_b2PolygonShape(shape))
+
+    return None
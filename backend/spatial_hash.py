@@ -0,0 +1,114 @@
+from typing import Dict, Iterable, Iterator, Set, Tuple
+from math import floor
+from ecs.context import Context
+from components import Position
+from constants import SPATIAL_HASH_CELL_SIZE
+
+Cell = Tuple[int, int]
+Point = Tuple[float, float]
+
+
+class SpatialHash:
+    """Index of entity positions on a uniform grid, answering which entities are near a point or in an area.
+
+    The index does not follow its context by itself: callers pass the entities they already read
+    as updated or removed from their own consumer to update(), so the index takes no consumer of
+    the context. Queries see the positions of the last update of an entity. PhysicsSystem keeps
+    the index of a room in its SpatialIndex singleton up to date.
+    """
+
+    def __init__(self, context: Context, cell_size: float = SPATIAL_HASH_CELL_SIZE):
+        self.context = context
+        self.cell_size = cell_size
+        self.cells: Dict[Cell, Set[str]] = {}
+        self.positions: Dict[str, Point] = {}
+        self._entity_cells: Dict[str, Cell] = {}
+        self._move(context.query(Position).entities)
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __contains__(self, entity_id: str) -> bool:
+        return entity_id in self.positions
+
+    def update(self, updated: Iterable[str] = (), removed: Iterable[str] = ()):
+        """Move updated entities to the cells of their current positions and drop removed ones"""
+
+        for entity_id in removed:
+            self._discard(entity_id)
+        if updated:
+            self._move(updated)
+
+    def query_aabb(self, lower: Point, upper: Point) -> Set[str]:
+        """Return entities with a position inside the axis aligned box from lower to upper"""
+
+        (min_x, min_y), (max_x, max_y) = lower, upper
+        positions = self.positions
+        return {
+            entity_id
+            for entity_ids in self._cells_in(lower, upper)
+            for entity_id in entity_ids
+            if min_x <= positions[entity_id][0] <= max_x and min_y <= positions[entity_id][1] <= max_y
+        }
+
+    def query_radius(self, center: Point, radius: float) -> Set[str]:
+        """Return entities with a position at most radius away from center"""
+
+        x, y = center
+        squared = radius * radius
+        positions = self.positions
+        found = set()
+        for entity_ids in self._cells_in((x - radius, y - radius), (x + radius, y + radius)):
+            for entity_id in entity_ids:
+                entity_x, entity_y = positions[entity_id]
+                if (entity_x - x) ** 2 + (entity_y - y) ** 2 <= squared:
+                    found.add(entity_id)
+        return found
+
+    def _cells_in(self, lower: Point, upper: Point) -> Iterator[Set[str]]:
+        low_x, low_y = self._cell(lower)
+        high_x, high_y = self._cell(upper)
+        if (high_x - low_x + 1) * (high_y - low_y + 1) > len(self.cells):
+            # a large area covers more cells than are occupied
+            for (cell_x, cell_y), entity_ids in self.cells.items():
+                if low_x <= cell_x <= high_x and low_y <= cell_y <= high_y:
+                    yield entity_ids
+            return
+        cells = self.cells
+        for cell_x in range(low_x, high_x + 1):
+            for cell_y in range(low_y, high_y + 1):
+                entity_ids = cells.get((cell_x, cell_y))
+                if entity_ids:
+                    yield entity_ids
+
+    def _cell(self, point: Point) -> Cell:
+        return floor(point[0] / self.cell_size), floor(point[1] / self.cell_size)
+
+    def _move(self, entity_ids: Iterable[str]):
+        entity_ids = list(entity_ids)
+        for entity_id, position in zip(entity_ids, self.context.get_many(entity_ids, Position)):
+            if position is None:
+                self._discard(entity_id)
+                continue
+            point = (position.position[0], position.position[1])
+            cell = self._cell(point)
+            self.positions[entity_id] = point
+            old_cell = self._entity_cells.get(entity_id)
+            if old_cell == cell:
+                continue
+            if old_cell is not None:
+                self._leave(entity_id, old_cell)
+            self._entity_cells[entity_id] = cell
+            self.cells.setdefault(cell, set()).add(entity_id)
+
+    def _discard(self, entity_id: str):
+        cell = self._entity_cells.pop(entity_id, None)
+        if cell is not None:
+            del self.positions[entity_id]
+            self._leave(entity_id, cell)
+
+    def _leave(self, entity_id: str, cell: Cell):
+        entity_ids = self.cells[cell]
+        entity_ids.discard(entity_id)
+        if not entity_ids:
+            del self.cells[cell]
@@ -1,9 +1,9 @@
-from typing import Callable, Tuple
+from typing import Container, Dict, List, Sequence, Set, Tuple
 from ecs.base_system import System
 from ecs.context import Context
-from systems.physics_system import PhysicsSystem
+from systems.physics_system import PhysicsSystem, WakeListener
 from components import Box2DBody, Box2DWorld, Collidable
-from Box2D import b2ContactListener, b2Contact
+from Box2D import b2Contact, b2Fixture
 
 
 class ContactSystem(System):
@@ -11,63 +11,97 @@ class ContactSystem(System):
 
     def __init__(self, context: Context):
         self.context = context
+        self.collidables = context.query(Box2DBody, Collidable)
 
     def on_game_init(self, room):  # type:ignore
         self._add_contact_listener()
 
+    def on_update_frame(self, dt: float):
+        # runs after PhysicsSystem stepped the world
+        self.apply_contacts(*self.listener.take())
+
+    def apply_contacts(self, entity_ids: Sequence[str], begins: bytes):
+        """Update collides_with of collidables for contacts begun and ended, in the order they happened.
+
+        Contact i is one of collidable entity_ids[2 * i] with entity_ids[2 * i + 1] and began if
+        begins[i] is set.
+        """
+
+        # only the last contact of an entity with another matters
+        touching: Dict[Tuple[str, str], int] = {}
+        for entity_id, other, begin in zip(entity_ids[0::2], entity_ids[1::2], begins):
+            if entity_id != other:
+                touching[entity_id, other] = begin
+
+        involved = list({entity_id for entity_id, _ in touching})
+        collides_with: Dict[str, Set[str]] = {
+            entity_id: collidable.collides_with
+            for entity_id, collidable in zip(involved, self.context.get_many(involved, Collidable)) if collidable}
+        for (entity_id, other), begin in touching.items():
+            if entity_id in collides_with:
+                if begin:
+                    collides_with[entity_id].add(other)
+                else:
+                    collides_with[entity_id].discard(other)
+
     def _add_contact_listener(self):
         world = self._get_world()
-        world.contactListener = EntityContactListener(
-            begin_contact=self.begin_contact,
-            end_contact=self.end_contact
-        )
-
-    def begin_contact(self, entity_a: str, entity_b: str):
-        collides = {entity_a, entity_b}
-        entity_ids = collides.intersection(self.context.get_entities_with(Box2DBody, Collidable))
+        self.listener = EntityContactListener(self.context, self.collidables)
+        world.contactListener = self.listener
 
-        for entity_id in entity_ids:
-            self.context.get_definitely(entity_id, Collidable).collides_with.update(collides - {entity_id})
+    def _get_world(self):
+        return self.context.singleton(Box2DWorld, field='world')
 
-    def end_contact(self, entity_a: str, entity_b: str):
-        collides = {entity_a, entity_b}
-        entity_ids = collides.intersection(self.context.get_entities_with(Box2DBody, Collidable))
 
-        for entity_id in entity_ids:
-            collidable = self.context.get_definitely(entity_id, Collidable)
+class EntityContactListener(WakeListener):
+    """Records contacts begun and ended during world steps, the ones collidable entities subscribed to.
 
-            collidable.collides_with.discard(entity_a)
-            collidable.collides_with.discard(entity_b)
+    A collidable entity subscribes to contacts with fixtures of the categories in its Collidable.
+    Each contact is recorded once for every subscribed entity of it, as the ids of the entity and
+    the other one in a flat list and whether the contact began in a bytearray, to be taken and
+    applied as a batch after the step.
+    """
 
-    def _get_world(self):
-        return self.context.singleton(Box2DWorld, field='world')
+    def __init__(self, context: Context, collidables: Container[str]):
+        WakeListener.__init__(self)
+        self.context = context
+        self.collidables = collidables
+        self.entity_ids: List[str] = []
+        self.begins = bytearray()
 
+    def take(self) -> Tuple[List[str], bytearray]:
+        """Return recorded contacts and start recording anew"""
 
-class EntityContactListener(b2ContactListener):
-    def __init__(self, begin_contact: Callable = None, end_contact=None):
-        b2ContactListener.__init__(self)
-        self.begin_contact_callback = begin_contact
-        self.end_contact_callback = end_contact
+        recorded = self.entity_ids, self.begins
+        self.entity_ids = []
+        self.begins = bytearray()
+        return recorded
 
     def BeginContact(self, contact: b2Contact) -> None:
-        if self.begin_contact_callback:
-            entity_a, entity_b = self._get_entities(contact)
-            if entity_a and entity_b:
-                self.begin_contact_callback(entity_a, entity_b)
+        WakeListener.BeginContact(self, contact)
+        self._record(contact, 1)
 
     def EndContact(self, contact: b2Contact) -> None:
-        if self.end_contact_callback:
-            entity_a, entity_b = self._get_entities(contact)
-            if entity_a and entity_b:
-                self.end_contact_callback(entity_a, entity_b)
-
-    def PreSolve(self, contact, oldManifold) -> None:
-        pass
-
-    def PostSolve(self, contact, impulse) -> None:
-        pass
-
-    def _get_entities(self, contact: b2Contact) -> Tuple[str, str]:
-        entity_a = contact.fixtureA.body.userData
-        entity_b = contact.fixtureB.body.userData
-        return entity_a, entity_b
+        self._record(contact, 0)
+
+    def _record(self, contact: b2Contact, begin: int):
+        fixture_a = contact.fixtureA
+        fixture_b = contact.fixtureB
+        entity_a = fixture_a.body.userData
+        entity_b = fixture_b.body.userData
+        if not (entity_a and entity_b):
+            return
+        if self._subscribed(entity_a, fixture_b):
+            self.entity_ids.append(entity_a)
+            self.entity_ids.append(entity_b)
+            self.begins.append(begin)
+        if self._subscribed(entity_b, fixture_a):
+            self.entity_ids.append(entity_b)
+            self.entity_ids.append(entity_a)
+            self.begins.append(begin)
+
+    def _subscribed(self, entity_id: str, other: b2Fixture) -> bool:
+        if entity_id not in self.collidables:
+            return False
+        categories = self.context.get_definitely(entity_id, Collidable).categories
+        return bool(categories & other.filterData.categoryBits)
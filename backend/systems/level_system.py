@@ -4,10 +4,10 @@ from Box2D import b2Body, b2Vec2
 from ecs.base_system import System
 from ecs.context import Context
 from components import Match
-from components import Box2DBody, Box2DWorld, Position, Velocity, Angle, Collidable
+from components import Box2DBody, Box2DWorld, Position, Velocity, Angle, CollisionFilter
 import server_interfaces as si
 import client_interfaces as ci
-from constants import ENTER
+from constants import CollisionCategory, InputKey
 from systems.physics_system import PhysicsSystem
 
 
@@ -25,8 +25,8 @@ class LevelSystem(System):
             box_body = self._spawn_box(f'box{i}', (4, -i))
             self.bodies.append(box_body)
 
-    def on_input(self, sid: str, data: ci.InputDTO):
-        restart = ENTER in (data.keys_released or [])
+    def on_input(self, sid: str, data: ci.CompactInput):
+        restart = data.released & InputKey.ENTER
 
         if restart:
             logging.info('restart')
@@ -34,6 +34,8 @@ class LevelSystem(System):
                 body.awake = True
                 body.angle = 0
                 body.position = b2Vec2(4, -i)
+                # lets PhysicsSystem know the body woke up
+                self.context.mark_entity_updated(body.userData, Box2DBody)
 
     def _spawn_box(self, entity_id: str, pos: Tuple):
         world = self._get_world()
@@ -44,7 +46,7 @@ class LevelSystem(System):
 
         position = Position.from_body(box_body)
         velocity = Velocity.from_body(box_body)
-        collidable = Collidable()
+        collision_filter = CollisionFilter(CollisionCategory.BOX)
         angle = Angle.Straight()
 
         self.context.upsert(
@@ -52,7 +54,7 @@ class LevelSystem(System):
             body,
             position,
             velocity,
-            collidable,
+            collision_filter,
             angle
         )
         return box_body
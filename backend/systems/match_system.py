@@ -2,7 +2,8 @@ from ecs.base_system import System
 from ecs.context import Context
 from components import Match
 from components import Box2DBody, Box2DWorld, Position, Velocity
-from components import Ball, Collidable
+from components import Ball, CollisionFilter
+from constants import CollisionCategory
 import server_interfaces as si
 from systems.player_system import PlayerSystem
 
@@ -24,7 +25,7 @@ class MatchSystem(System):
         ball_body = world.CreateDynamicBody(position=(3, 0))
         ball_body.CreateCircleFixture(radius=0.5, density=0.5, friction=0.5)
         body = Box2DBody(ball_body)
-        collidable = Collidable()
+        collision_filter = CollisionFilter(CollisionCategory.BALL)
 
         position = Position.from_body(ball_body)
         velocity = Velocity.from_body(ball_body)
@@ -36,7 +37,7 @@ class MatchSystem(System):
             position,
             velocity,
             ball,
-            collidable
+            collision_filter
         )
 
     def _get_world(self):
@@ -1,39 +1,195 @@
-from typing import Tuple, Dict
+import logging
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional, Set, Type, Union
+from ecs.base_component import Component
 from ecs.base_system import System
 from ecs.context import Context
-from components import Box2DBody, Box2DWorld, Position, Velocity, Input, Collidable, Angle
-from Box2D import b2World, b2EdgeShape, b2Vec2
-from constants import BOX2D_VEL_ITERS, BOX2D_POS_ITERS, BodyType
+from components import (
+    Box2DBody, Box2DWorld, Position, Velocity, Input, Collidable, Angle, CollisionFilter, SpatialIndex)
+from Box2D import (
+    b2World, b2Body, b2EdgeShape, b2Vec2, b2Contact, b2ContactFilter, b2ContactListener, b2Filter, b2Fixture)
+from constants import (
+    BOX2D_VEL_ITERS, BOX2D_POS_ITERS, PHYSICS_TIMESTEP, PHYSICS_MAX_SUBSTEPS, PHYSICS_AWAKE_SCAN_INTERVAL, BodyType)
+from spatial_hash import SpatialHash
+from systems.solver_iterations import AdaptiveIterations, FixedIterations, Iterations, StepStats
+
+IterationPolicy = Union[AdaptiveIterations, FixedIterations]
 
 
 class PhysicsSystem(System):
-    def __init__(self, context: Context):
+    """Steps the Box2D world.
+
+    With a timestep, the world advances in fixed steps: frame times add up in an accumulator and
+    each frame runs as many whole steps as fit, at most `max_substeps`. Time beyond that is dropped
+    so a stall does not make the following frames even slower. Without one, the world steps by
+    the frame time. The leftover fraction of a timestep is reported as alpha, short syncs
+    extrapolate positions by it (see serializer.physics_lead).
+
+    Solver iterations of each step come from the iteration policy, adaptive by default, and are
+    reported on the Box2DWorld singleton.
+
+    Only entities of awake bodies are marked updated, each once more when its body falls asleep.
+    Other systems waking or moving a body mark its Box2DBody updated.
+
+    The CollisionFilter of an entity is applied to the fixtures of its body before the next step.
+
+    The SpatialIndex singleton follows the entities marked updated, new or changed bodies and
+    removed entities after every frame, so systems can ask what is near a point.
+    """
+
+    def __init__(self, context: Context, timestep: Optional[float] = PHYSICS_TIMESTEP,
+                 max_substeps: int = PHYSICS_MAX_SUBSTEPS, iteration_policy: Optional[IterationPolicy] = None,
+                 scan_interval: int = PHYSICS_AWAKE_SCAN_INTERVAL):
         self.context = context
+        self.timestep = timestep
+        self.max_substeps = max_substeps
+        self.accumulator = 0.0
+        self.iteration_policy = iteration_policy or AdaptiveIterations()
+        self.iterations: Iterations = (BOX2D_VEL_ITERS, BOX2D_POS_ITERS)
+        self._step_seconds = 0.0
+        self.scan_interval = scan_interval
+        self.bodies = context.query(Box2DBody)
+        self.positions = context.query(Position)
+        self.velocities = context.query(Velocity)
+        self.filtered = context.query(Box2DBody, CollisionFilter)
+        # entities of non-static bodies awake after the last frame
+        self.awake: Set[str] = set()
+        self._frame = 0
+        # Box2DBody updates announce new bodies and bodies woken by other systems, CollisionFilter
+        # updates filters to apply, removed entities leave the spatial index
+        context.add_consumer(self)
+
+    @property
+    def alpha(self) -> float:
+        """Return fraction of a timestep the world is behind real time"""
+        return self.accumulator / self.timestep if self.timestep else 0.0
 
     def on_game_init(self, room):  # type:ignore
         self._create_world()
 
     def on_update_frame(self, dt: float):
         world = self._get_world()
-        entity_data = self.context.all_dict(
-            Box2DBody, optional_components=[Position, Velocity, Input, Collidable, Angle])
-        self.do_update(entity_data, world, dt)
-        for entity_id, data in entity_data.items():
-            body, position, velocity, input, collidable, angle = data
-            self._mark_entity_updated(entity_id, body, position, velocity, angle)
-
-    def do_update(self, entity_data: Dict[str, Tuple], world: b2World, dt: float) -> None:
-        # flush contactlisteners
-        world.Step(0, 0, 0)
-        for entity_id, data in entity_data.items():
-            body, position, velocity, input, collidable, angle = data
-            self._mark_entity_updated(entity_id, body, position, velocity, angle)
-            if input:
-                self._handle_input(entity_id, body, input, collidable)
-
-        world.Step(dt, BOX2D_VEL_ITERS, BOX2D_POS_ITERS)
+        self._apply_collision_filters()
+        controlled = self.context.all_dict(Box2DBody, Input, optional_components=[Collidable])
+        for entity_id, (body, input, collidable) in controlled.items():
+            self._handle_input(entity_id, body, input, collidable)
+        self.do_update(world, dt)
+        # forces woke the bodies of controlled entities
+        self._update_awake(world, controlled)
+
+    def do_update(self, world: b2World, dt: float) -> None:
+        # static bodies count as sleeping
+        bodies = len(self.bodies)
+        sleeping = bodies - len(self.awake)
+        self._choose_iterations(StepStats(world.contactCount, bodies, sleeping, self._step_seconds, self.iterations))
+        velocity_iterations, position_iterations = self.iterations
+        start = perf_counter()
+        if not self.timestep:
+            world.Step(dt, velocity_iterations, position_iterations)
+            steps = 1
+        else:
+            steps = self._substeps(dt)
+            for _ in range(steps):
+                world.Step(self.timestep, velocity_iterations, position_iterations)
+        if steps:
+            self._step_seconds = (perf_counter() - start) / steps
         world.ClearForces()
 
+        world_component = self.context.singleton(Box2DWorld)
+        world_component.iterations = self.iterations
+        if self.timestep:
+            world_component.timestep = self.timestep
+            world_component.alpha = self.alpha
+
+    def _update_awake(self, world: b2World, pushed: Iterable[str] = ()):
+        """Mark entities of awake bodies updated, and once more the ones that came to rest.
+
+        Only bodies awake after the last frame are checked, along with the ones that may have
+        woken up: bodies Box2D woke by creating or touching a contact, which the contact filter and
+        listener record, bodies pushed by input and bodies created or changed, which is announced
+        by marking their Box2DBody updated. A body waking up wakes the ones it already touches, so
+        contact edges of newly awake bodies are followed. Every `scan_interval` frames all bodies
+        are checked, in case a replaced filter or listener missed some.
+        """
+
+        self._frame += 1
+        changed = self.context.get_updated_entities_for(Box2DBody, consumer=self)
+        if self.scan_interval and self._frame % self.scan_interval == 0:
+            candidates = set(self.bodies)
+        else:
+            candidates = self.awake.union(pushed, changed, self._take_woken(world))
+
+        awake: Dict[str, b2Body] = {}
+        ids = list(candidates)
+        frontier = [
+            (entity_id, body.body) for entity_id, body in zip(ids, self.context.get_many(ids, Box2DBody)) if body]
+        while frontier:
+            entity_id, body = frontier.pop()
+            if not body.awake or body.type == BodyType.STATIC:
+                continue
+            awake[entity_id] = body
+            if entity_id in self.awake:
+                continue
+            for edge in body.contacts:
+                other = edge.other
+                if other.userData not in candidates and other.awake:
+                    candidates.add(other.userData)
+                    frontier.append((other.userData, other))
+
+        # sleeping bodies have zero velocity, a last update lets clients stop extrapolating them
+        came_to_rest = list(self.awake.difference(awake).intersection(self.bodies.entities))
+        self.awake = set(awake)
+        for entity_id, body in zip(came_to_rest, self.context.get_many(came_to_rest, Box2DBody)):
+            awake[entity_id] = body.body  # type:ignore
+        for (entity_id, body), angle in zip(awake.items(), self.context.get_many(awake, Angle)):
+            self._mark_entity_updated(entity_id, body, angle)
+        self._update_spatial_index(changed.union(awake))
+
+    def _update_spatial_index(self, updated: Set[str]):
+        index = self.context.singleton(SpatialIndex, field='index')
+        index.update(updated, self.context.get_removed_entities(consumer=self))
+
+    def _apply_collision_filters(self):
+        """Set filter data of fixtures of entities with a new CollisionFilter or Box2DBody"""
+
+        changed = self.context.get_updated_entities_for(CollisionFilter, consumer=self)
+        # Box2DBody updates are read again after the step
+        changed |= self.context.get_updated_entities_for(Box2DBody, reset=False, consumer=self)
+        entity_ids = list(changed.intersection(self.filtered.entities))
+        get_many = self.context.get_many
+        for body, collision_filter in zip(get_many(entity_ids, Box2DBody), get_many(entity_ids, CollisionFilter)):
+            filter_data = b2Filter(
+                categoryBits=collision_filter.category,  # type:ignore
+                maskBits=collision_filter.mask,  # type:ignore
+                groupIndex=collision_filter.group)  # type:ignore
+            for fixture in body.body.fixtures:  # type:ignore
+                fixture.filterData = filter_data
+
+    def _take_woken(self, world: b2World) -> Set[str]:
+        woken: Set[str] = set()
+        for recorder in (world.contactFilter, world.contactListener):
+            if isinstance(recorder, (WakeFilter, WakeListener)):
+                woken |= recorder.woken
+                recorder.woken = set()
+        return woken
+
+    def _choose_iterations(self, stats: StepStats):
+        iterations = self.iteration_policy.choose(stats)
+        if iterations != self.iterations:
+            logging.debug(f'solver iterations {self.iterations} -> {iterations} for {stats}')
+            self.iterations = iterations
+
+    def _substeps(self, dt: float) -> int:
+        self.accumulator += dt
+        # tolerate rounding errors of adding up frame times
+        steps = int(self.accumulator / self.timestep + 1e-9)  # type:ignore
+        if steps > self.max_substeps:
+            steps = self.max_substeps
+            self.accumulator = self.accumulator % self.timestep  # type:ignore
+        else:
+            self.accumulator = max(0.0, self.accumulator - steps * self.timestep)  # type:ignore
+        return steps
+
     def _handle_input(self, entity_id: str, body: Box2DBody, input: Input, collidable: Collidable = None):
         if input.move_right:
             body.body.ApplyForceToCenter(b2Vec2(5, 0), True)
@@ -46,27 +202,25 @@ class PhysicsSystem(System):
         if input.jump and collidable and 'floor' in collidable.collides_with:
             body.body.ApplyLinearImpulse(b2Vec2(0, 3), body.body.position, True)
 
-    def _mark_entity_updated(
-            self,
-            entity_id: str,
-            body: Box2DBody,
-            position: Position,
-            velocity: Velocity,
-            angle: Angle):
-        if not body.body.awake or body.body.type == BodyType.STATIC:
-            return
-
-        if position:
-            self.context.mark_entity_updated(entity_id, Position)
-        if velocity:
-            self.context.mark_entity_updated(entity_id, Velocity)
-        if body and angle:
-            self.context.component(entity_id, Angle).angle = body.body.angle  # type:ignore
-            self.context.mark_entity_updated(entity_id, Angle)
+    def _mark_entity_updated(self, entity_id: str, body: b2Body, angle: Optional[Angle]):
+        updated: List[Type[Component]] = []
+        if entity_id in self.positions:
+            updated.append(Position)
+        if entity_id in self.velocities:
+            updated.append(Velocity)
+        if angle:
+            angle.angle = body.angle
+            updated.append(Angle)
+        self.context.mark_entity_updated(entity_id, *updated)
 
     def _create_world(self):
         world = b2World(gravity=(0, -10), doSleep=True)
+        # forces apply to every substep of a frame, they are cleared after the last one
+        world.autoClearForces = False
+        world.contactFilter = WakeFilter()
+        world.contactListener = WakeListener()
         self.context.new_singleton(Box2DWorld(world))
+        self.context.new_singleton(SpatialIndex(SpatialHash(self.context)))
 
         # left wall
         world.CreateStaticBody(
@@ -85,3 +239,50 @@ class PhysicsSystem(System):
 
     def _get_world(self):
         return self.context.singleton(Box2DWorld, field='world')
+
+
+def _record_wakes(woken: Set[str], body_a: b2Body, body_b: b2Body):
+    if not (body_a.awake and body_b.awake):
+        woken.add(body_a.userData)
+        woken.add(body_b.userData)
+
+
+class WakeFilter(b2ContactFilter):
+    """Records entities of bodies getting a contact with a sleeping body, which wakes it up.
+
+    Filters like Box2D's default contact filter.
+    """
+
+    def __init__(self):
+        b2ContactFilter.__init__(self)
+        self.woken: Set[str] = set()
+
+    def ShouldCollide(self, fixture_a: b2Fixture, fixture_b: b2Fixture) -> bool:
+        _record_wakes(self.woken, fixture_a.body, fixture_b.body)
+        filter_a = fixture_a.filterData
+        filter_b = fixture_b.filterData
+        if filter_a.groupIndex == filter_b.groupIndex and filter_a.groupIndex != 0:
+            return filter_a.groupIndex > 0
+        return bool(filter_a.maskBits & filter_b.categoryBits and filter_a.categoryBits & filter_b.maskBits)
+
+
+class WakeListener(b2ContactListener):
+    """Records entities of bodies that began touching a sleeping body, which wakes it up.
+
+    PhysicsSystem installs one on the world, systems replacing it extend this class.
+    """
+
+    def __init__(self):
+        b2ContactListener.__init__(self)
+        self.woken: Set[str] = set()
+
+    def BeginContact(self, contact: b2Contact) -> None:
+        _record_wakes(self.woken, contact.fixtureA.body, contact.fixtureB.body)
+
+    # pybox2d calls these for every contact of every step whether they are overridden or not, and
+    # its default ones call back into Box2D, so doing nothing here is the cheapest option
+    def PreSolve(self, contact, oldManifold) -> None:
+        pass
+
+    def PostSolve(self, contact, impulse) -> None:
+        pass
@@ -4,9 +4,9 @@ from ecs.base_system import System
 from ecs.context import Context
 from collections import defaultdict
 import client_interfaces as ci
-from components import Box2DBody, Box2DWorld, Position, Velocity, Collidable, Angle
+from components import Box2DBody, Box2DWorld, Position, Velocity, Collidable, CollisionFilter, Angle
 from components import Player, Match, Team, Input
-from constants import LEFT, RIGHT, UP
+from constants import CollisionCategory
 from random import random
 
 
@@ -23,17 +23,8 @@ class PlayerSystem(System):
     def on_player_leave(self, sid: str):
         self._remove_player(sid)
 
-    def on_input(self, sid: str, data: ci.InputDTO):
-        move_left = LEFT in data.keys_down
-        move_right = RIGHT in data.keys_down
-
-        input_ = Input(
-            move_left=move_left and not move_right,
-            move_right=move_right and not move_left,
-            jump=UP in data.keys_down
-        )
-
-        self.context.upsert(sid, input_)
+    def on_input(self, sid: str, data: ci.CompactInput):
+        self.context.upsert(sid, Input.from_bits(data.down))
 
     def _spawn_player(self, entity_id: str):
         world = self._get_world()
@@ -50,7 +41,9 @@ class PlayerSystem(System):
         position = Position.from_body(player_body)
         velocity = Velocity.from_body(player_body)
         player = Player(color=int('0xff0000', 16))
-        collidable = Collidable()
+        # jumping needs to know about touching the floor only
+        collidable = Collidable(categories=CollisionCategory.WORLD)
+        collision_filter = CollisionFilter(CollisionCategory.PLAYER)
         angle = Angle.Straight()
 
         self.context.upsert(
@@ -60,6 +53,7 @@ class PlayerSystem(System):
             velocity,
             player,
             collidable,
+            collision_filter,
             angle
         )
 
@@ -0,0 +1,74 @@
+from typing import Tuple
+from dataclasses import dataclass
+from constants import (
+    BOX2D_VEL_ITERS, BOX2D_POS_ITERS, BOX2D_MIN_VEL_ITERS, BOX2D_MIN_POS_ITERS, PHYSICS_STEP_BUDGET,
+    CONTACTS_FOR_MAX_ITERS)
+
+Iterations = Tuple[int, int]
+
+
+@dataclass
+class StepStats:
+    """What the last step of a world looked like"""
+    contacts: int
+    bodies: int
+    sleeping: int
+    seconds: float = 0.0
+    iterations: Iterations = (0, 0)
+
+
+class FixedIterations:
+    def __init__(self, velocity_iterations: int = BOX2D_VEL_ITERS, position_iterations: int = BOX2D_POS_ITERS):
+        self.iterations = (velocity_iterations, position_iterations)
+
+    def choose(self, stats: StepStats) -> Iterations:
+        return self.iterations
+
+
+class AdaptiveIterations:
+    """Picks solver iterations from how much is going on in the world and how long steps take.
+
+    Iterations grow from the minimum towards the maximum with the number of contacts between
+    awake bodies; a world that is mostly asleep or has few contacts does not need many. The
+    result is then scaled down if the measured time per iteration says a step would take longer
+    than the budget.
+    """
+
+    def __init__(self,
+                 minimum: Iterations = (BOX2D_MIN_VEL_ITERS, BOX2D_MIN_POS_ITERS),
+                 maximum: Iterations = (BOX2D_VEL_ITERS, BOX2D_POS_ITERS),
+                 budget: float = PHYSICS_STEP_BUDGET,
+                 contacts_for_max: int = CONTACTS_FOR_MAX_ITERS,
+                 smoothing: float = 0.2):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.budget = budget
+        self.contacts_for_max = contacts_for_max
+        self.smoothing = smoothing
+        self.seconds_per_iteration = 0.0
+
+    def choose(self, stats: StepStats) -> Iterations:
+        self._measure(stats)
+
+        awake_ratio = 1 - stats.sleeping / stats.bodies if stats.bodies else 0.0
+        demand = min(1.0, stats.contacts * awake_ratio / self.contacts_for_max)
+        velocity, position = (
+            round(low + (high - low) * demand) for low, high in zip(self.minimum, self.maximum))
+
+        if self.seconds_per_iteration and self.budget:
+            affordable = self.budget / self.seconds_per_iteration
+            if velocity + position > affordable:
+                scale = affordable / (velocity + position)
+                velocity = max(self.minimum[0], int(velocity * scale))
+                position = max(self.minimum[1], int(position * scale))
+        return velocity, position
+
+    def _measure(self, stats: StepStats):
+        total_iterations = sum(stats.iterations)
+        if not stats.seconds or not total_iterations:
+            return
+        seconds_per_iteration = stats.seconds / total_iterations
+        if not self.seconds_per_iteration:
+            self.seconds_per_iteration = seconds_per_iteration
+        else:
+            self.seconds_per_iteration += self.smoothing * (seconds_per_iteration - self.seconds_per_iteration)
@@ -1,8 +1,20 @@
 import pytest
 from unittest.mock import Mock, MagicMock
 from systems.contact_system import ContactSystem, EntityContactListener
+from systems.physics_system import WakeListener
 from components import Box2DWorld, Box2DBody, Collidable
-from Box2D import b2Contact
+from Box2D import b2Contact, b2ContactListener, b2EdgeShape, b2World
+from constants import CollisionCategory
+
+
+def make_contact(entity_a: str, entity_b: str, category_a: int = CollisionCategory.WORLD,
+                 category_b: int = CollisionCategory.WORLD) -> b2Contact:
+    contact = Mock()
+    contact.fixtureA.body.userData = entity_a
+    contact.fixtureA.filterData.categoryBits = category_a
+    contact.fixtureB.body.userData = entity_b
+    contact.fixtureB.filterData.categoryBits = category_b
+    return contact
 
 
 @pytest.fixture
@@ -29,15 +41,17 @@ class TestContactSystem:
         system.on_game_init(None)
 
         assert isinstance(world.world.contactListener, EntityContactListener)
+        # keeps recording bodies woken by contacts for PhysicsSystem
+        assert isinstance(world.world.contactListener, WakeListener)
 
     def test_begin_contact_updates_collidable(self, system, context, world):
         system.on_game_init(None)
-        contact: b2Contact = Mock()
-        contact.fixtureA.body.userData = 'body1'
-        contact.fixtureB.body.userData = 'body2'
+        contact = make_contact('body1', 'body2')
 
         world.world.contactListener.BeginContact(contact)
+        assert context.component('body1', Collidable).collides_with == set()
 
+        system.on_update_frame(1)
         assert context.component('body1', Collidable).collides_with == {'body2'}
         assert context.component('body2', Collidable).collides_with == {'body1'}
 
@@ -46,11 +60,176 @@ class TestContactSystem:
         context.component('body1', Collidable).collides_with.add('body2')
         context.component('body2', Collidable).collides_with.add('body1')
 
-        contact: b2Contact = Mock()
-        contact.fixtureA.body.userData = 'body1'
-        contact.fixtureB.body.userData = 'body2'
+        contact = make_contact('body1', 'body2')
 
         world.world.contactListener.EndContact(contact)
+        system.on_update_frame(1)
 
         assert context.component('body1', Collidable).collides_with == set()
         assert context.component('body2', Collidable).collides_with == set()
+
+    def test_contacts_are_applied_in_order(self, system, context, world):
+        system.on_game_init(None)
+        contact = make_contact('body1', 'body2')
+
+        world.world.contactListener.BeginContact(contact)
+        world.world.contactListener.EndContact(contact)
+        world.world.contactListener.BeginContact(contact)
+        system.on_update_frame(1)
+
+        assert context.component('body1', Collidable).collides_with == {'body2'}
+        assert world.world.contactListener.entity_ids == []
+
+    def test_contact_begun_and_ended_in_one_frame_changes_nothing(self, system, context, world):
+        system.on_game_init(None)
+        context.component('body1', Collidable).collides_with.add('body2')
+        context.component('body2', Collidable).collides_with.add('body1')
+        contact = make_contact('body1', 'body2')
+
+        world.world.contactListener.EndContact(contact)
+        world.world.contactListener.BeginContact(contact)
+        system.on_update_frame(1)
+
+        assert context.component('body1', Collidable).collides_with == {'body2'}
+        assert context.component('body2', Collidable).collides_with == {'body1'}
+
+    def test_contacts_without_collidables_are_not_recorded(self, system, context, world):
+        system.on_game_init(None)
+        context.upsert('wall', Box2DBody(Mock()))
+        contact = make_contact('wall', 'floor')
+
+        world.world.contactListener.BeginContact(contact)
+        assert world.world.contactListener.entity_ids == []
+
+    def test_apply_contacts_updates_collidables_only(self, system, context):
+        context.upsert('wall', Box2DBody(Mock()))
+        system.apply_contacts(['body1', 'wall', 'wall', 'body2', 'body2', 'wall'], bytearray([1, 1, 1]))
+
+        assert context.component('body1', Collidable).collides_with == {'wall'}
+        assert context.component('body2', Collidable).collides_with == {'wall'}
+
+    def test_contacts_are_recorded_for_subscribed_categories(self, system, context, world):
+        system.on_game_init(None)
+        context.upsert('player', Box2DBody(Mock()), Collidable(categories=CollisionCategory.WORLD))
+
+        world.world.contactListener.BeginContact(
+            make_contact('player', 'body1', CollisionCategory.PLAYER, CollisionCategory.BOX))
+        world.world.contactListener.BeginContact(
+            make_contact('player', 'floor', CollisionCategory.PLAYER, CollisionCategory.WORLD))
+        system.on_update_frame(1)
+
+        assert context.component('player', Collidable).collides_with == {'floor'}
+        assert context.component('body1', Collidable).collides_with == {'player'}
+
+
+def begin_contact_with_intersection(context, entity_a: str, entity_b: str):
+    """Contact handling before cached queries, kept for comparison"""
+    collides = {entity_a, entity_b}
+    entity_ids = collides.intersection(context.get_entities_with(Box2DBody, Collidable))
+
+    for entity_id in entity_ids:
+        context.get_definitely(entity_id, Collidable).collides_with.update(collides - {entity_id})
+
+
+def apply_contacts_one_by_one(system: ContactSystem, events):
+    """Contact handling before contacts were applied as a batch, kept for comparison"""
+    for begin, entity_a, entity_b in events:
+        if entity_a == entity_b:
+            continue
+        for entity_id, other in ((entity_a, entity_b), (entity_b, entity_a)):
+            if entity_id in system.collidables:
+                collides_with = system.context.get_definitely(entity_id, Collidable).collides_with
+                if begin:
+                    collides_with.add(other)
+                else:
+                    collides_with.discard(other)
+
+
+def collisions_of_boxes(context, count: int):
+    """Return and clear what every box collides with"""
+    collisions = {}
+    for i in range(count):
+        collides_with = context.component(f'box{i}', Collidable).collides_with
+        collisions[f'box{i}'] = set(collides_with)
+        collides_with.clear()
+    return collisions
+
+
+class ListenerWithDefaultSolveCallbacks(b2ContactListener):
+    """Listener leaving PreSolve and PostSolve to pybox2d, as EntityContactListener did, kept for comparison"""
+
+    def BeginContact(self, contact):
+        pass
+
+    def EndContact(self, contact):
+        pass
+
+
+def resting_pile(count: int) -> b2World:
+    world = b2World(gravity=(0, -10))
+    world.CreateStaticBody(shapes=b2EdgeShape(vertices=[(-50, 0), (50, 0)]))
+    for i in range(count):
+        body = world.CreateDynamicBody(position=(i % 30 * 0.5, 0.5 + i // 30 * 0.5))
+        body.CreatePolygonFixture(box=(0.24, 0.24), density=1)
+        body.sleepingAllowed = False
+    for _ in range(60):
+        world.Step(1 / 60, 8, 3)
+    return world
+
+
+@pytest.mark.benchmark
+class TestContactSystemBenchmark:
+    def test_solve_callbacks(self, measure):
+        world = resting_pile(300)
+
+        def step(listener):
+            world.contactListener = listener
+            world.Step(1 / 60, 8, 3)
+
+        measure(lambda: step(None), f'{world.contactCount} contacts, no listener', number=20)
+        measure(lambda: step(ListenerWithDefaultSolveCallbacks()),
+                f'{world.contactCount} contacts, default PreSolve and PostSolve', number=20)
+        measure(lambda: step(WakeListener()), f'{world.contactCount} contacts, WakeListener', number=20)
+
+    @pytest.mark.parametrize('count', [100, 1000])
+    def test_begin_contact_pile_up(self, empty_context, measure, count):
+        empty_context.new_singleton(Box2DWorld(MagicMock(name='b2World')))
+        for i in range(count):
+            empty_context.upsert(f'box{i}', Box2DBody(Mock()), Collidable(set()))
+        contacts = [(f'box{i}', f'box{(i + 1) % count}') for i in range(count)]
+        system = ContactSystem(empty_context)
+
+        def before():
+            for entity_a, entity_b in contacts:
+                begin_contact_with_intersection(empty_context, entity_a, entity_b)
+
+        def after():
+            apply_contacts_one_by_one(system, [(True, entity_a, entity_b) for entity_a, entity_b in contacts])
+
+        before()
+        expected = collisions_of_boxes(empty_context, count)
+        after()
+        assert collisions_of_boxes(empty_context, count) == expected
+        measure(before, f'{count} contacts, set intersection', number=1, repeat=3)
+        measure(after, f'{count} contacts, cached query', number=1, repeat=3)
+
+    @pytest.mark.parametrize('count', [100, 1000])
+    def test_jittering_pile_up(self, empty_context, measure, count):
+        empty_context.new_singleton(Box2DWorld(MagicMock(name='b2World')))
+        for i in range(count):
+            empty_context.upsert(f'box{i}', Box2DBody(Mock()), Collidable(set()))
+        system = ContactSystem(empty_context)
+        # resting boxes losing and regaining contact within a frame, seen from both fixtures
+        events = []
+        for i in range(count):
+            entity_a, entity_b = f'box{i}', f'box{(i + 1) % count}'
+            events += [(True, entity_a, entity_b), (False, entity_b, entity_a), (True, entity_b, entity_a)]
+        entity_ids = [entity_id for _, entity_a, entity_b in events for entity_id in (entity_a, entity_b)]
+        begins = bytearray(begin for begin, _, _ in events)
+
+        apply_contacts_one_by_one(system, events)
+        expected = collisions_of_boxes(empty_context, count)
+        system.apply_contacts(entity_ids, begins)
+        assert collisions_of_boxes(empty_context, count) == expected
+        measure(lambda: apply_contacts_one_by_one(system, events), f'{count} pairs, one by one', number=5, repeat=3)
+        measure(lambda: system.apply_contacts(entity_ids, begins), f'{count} pairs, batch', number=5, repeat=3)
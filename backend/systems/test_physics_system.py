@@ -1,9 +1,14 @@
+import logging
 import pytest
+from time import perf_counter
 from Box2D import b2CircleShape
 from systems.physics_system import PhysicsSystem
+from systems.solver_iterations import AdaptiveIterations, FixedIterations
 from unittest.mock import patch, Mock, call
-from components import Box2DWorld, Box2DBody, Position, Velocity
-from constants import BOX2D_POS_ITERS, BOX2D_VEL_ITERS
+from components import Box2DWorld, Box2DBody, Position, Velocity, Input, Collidable, Angle, CollisionFilter
+from repository import repository_factory
+from constants import BOX2D_POS_ITERS, BOX2D_VEL_ITERS, PHYSICS_TIMESTEP, PHYSICS_MAX_SUBSTEPS, BodyType
+from constants import ALL_CATEGORIES, CollisionCategory
 
 
 @pytest.fixture
@@ -21,25 +26,48 @@ class TestPhysicsSystem:
         system.on_game_init(None)
         assert context.singleton(Box2DWorld)
 
-    def test_on_update_frame_calls_step(self, system):
+    def test_on_update_frame_calls_step(self, context):
+        system = PhysicsSystem(context, iteration_policy=FixedIterations())
         world = Mock(bodies_gen=[])
         with patch('systems.physics_system.b2World', return_value=world):
             system.on_game_init(None)
             system.on_update_frame(1)
-        world.Step.assert_has_calls([
-            call(0, 0, 0),  # flush contactlisteners
-            call(1, BOX2D_VEL_ITERS, BOX2D_POS_ITERS),  # actual update
-        ])
+        assert world.Step.call_args_list == [
+            call(PHYSICS_TIMESTEP, BOX2D_VEL_ITERS, BOX2D_POS_ITERS)] * PHYSICS_MAX_SUBSTEPS  # capped substeps
+        assert system.alpha < 1
+
+    def test_on_update_frame_calls_step_with_frame_time_without_timestep(self, context):
+        system = PhysicsSystem(context, timestep=None, iteration_policy=FixedIterations())
+        world = Mock(bodies_gen=[])
+        with patch('systems.physics_system.b2World', return_value=world):
+            system.on_game_init(None)
+            system.on_update_frame(1)
+        assert world.Step.call_args_list == [call(1, BOX2D_VEL_ITERS, BOX2D_POS_ITERS)]
+
+    def test_on_update_frame_accumulates_time(self, context):
+        system = PhysicsSystem(context, timestep=0.1, iteration_policy=FixedIterations())
+        world = Mock(bodies_gen=[])
+        with patch('systems.physics_system.b2World', return_value=world):
+            system.on_game_init(None)
+            system.on_update_frame(0.15)
+            assert world.Step.call_count == 1
+            assert context.singleton(Box2DWorld).alpha == pytest.approx(0.5)
+
+            system.on_update_frame(0.04)
+            assert world.Step.call_count == 1
+            system.on_update_frame(0.01)
+            assert world.Step.call_count == 2
+            assert system.alpha == pytest.approx(0)
 
     def test_on_update_frame_marks_all_awake_entities_updated(self, system, context):
         context.upsert('0',
-                       Box2DBody(body=Mock(awake=True, position=(0, 0))),
+                       Box2DBody(body=Mock(awake=True, position=(0, 0), contacts=[])),
                        Position.Origin(),
                        Velocity.Still()
                        )
 
         context.upsert('1',
-                       Box2DBody(body=Mock(awake=False, position=(0, 0))),
+                       Box2DBody(body=Mock(awake=False, position=(0, 0), contacts=[])),
                        Position.Origin(),
                        Velocity.Still()
                        )
@@ -68,3 +96,200 @@ class TestPhysicsSystem:
 
         assert context.component('0', Box2DBody).body.position != (0, 0)
         assert context.component('0', Position).position != (0, 0)
+
+    def test_on_update_frame_marks_entity_once_more_when_it_comes_to_rest(self, system, context):
+        system.on_game_init(None)
+        body = drop_box(context, 'box', (4, -5))
+
+        for _ in range(300):
+            context.get_all_updated_entities(reset=True)
+            system.on_update_frame(1 / 60)
+            if not body.awake:
+                break
+        assert not body.awake
+        assert 'box' in context.get_all_updated_entities(reset=True)
+        assert context.component('box', Velocity).velocity == (0, 0)
+
+        system.on_update_frame(1 / 60)
+        assert 'box' not in context.get_all_updated_entities()
+
+    def test_on_update_frame_marks_bodies_woken_by_contact(self, context):
+        system = PhysicsSystem(context, scan_interval=0)
+        system.on_game_init(None)
+        resting = drop_box(context, 'resting', (4, -5))
+        while resting.awake:
+            system.on_update_frame(1 / 60)
+        falling = drop_box(context, 'falling', (4, -3.5))
+        falling.linearVelocity = (0, -5)
+        context.get_all_updated_entities(reset=True)
+
+        for _ in range(30):
+            system.on_update_frame(1 / 60)
+            if resting.awake:
+                break
+        assert resting.awake
+        assert 'resting' in system.awake
+        assert 'resting' in context.get_all_updated_entities()
+
+    def test_on_update_frame_marks_bodies_woken_by_other_systems(self, context):
+        system = PhysicsSystem(context, scan_interval=0)
+        system.on_game_init(None)
+        body = drop_box(context, 'box', (4, -5))
+        while body.awake:
+            system.on_update_frame(1 / 60)
+
+        body.position = (4, 0)
+        body.awake = True
+        context.mark_entity_updated('box', Box2DBody)
+        context.get_all_updated_entities(reset=True)
+        system.on_update_frame(1 / 60)
+        assert 'box' in context.get_all_updated_entities()
+
+    def test_on_update_frame_applies_collision_filters(self, system, context):
+        system.on_game_init(None)
+        body = drop_box(context, 'box', (4, -3))
+        context.upsert('box', CollisionFilter(CollisionCategory.BOX, mask=ALL_CATEGORIES ^ CollisionCategory.WORLD))
+
+        system.on_update_frame(1 / 60)
+        filter_data = body.fixtures[0].filterData
+        assert (filter_data.categoryBits, filter_data.maskBits) == (CollisionCategory.BOX, 0xFFFE)
+
+        # falls through the floor
+        for _ in range(60):
+            system.on_update_frame(1 / 60)
+        assert body.position.y < -6
+
+
+def drop_box(context, entity_id: str, position):
+    world = context.singleton(Box2DWorld, field='world')
+    body = world.CreateDynamicBody(position=position)
+    body.CreatePolygonFixture(box=(0.5, 0.5), density=0.2, friction=0.3, restitution=0)
+    context.upsert(entity_id, Box2DBody(body), Position.from_body(body), Velocity.from_body(body), Angle.Straight())
+    return body
+
+
+def stack_boxes(context, height: int):
+    """Return bodies of a slightly staggered stack of boxes dropped onto the floor"""
+    world = context.singleton(Box2DWorld, field='world')
+    bodies = []
+    for i in range(height):
+        body = world.CreateDynamicBody(position=(4 + 0.1 * (i % 2), -4.9 + i * 1.1))
+        body.CreatePolygonFixture(box=(0.5, 0.5), density=0.2, friction=0.3, restitution=0)
+        context.upsert(f'box{i}', Box2DBody(body), Position.from_body(body), Velocity.from_body(body))
+        bodies.append(body)
+    return bodies
+
+
+def mark_awake_entities(system: PhysicsSystem, entity_data):
+    """Marking as done before awake bodies were tracked, checking every body"""
+    for entity_id, (body, position, velocity, input, collidable, angle) in entity_data.items():
+        if body.body.awake and body.body.type != BodyType.STATIC:
+            system._mark_entity_updated(entity_id, body.body, angle)
+
+
+def crowded_system(context, count: int, **kwargs) -> PhysicsSystem:
+    """Return system of a world crowded with small boxes that never sleep"""
+    system = PhysicsSystem(context, **{'iteration_policy': FixedIterations(), **kwargs})
+    system.on_game_init(None)
+    world = system._get_world()
+    for i in range(count):
+        body = world.CreateDynamicBody(position=(i % 20 * 0.4, i // 20 * 0.4))
+        body.CreatePolygonFixture(box=(0.15, 0.15), density=0.2, friction=0.3)
+        body.sleepingAllowed = False
+        context.upsert(f'box{i}', Box2DBody(body), Position.from_body(body), Velocity.from_body(body),
+                       Collidable(), Angle.Straight())
+    return system
+
+
+def update_frame_with_flush(system: PhysicsSystem, dt: float):
+    """Frame as stepped before contacts were buffered, kept for comparison"""
+    world = system._get_world()
+    world.Step(0, 0, 0)
+    system._update_awake(world)
+    for _ in range(system._substeps(dt)):
+        world.Step(system.timestep, *system.iterations)
+    world.ClearForces()
+    system._update_awake(world)
+
+
+@pytest.mark.benchmark
+class TestPhysicsSystemBenchmark:
+    @pytest.mark.parametrize('count', [50, 200])
+    def test_frame_time(self, context, measure, count):
+        # same scene in two worlds, so both variants are timed over the same frames
+        flushing = crowded_system(context, count)
+        single = crowded_system(type(context)(repository_factory()), count)
+
+        measure(lambda: update_frame_with_flush(flushing, 1 / 60), f'{count} bodies, flush step', number=20)
+        measure(lambda: single.on_update_frame(1 / 60), f'{count} bodies, single step', number=20)
+
+    @pytest.mark.parametrize('timestep', [None, 1 / 12, 1 / 24, 1 / 60], ids=['frame time', '1/12', '1/24', '1/60'])
+    def test_tick_cost_of_timestep(self, context, measure, timestep):
+        # frames at the 12 Hz tick rate of the server, with the default solver iterations
+        system = crowded_system(context, 200, timestep=timestep, iteration_policy=AdaptiveIterations())
+        label = 'frame time' if timestep is None else f'1/{round(1 / timestep)}'
+
+        measure(lambda: system.on_update_frame(1 / 12), f'200 bodies, 12 Hz ticks, timestep {label}', number=20)
+
+    @pytest.mark.parametrize('timestep', [1 / 12, 1 / 24, 1 / 60], ids=['1/12', '1/24', '1/60'])
+    def test_stacking_with_timestep(self, context, timestep):
+        system = PhysicsSystem(context, timestep=timestep)
+        system.on_game_init(None)
+        bodies = stack_boxes(context, 16)
+
+        for _ in range(60):
+            system.on_update_frame(1 / 12)
+
+        height = bodies[-1].position.y - (-5 + 15)
+        logging.info(f'16 boxes, timestep 1/{round(1 / timestep)}: top box rests {height:+.3f} off ideal height')
+        if timestep <= PHYSICS_TIMESTEP:
+            assert abs(height) < 0.5
+
+    def test_marking_mostly_sleeping_bodies(self, context, measure):
+        count = 500
+        system = PhysicsSystem(context, iteration_policy=FixedIterations())
+        system.on_game_init(None)
+        world = system._get_world()
+        for i in range(count):
+            body = world.CreateDynamicBody(position=(i % 50 * 0.4, i // 50 * 0.4))
+            body.CreatePolygonFixture(box=(0.15, 0.15), density=0.2, friction=0.3)
+            body.awake = i % 50 == 0
+            context.upsert(f'box{i}', Box2DBody(body), Position.from_body(body), Velocity.from_body(body),
+                           Collidable(), Angle.Straight())
+        system._update_awake(world)
+        entity_data = context.all_dict(Box2DBody, optional_components=[Position, Velocity, Input, Collidable, Angle])
+
+        context.get_all_updated_entities()
+        mark_awake_entities(system, entity_data)
+        expected = context.get_all_updated_entities()
+        system._update_awake(world)
+        assert context.get_all_updated_entities() == expected
+        measure(lambda: mark_awake_entities(system, entity_data), f'{count} bodies, 10 awake, scan all')
+        measure(lambda: system._update_awake(world), f'{count} bodies, 10 awake, awake set')
+
+    @pytest.mark.parametrize('policy', [
+        FixedIterations(),
+        FixedIterations(8, 3),
+        AdaptiveIterations(),
+    ], ids=['fixed 25/50', 'fixed 8/3', 'adaptive'])
+    def test_stacking(self, context, policy):
+        height = 16
+        frames = 60
+        system = PhysicsSystem(context, timestep=1 / 60, iteration_policy=policy)
+        system.on_game_init(None)
+        bodies = stack_boxes(context, height)
+        top_start = bodies[-1].position.copy()
+
+        seconds = 0.0
+        for _ in range(frames):
+            start = perf_counter()
+            system.on_update_frame(1 / 12)
+            seconds = max(seconds, perf_counter() - start)
+
+        top = bodies[-1].position
+        drift = abs(top.x - top_start.x)
+        ideal_top = -5 + height - 1
+        logging.info(
+            f'{height} boxes, {type(policy).__name__} {system.iterations}: {seconds * 1e3:.2f} ms slowest frame, '
+            f'top box moved {drift:.3f} sideways and rests {top.y - ideal_top:+.3f} off ideal height')
+        assert drift < 0.5
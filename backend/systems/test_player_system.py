@@ -3,6 +3,7 @@ from unittest.mock import Mock
 from systems.player_system import PlayerSystem
 import client_interfaces as ci
 from components import Match, Team, Player, Input, Box2DWorld, Box2DBody
+from constants import InputKey
 
 
 @pytest.fixture
@@ -41,14 +42,13 @@ class TestPlayerSystem:
     def test_on_input_sets_input(self, system, context):
         system.on_player_join('player1')
 
-        system.on_input('player1', ci.InputDTO(
-            keys_down=['ArrowRight'],
-            keys_pressed=None,
-            keys_released=None)
-        )
+        system.on_input('player1', ci.CompactInput(seq=1, down=InputKey.RIGHT))
         assert context.component('player1', Input).move_right
         assert context.component('player1', Input).move_left is False
 
+        system.on_input('player1', ci.CompactInput(seq=2, down=InputKey.LEFT | InputKey.RIGHT | InputKey.UP))
+        assert context.component('player1', Input) == Input(move_left=False, move_right=False, jump=True)
+
     def test_on_player_leave_destroys_body(self, system, context):
         system.on_player_join('player1')
         assert context.get_entities_with(Box2DBody) == {'player1'}
@@ -0,0 +1,32 @@
+import pytest
+from systems.solver_iterations import AdaptiveIterations, FixedIterations, StepStats
+
+
+@pytest.fixture
+def policy():
+    return AdaptiveIterations(minimum=(8, 3), maximum=(24, 48), budget=0.001, contacts_for_max=10)
+
+
+class TestSolverIterations:
+    def test_fixed(self):
+        assert FixedIterations(10, 20).choose(StepStats(contacts=100, bodies=10, sleeping=0)) == (10, 20)
+
+    def test_few_contacts_use_minimum(self, policy):
+        assert policy.choose(StepStats(contacts=0, bodies=10, sleeping=0)) == (8, 3)
+
+    def test_many_contacts_use_maximum(self, policy):
+        assert policy.choose(StepStats(contacts=20, bodies=10, sleeping=0)) == (24, 48)
+
+    def test_sleeping_bodies_need_fewer_iterations(self, policy):
+        assert policy.choose(StepStats(contacts=10, bodies=10, sleeping=5)) == (16, 26)
+        assert policy.choose(StepStats(contacts=10, bodies=10, sleeping=10)) == (8, 3)
+
+    def test_budget_limits_iterations(self, policy):
+        # 72 iterations took 2ms, twice the budget
+        stats = StepStats(contacts=20, bodies=10, sleeping=0, seconds=0.002, iterations=(24, 48))
+        assert policy.choose(stats) == (12, 24)
+        assert policy.seconds_per_iteration == pytest.approx(0.002 / 72)
+
+    def test_budget_never_goes_below_minimum(self, policy):
+        stats = StepStats(contacts=20, bodies=10, sleeping=0, seconds=1, iterations=(24, 48))
+        assert policy.choose(stats) == (8, 3)
@@ -0,0 +1,15 @@
+import pytest
+import client_interfaces as ci
+from constants import InputKey
+
+
+class TestCompactInput:
+    def test_from_list(self):
+        assert ci.CompactInput.from_list([3, 5, 4, 0]) == ci.CompactInput(seq=3, down=5, pressed=4, released=0)
+        for malformed in ([3, 5, 4], [3, 5, 4, 0, 0], [3, 5.0, 4, 0], [3, None, 4, 0], [True, 5, 4, 0]):
+            with pytest.raises(ValueError):
+                ci.CompactInput.from_list(malformed)
+
+    def test_from_dto(self):
+        data = ci.InputDTO(keys_down=['ArrowLeft', 'Unknown'], keys_pressed=None, keys_released=['Enter'])
+        assert ci.CompactInput.from_dto(data) == ci.CompactInput(0, InputKey.LEFT, 0, InputKey.ENTER)
@@ -0,0 +1,98 @@
+import pytest
+from Box2D import b2World, b2Vec2
+import server_interfaces as si
+from components import Box2DBody, Box2DWorld, Position, Velocity
+from interest import InterestManager, entities_in_area
+from serializer import ShortSyncEncoder
+
+
+@pytest.fixture
+def context(empty_context):
+    empty_context.new_singleton(Box2DWorld(b2World(gravity=(0, 0))))
+    return empty_context
+
+
+def add_entity(context, entity_id, x, velocity=(0, 0)):
+    world = context.singleton(Box2DWorld, field='world')
+    body = world.CreateDynamicBody(position=(x, 0), userData=entity_id)
+    body.CreateCircleFixture(radius=0.5)
+    context.upsert(entity_id, Box2DBody(body), Position.at((x, 0)), Velocity(b2Vec2(*velocity)))
+
+
+def move(context, entity_id, x):
+    body = context.component(entity_id, Box2DBody).body
+    body.position = (x, 0)
+    context.upsert(entity_id, Position.at((x, 0)))
+
+
+def sent_ids(dto):
+    return sorted(data.id for data in dto.updates)
+
+
+class TestInterestManager:
+    def test_entities_in_area(self, context):
+        add_entity(context, 'near', 2)
+        add_entity(context, 'far', 20)
+
+        assert entities_in_area(context.singleton(Box2DWorld, field='world'), (0, 0), (5, 5)) == {'near'}
+
+    def test_clients_get_entities_around_their_player(self, context):
+        add_entity(context, 'player1', 0)
+        add_entity(context, 'player2', 30)
+        add_entity(context, 'ball', 3)
+        manager = InterestManager(context, (5, 5))
+
+        syncs = manager.encode(['player1', 'player2'])
+        assert sent_ids(syncs['player1']) == ['ball', 'player1']
+        assert sent_ids(syncs['player2']) == ['player2']
+
+    def test_only_changed_entities_are_sent(self, context):
+        add_entity(context, 'player1', 0)
+        add_entity(context, 'ball', 3)
+        manager = InterestManager(context, (5, 5))
+        manager.encode(['player1'])
+
+        assert manager.encode(['player1'])['player1'].updates == []
+        move(context, 'ball', 4)
+        assert sent_ids(manager.encode(['player1'])['player1']) == ['ball']
+
+    def test_entities_leaving_the_area_are_sent_stopped(self, context):
+        add_entity(context, 'player1', 0)
+        add_entity(context, 'ball', 3, velocity=(1, 0))
+        manager = InterestManager(context, (5, 5))
+        manager.encode(['player1'])
+
+        move(context, 'ball', 10)
+        assert manager.encode(['player1'])['player1'].updates == [
+            si.ShortEntityData(id='ball', position=[10.0, 0.0], velocity=[0.0, 0.0])]
+        move(context, 'ball', 11)
+        assert manager.encode(['player1'])['player1'].updates == []
+
+    def test_entering_entities_are_sent_whole(self, context):
+        add_entity(context, 'player1', 0)
+        add_entity(context, 'ball', 3)
+        manager = InterestManager(context, (5, 5), encoder_factory=ShortSyncEncoder)
+        manager.encode(['player1'])
+        move(context, 'ball', 10)
+        manager.encode(['player1'])
+
+        # the velocity did not change since it was last sent, it is sent again all the same
+        move(context, 'ball', 3)
+        assert manager.encode(['player1'])['player1'].updates == [
+            si.ShortEntityData(id='ball', position=[3.0, 0.0], velocity=[0.0, 0.0])]
+
+    def test_clients_without_player_see_everything(self, context):
+        add_entity(context, 'ball', 3)
+        add_entity(context, 'box', 30)
+        manager = InterestManager(context, (5, 5))
+
+        assert sent_ids(manager.encode(['spectator'])['spectator']) == ['ball', 'box']
+
+    def test_removed_entities_are_sent_to_everyone(self, context):
+        add_entity(context, 'player1', 0)
+        add_entity(context, 'box', 30)
+        manager = InterestManager(context, (5, 5))
+        manager.encode(['player1'])
+
+        context.remove_entity('box')
+        assert manager.encode(['player1'])['player1'].remove == ['box']
@@ -0,0 +1,127 @@
+import pytest
+from unittest.mock import Mock
+import client_interfaces as ci
+from game.game import Game
+from metrics import Histogram, Metrics
+from systems import SYSTEMS
+
+
+def get(app, path, authorization=None):
+    response = Mock()
+    environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET'}
+    if authorization:
+        environ['HTTP_AUTHORIZATION'] = authorization
+    body = b''.join(app(environ, response))
+    return response.call_args[0][0], body.decode()
+
+
+@pytest.fixture
+def game():
+    game = Game(SYSTEMS, metrics=Metrics(sample_rate=1))
+    game.create_room('player1', ci.CreateRoomDTO(name='my room', private=False), Mock())
+    return game
+
+
+class TestMetrics:
+    def test_histogram_buckets(self):
+        histogram = Histogram([1, 10])
+        for value in (0.5, 1, 5, 50):
+            histogram.observe(value)
+
+        assert histogram.counts == [2, 1, 1]
+        assert (histogram.sum, histogram.count) == (56.5, 4)
+
+    def test_histogram_weights(self):
+        histogram = Histogram([1, 10])
+        histogram.observe(5, weight=10)
+
+        assert histogram.counts == [0, 10, 0]
+        assert (histogram.sum, histogram.count) == (50, 10)
+
+    def test_sampled_values_count_for_unsampled_ones(self):
+        metrics = Metrics(sample_rate=0.25)
+        metrics.observe('sync_entities', 3, room='room0', sync='short')
+
+        assert 'sync_entities_count{room="room0",sync="short"} 4.0' in metrics.render()
+        assert 'sync_entities_sum{room="room0",sync="short"} 12.0' in metrics.render()
+
+    def test_render_sources(self):
+        shard = Metrics(sample_rate=1)
+        shard.observe('sync_entities', 3, room='room1', sync='short')
+        shard.add_collector(lambda: [('room_players', {'room': 'room1'}, 1)])
+        metrics = Metrics(sample_rate=1)
+        metrics.observe('sync_entities', 2, room='room0', sync='short')
+        metrics.add_source(lambda: [shard.snapshot()])
+
+        lines = metrics.render().splitlines()
+        assert lines.count('# HELP sync_entities Entities in the updates of a sync') == 1
+        assert 'sync_entities_count{room="room0",sync="short"} 1' in lines
+        assert 'sync_entities_count{room="room1",sync="short"} 1' in lines
+        assert 'room_players{room="room1"} 1' in lines
+
+    def test_render(self):
+        metrics = Metrics(sample_rate=1)
+        metrics.observe('sync_entities', 3, room='room"0', sync='short')
+        metrics.add_collector(lambda: [('room_players', {'room': 'room0'}, 2)])
+
+        lines = metrics.render().splitlines()
+        assert lines[:3] == [
+            '# HELP sync_entities Entities in the updates of a sync',
+            '# TYPE sync_entities histogram',
+            'sync_entities_bucket{room="room\\"0",sync="short",le="0"} 0',
+        ]
+        assert 'sync_entities_bucket{room="room\\"0",sync="short",le="4"} 1' in lines
+        assert 'sync_entities_bucket{room="room\\"0",sync="short",le="+Inf"} 1' in lines
+        assert 'sync_entities_count{room="room\\"0",sync="short"} 1' in lines
+        assert lines[-3:] == [
+            '# HELP room_players Players in a room', '# TYPE room_players gauge', 'room_players{room="room0"} 2']
+
+    def test_sample_rate(self):
+        assert not any(Metrics(sample_rate=0).sample() for _ in range(100))
+        assert all(Metrics(sample_rate=1).sample() for _ in range(100))
+
+    def test_wsgi_app(self):
+        metrics = Metrics(token='secret')
+        metrics.add_collector(lambda: [('scheduler_missed_deadlines_total', {}, 3)])
+
+        assert get(metrics.wsgi_app, '/metrics', 'Bearer secret') == ('200 OK', metrics.render())
+        assert 'scheduler_missed_deadlines_total 3' in metrics.render()
+        assert get(metrics.wsgi_app, '/other')[0] == '404 Not Found'
+
+    def test_wsgi_app_needs_token(self):
+        assert get(Metrics(token='secret').wsgi_app, '/metrics')[0] == '401 Unauthorized'
+        assert get(Metrics(token='secret').wsgi_app, '/metrics', 'Bearer other')[0] == '401 Unauthorized'
+        assert get(Metrics().wsgi_app, '/metrics', 'Bearer None')[0] == '401 Unauthorized'
+
+
+class TestGameMetrics:
+    def test_ticks_are_measured(self, game):
+        game.input('player1', 'room0', ci.CompactInput(1, 0))
+        game.update_room_short('room0', 1 / 60, Mock())
+        game.update_room_long('room0', Mock())
+
+        text = game.metrics.render()
+        assert 'game_event_seconds_count{room="room0",system="PhysicsSystem",event="update_frame"} 1' in text
+        assert 'game_event_seconds_count{room="room0",system="PlayerSystem",event="input"} 1' in text
+        assert 'sync_create_seconds_count{room="room0",sync="short"} 1' in text
+        assert 'sync_dirty_entities_count{room="room0",sync="long"} 1' in text
+        assert 'room_players{room="room0"} 1' in text
+        assert 'box2d_velocity_iterations{room="room0"}' in text
+
+    def test_nothing_is_measured_without_sampling(self):
+        game = Game(SYSTEMS, metrics=Metrics(sample_rate=0))
+        game.create_room('player1', ci.CreateRoomDTO(name='my room', private=False), Mock())
+        game.update_room_short('room0', 1 / 60, Mock())
+
+        assert 'game_event_seconds' not in game.metrics.render()
+
+
+@pytest.mark.benchmark
+class TestMetricsBenchmark:
+    @pytest.mark.parametrize('sample_rate', [None, 0.1, 1])
+    def test_tick_overhead(self, measure, sample_rate):
+        game = Game(SYSTEMS, metrics=None if sample_rate is None else Metrics(sample_rate))
+        room_id = game.create_room('player1', ci.CreateRoomDTO(name='my room', private=False), Mock()).room.id
+
+        measure(lambda: game.update_room_short(room_id, 1 / 60, Mock()), f'short tick, sample rate {sample_rate}',
+                number=200)
@@ -1,9 +1,12 @@
+import logging
 import pytest
 import server_interfaces as si
 from unittest.mock import Mock, ANY
-from components import Box2DBody, Position, Velocity
+from components import Box2DBody, Position, Velocity, Angle
 from Box2D import b2Vec2, b2CircleShape
-from serializer import short_sync_data, long_sync_data, create_short_sync, create_long_sync
+from serializer import short_sync_data, long_sync_data, create_short_sync, create_long_sync, snapshot_short_sync
+from serializer import ShortSyncEncoder
+import server.custom_json as custom_json
 
 
 @pytest.fixture
@@ -84,6 +87,19 @@ class TestSerializerLong:
             start_angle=ANY,
             end_angle=ANY)
 
+    def test_long_sync_data_reuses_shape_until_invalidated(self, context):
+        body = Mock(awake=True, position=(1, 2), fixtures=[
+            Mock(shape=b2CircleShape(pos=(3, 4), radius=5))
+        ])
+        context.upsert('0', Box2DBody(body=body))
+        shape = long_sync_data('0', context)['shape']
+
+        body.fixtures = []
+        assert long_sync_data('0', context)['shape'] is shape
+
+        context.component('0', Box2DBody).invalidate_shape()
+        assert long_sync_data('0', context)['shape'] is None
+
     def test_create_long_sync(self, context):
         context.upsert('0', Position.Origin(), Velocity.Still())
         context.upsert('1', Position.Origin(), Velocity.Still())
@@ -111,3 +127,144 @@ class TestSerializerLong:
         context.remove_entity('0')
 
         assert create_long_sync(context, sort=True) == si.LongSyncDTO([], remove=['0'])
+
+
+class TestShortSyncBatch:
+    def test_snapshot_short_sync(self, context):
+        context.upsert('0', Position.at((1, 2)), Velocity.Still(), Angle(0.5))
+        context.upsert('1', Position.at((3, 4)))
+
+        batch = snapshot_short_sync(['0', '1'], context)
+
+        assert len(batch) == 2
+        assert batch[0] == si.ShortEntityData(id='0', position=[1, 2], velocity=[0, 0], angle=0.5)
+        assert batch[1] == si.ShortEntityData(id='1', position=[3, 4])
+        assert batch == [batch[0], batch[1]]
+
+    def test_snapshot_short_sync_leaves_out_unknown_entities(self, context):
+        context.upsert('0', Position.at((1, 2)))
+
+        batch = snapshot_short_sync(['0', '2'], context)
+
+        assert batch.ids == ['0']
+        assert '2' not in context.index
+
+    def test_snapshot_short_sync_extrapolates_positions(self, context):
+        context.upsert('0', Position.at((1, 2)), Velocity(b2Vec2(2, -2)))
+        context.upsert('1', Position.at((3, 4)))
+
+        batch = snapshot_short_sync(['0', '1'], context, lead=0.25)
+
+        assert batch[0] == si.ShortEntityData(id='0', position=[1.5, 1.5], velocity=[2, -2])
+        assert batch[1] == si.ShortEntityData(id='1', position=[3, 4])
+
+    def test_batch_encodes_like_entity_data(self, context):
+        context.upsert('0', Position.at((0.1, 2)), Velocity.Still(), Angle(0.5))
+        context.upsert('1', Position.at((3, 4)))
+        context.upsert('2', Angle(1.5))
+        entity_ids = ['0', '1', '2']
+
+        updates = [si.ShortEntityData(**short_sync_data(entity_id, context)) for entity_id in entity_ids]
+        batch = snapshot_short_sync(entity_ids, context)
+
+        assert custom_json.dumps(batch) == custom_json.dumps(updates)
+
+
+class TestShortSyncEncoder:
+    @pytest.fixture
+    def encoder(self):
+        encoder = ShortSyncEncoder(position_precision=0.01, velocity_precision=0.1, angle_precision=0.01,
+                                   keyframe_interval=3)
+        encoder._keyframe_requested = False
+        return encoder
+
+    def test_values_are_quantized(self, context, encoder):
+        context.upsert('0', Position.at((1.23456, -2.00001)), Velocity(b2Vec2(0.26, 0)), Angle(0.1234))
+
+        updates = encoder.encode(context).updates
+        assert updates == [si.ShortEntityData(id='0', position=[1.23, -2.0], velocity=[0.3, 0.0], angle=0.12)]
+
+    def test_only_changed_values_are_sent(self, context, encoder):
+        context.upsert('0', Position.at((1, 1)), Velocity(b2Vec2(1, 0)), Angle(0))
+        encoder.encode(context)
+
+        context.upsert('0', Position.at((1.001, 1)), Velocity(b2Vec2(1, 0.5)))
+        updates = encoder.encode(context).updates
+        assert updates == [si.ShortEntityData(id='0', velocity=[1.0, 0.5])]
+        assert custom_json.dumps(updates) == '[{"id": "0", "velocity": [1.0, 0.5]}]'
+
+    def test_small_changes_add_up(self, context, encoder):
+        context.upsert('0', Position.at((1, 1)))
+        encoder.encode(context)
+
+        context.upsert('0', Position.at((1.004, 1)))
+        assert encoder.encode(context).updates == []
+        context.upsert('0', Position.at((1.008, 1)))
+        assert encoder.encode(context).updates == [si.ShortEntityData(id='0', position=[1.01, 1.0])]
+
+    def test_keyframe_sends_everything(self, context, encoder):
+        context.upsert('0', Position.at((1, 1)))
+        context.upsert('1', Position.at((2, 2)), Angle(1))
+        encoder.encode(context)
+        encoder.encode(context)
+
+        updates = encoder.encode(context, sort=True).updates
+        assert updates == [
+            si.ShortEntityData(id='0', position=[1.0, 1.0]),
+            si.ShortEntityData(id='1', position=[2.0, 2.0], angle=1.0),
+        ]
+
+    def test_requested_keyframe(self, context, encoder):
+        context.upsert('0', Position.at((1, 1)))
+        encoder.encode(context)
+        encoder.request_keyframe()
+
+        assert encoder.encode(context).updates == [si.ShortEntityData(id='0', position=[1.0, 1.0])]
+
+    def test_removed_entities(self, context, encoder):
+        context.upsert('0', Position.at((1, 1)))
+        encoder.encode(context)
+        context.remove_entity('0')
+        context.upsert('0', Position.at((1, 1)))
+
+        dto = encoder.encode(context)
+        assert dto.remove == []
+        assert dto.updates == [si.ShortEntityData(id='0', position=[1.0, 1.0])]
+
+
+@pytest.mark.benchmark
+class TestSerializerBenchmark:
+    @pytest.mark.parametrize('count', [10, 100, 1000, 10000])
+    def test_short_sync_encode(self, context, measure, count):
+        for i in range(count):
+            context.upsert(str(i), Position.at((i, i)), Velocity(b2Vec2(1, 1)), Angle(0.1))
+        entity_ids = [str(i) for i in range(count)]
+
+        def per_entity():
+            updates = [si.ShortEntityData(**short_sync_data(entity_id, context)) for entity_id in entity_ids]
+            custom_json.dumps(si.ShortSyncDTO(updates, []))
+
+        def batched():
+            custom_json.dumps(si.ShortSyncDTO(snapshot_short_sync(entity_ids, context), []))  # type: ignore
+
+        measure(per_entity, f'{count} entities, per entity', number=1)
+        measure(batched, f'{count} entities, batched', number=1)
+
+    def test_short_sync_size(self, context):
+        """Compare bytes sent for bodies slowly settling"""
+        count = 100
+        frames = 120
+        encoder = ShortSyncEncoder()
+        context.add_consumer('full')
+        context.add_consumer('delta')
+        full_size = delta_size = 0
+
+        for frame in range(frames):
+            for i in range(count):
+                speed = 2 / (1 + frame) * (i % 4)
+                context.upsert(str(i), Position.at((i + speed * frame, 1)), Velocity(b2Vec2(speed, 0)), Angle(0))
+            full_size += len(custom_json.dumps(create_short_sync(context, consumer='full')))
+            delta_size += len(custom_json.dumps(encoder.encode(context, consumer='delta')))
+
+        logging.info(f'{count} entities, {frames} frames: {full_size} bytes full, {delta_size} bytes delta')
+        assert delta_size < full_size / 2
@@ -0,0 +1,124 @@
+import random
+import pytest
+from components import Position, Velocity
+from spatial_hash import SpatialHash
+
+
+@pytest.fixture
+def context(empty_context):
+    return empty_context
+
+
+def scan_radius(context, center, radius):
+    """Linear scan over all positions, kept for comparison"""
+    x, y = center
+    return {
+        entity_id for entity_id, position in context.all(Position)
+        if (position.position[0] - x) ** 2 + (position.position[1] - y) ** 2 <= radius * radius
+    }
+
+
+class TestSpatialHash:
+    def test_query_radius(self, context):
+        context.upsert('a', Position.at((0, 0)))
+        context.upsert('b', Position.at((1.5, 0)))
+        context.upsert('c', Position.at((3, 3)))
+        context.upsert('d', Velocity.Still())
+        index = SpatialHash(context, cell_size=1)
+
+        assert index.query_radius((0, 0), 2) == {'a', 'b'}
+        assert index.query_radius((3, 2), 1) == {'c'}
+        assert index.query_radius((-5, -5), 1) == set()
+
+    def test_query_aabb(self, context):
+        context.upsert('a', Position.at((0, 0)))
+        context.upsert('b', Position.at((1.5, -0.5)))
+        context.upsert('c', Position.at((3, 3)))
+        index = SpatialHash(context, cell_size=1)
+
+        assert index.query_aabb((-1, -1), (2, 1)) == {'a', 'b'}
+        # covers more cells than are occupied
+        assert index.query_aabb((-100, -100), (100, 2)) == {'a', 'b'}
+
+    def test_update_moves_entities(self, context):
+        index = SpatialHash(context, cell_size=1)
+        context.upsert('a', Position.at((0, 0)))
+        index.update({'a'})
+        assert index.query_radius((0, 0), 1) == {'a'}
+
+        context.upsert('a', Position.at((5, 5)))
+        index.update({'a'})
+        assert index.query_radius((0, 0), 1) == set()
+        assert index.query_radius((5, 5), 1) == {'a'}
+        assert list(index.cells) == [(5, 5)]
+
+    def test_moves_are_seen_after_update(self, context):
+        context.upsert('a', Position.at((0, 0)))
+        index = SpatialHash(context, cell_size=1)
+
+        context.component('a', Position).position.x = 5
+        assert index.query_radius((0, 0), 1) == {'a'}
+        index.update({'a'})
+        assert index.query_radius((0, 0), 1) == set()
+
+    def test_drops_removed_entities(self, context):
+        context.upsert('a', Position.at((0, 0)))
+        context.upsert('b', Position.at((0, 0)))
+        index = SpatialHash(context, cell_size=1)
+
+        context.remove_entity('a')
+        index.update(removed={'a'})
+        assert index.query_radius((0, 0), 1) == {'b'}
+        assert 'a' not in index
+        assert len(index) == 1
+
+    def test_update_skips_entities_without_position(self, context):
+        index = SpatialHash(context, cell_size=1)
+        context.upsert('a', Velocity.Still())
+        index.update({'a'})
+        assert 'a' not in index
+        assert len(index) == 0
+
+    def test_takes_no_consumer(self, context):
+        # contexts have a limited number of consumers and keep removed entities until all read them
+        context.upsert('a', Position.at((0, 0)))
+        SpatialHash(context)
+        context.remove_entity('a')
+        context.get_removed_entities()
+        assert len(context._removed_entities) == 0
+
+
+@pytest.mark.benchmark
+class TestSpatialHashBenchmark:
+    @pytest.mark.parametrize('count', [100, 1000, 10000])
+    def test_radius_query(self, context, measure, count):
+        """Frames moving a tenth of the entities and asking what is near a few points"""
+        rng = random.Random(0)
+        side = count ** 0.5 * 2
+        for i in range(count):
+            context.upsert(str(i), Position.at((rng.uniform(0, side), rng.uniform(0, side))))
+        index = SpatialHash(context)
+        centers = [(rng.uniform(0, side), rng.uniform(0, side)) for _ in range(4)]
+        moved = [str(i) for i in range(0, count, 10)]
+
+        def move():
+            for entity_id in moved:
+                position = context.component(entity_id, Position).position
+                position.x = (position.x + 0.5) % side
+                context.mark_entity_updated(entity_id, Position)
+            index.update(context.get_updated_entities_for(Position))
+
+        def scan():
+            move()
+            for center in centers:
+                scan_radius(context, center, 5)
+
+        def indexed():
+            move()
+            for center in centers:
+                index.query_radius(center, 5)
+
+        move()
+        assert all(index.query_radius(center, 5) == scan_radius(context, center, 5) for center in centers)
+        measure(scan, f'{count} entities, linear scan', number=5)
+        measure(indexed, f'{count} entities, spatial hash', number=5)
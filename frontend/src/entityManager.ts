@@ -34,7 +34,9 @@ export class EntityManager {
   }
 
   public updateEntityShort(id: string, update: Partial<si.ShortEntityData>): void {
-    this.updateEntity(id, update);
+    // short syncs leave out (or null) values that did not change since they were last sent
+    const changed = Object.fromEntries(Object.entries(update).filter(([, value]) => value !== null));
+    this.updateEntity(id, changed);
   }
 
   public updateEntity(id: string, update: Partial<si.EntityData>): void {
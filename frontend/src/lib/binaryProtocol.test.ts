@@ -0,0 +1,56 @@
+import { InputEncoder, ShortSyncDecoder } from './binaryProtocol';
+
+function pack(records: number[][]): ArrayBuffer {
+  const view = new DataView(new ArrayBuffer(records.length * 24));
+  records.flat().forEach((value, i) => view.setFloat32(4 * i, value, true));
+  return view.buffer;
+}
+
+describe('ShortSyncDecoder', () => {
+  it('decodes records', () => {
+    const decoder = new ShortSyncDecoder();
+    const sync = decoder.decode({
+      updates: pack([
+        [0, 1.5, -2, 0.25, 3, NaN],
+        [1, NaN, NaN, NaN, NaN, -1],
+      ]),
+      ids: { '0': 'a', '1': 'b' },
+      remove: ['c'],
+    });
+    expect(sync).toEqual({
+      updates: [
+        { id: 'a', position: [1.5, -2], velocity: [0.25, 3], angle: null },
+        { id: 'b', position: null, velocity: null, angle: -1 },
+      ],
+      remove: ['c'],
+    });
+  });
+
+  it('remembers announced ids', () => {
+    const decoder = new ShortSyncDecoder();
+    decoder.decode({ updates: pack([]), ids: { '3': 'a' }, remove: [] });
+    const sync = decoder.decode({ updates: pack([[3, 1, 2, NaN, NaN, NaN]]), ids: {}, remove: [] });
+    expect(sync.updates).toEqual([{ id: 'a', position: [1, 2], velocity: null, angle: null }]);
+  });
+});
+
+describe('InputEncoder', () => {
+  it('encodes keys as bitmasks with a sequence number', () => {
+    const encoder = new InputEncoder();
+    // eslint-disable-next-line camelcase
+    expect(encoder.encode({ keys_down: ['ArrowLeft', 'ArrowUp'], keys_pressed: ['ArrowUp'], keys_released: null }))
+      .toEqual([1, 0x5, 0x4, 0]);
+    // eslint-disable-next-line camelcase
+    expect(encoder.encode({ keys_down: [], keys_pressed: null, keys_released: ['Enter', 'KeyZ'] }))
+      .toEqual([2, 0, 0, 0x8]);
+  });
+
+  it('restarts sequence numbers on reset', () => {
+    const encoder = new InputEncoder();
+    // eslint-disable-next-line camelcase
+    encoder.encode({ keys_down: [], keys_pressed: null, keys_released: null });
+    encoder.reset();
+    // eslint-disable-next-line camelcase
+    expect(encoder.encode({ keys_down: [], keys_pressed: null, keys_released: null })[0]).toBe(1);
+  });
+});
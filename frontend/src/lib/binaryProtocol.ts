@@ -0,0 +1,82 @@
+import { ci, si } from './index';
+
+export const PROTOCOL_BINARY = 'binary';
+const RECORD_LENGTH = 6;
+const RECORD_BYTES = 4 * RECORD_LENGTH;
+
+/** Short sync as sent to clients connected with the `protocol=binary` query parameter */
+export interface BinaryShortSyncDTO {
+  updates: ArrayBuffer;
+  ids: Record<string, string>;
+  remove: Array<string>;
+}
+
+export function isBinaryShortSync(data: any): data is BinaryShortSyncDTO {
+  return data !== null && data.updates instanceof ArrayBuffer;
+}
+
+/**
+ * Decodes little-endian float32 records (entity index, x, y, vx, vy, angle), NaN marking
+ * a missing value. Keeps the entity ids the server announced, so use one decoder per connection.
+ */
+export class ShortSyncDecoder {
+  private ids: Map<number, string> = new Map();
+
+  public reset(): void {
+    this.ids.clear();
+  }
+
+  public decode(data: BinaryShortSyncDTO): si.ShortSyncDTO {
+    for (const [index, id] of Object.entries(data.ids)) {
+      this.ids.set(Number(index), id);
+    }
+
+    const view = new DataView(data.updates);
+    const updates: si.ShortEntityData[] = [];
+    for (let offset = 0; offset + RECORD_BYTES <= view.byteLength; offset += RECORD_BYTES) {
+      const field = (i: number) => view.getFloat32(offset + 4 * i, true);
+      const index = field(0);
+      const id = this.ids.get(index);
+      if (id === undefined) {
+        continue;
+      }
+      const [x, y, vx, vy, angle] = [field(1), field(2), field(3), field(4), field(5)];
+      updates.push({
+        id,
+        position: Number.isNaN(x) ? null : [x, y],
+        velocity: Number.isNaN(vx) ? null : [vx, vy],
+        angle: Number.isNaN(angle) ? null : angle,
+      });
+    }
+    return { updates, remove: data.remove };
+  }
+}
+
+/** Bits of keys in compact inputs, as in `InputKey` of the server */
+export const INPUT_KEY_BITS: Record<string, number> = {
+  ArrowLeft: 0x1,
+  ArrowRight: 0x2,
+  ArrowUp: 0x4,
+  Enter: 0x8,
+};
+
+/** Input as sent by clients using the binary protocol: sequence number and bitmasks of keys down, pressed, released */
+export type CompactInput = [number, number, number, number];
+
+function keyBits(keys: string[] | null): number {
+  return (keys || []).reduce((bits, key) => bits | (INPUT_KEY_BITS[key] || 0), 0);
+}
+
+/** Encodes inputs into compact inputs with increasing sequence numbers. Use one encoder per connection. */
+export class InputEncoder {
+  private seq = 0;
+
+  public reset(): void {
+    this.seq = 0;
+  }
+
+  public encode(data: ci.InputDTO): CompactInput {
+    this.seq += 1;
+    return [this.seq, keyBits(data.keys_down), keyBits(data.keys_pressed), keyBits(data.keys_released)];
+  }
+}
@@ -3,25 +3,38 @@ import { utils } from 'pixi.js';
 import { ci, si } from './index';
 import { ConnectionFailedError, ConnectionClosedError } from './clientErrors';
 import { ServerError } from './serverErrors';
+import { isBinaryShortSync, InputEncoder, ShortSyncDecoder, PROTOCOL_BINARY } from './binaryProtocol';
 
 export type ClientOptions = {
   url: string;
+  /**
+   * Ask server for packed short syncs and send inputs as compact bitmasks. Servers not supporting packed
+   * short syncs keep sending JSON.
+   */
+  binary?: boolean;
 } & Partial<SocketOptions & ManagerOptions>;
 
 export class Client {
   private socket: Socket;
   public eventEmitter: utils.EventEmitter = new utils.EventEmitter();
+  private shortSyncDecoder = new ShortSyncDecoder();
+  private inputEncoder: InputEncoder | null;
 
   constructor(options: ClientOptions = { url: 'localhost:5000' }) {
-    const { url, ...socketIoOptions } = options;
-    this.socket = io(url, { autoConnect: false, ...socketIoOptions });
+    const { url, binary, ...socketIoOptions } = options;
+    const query = binary ? { protocol: PROTOCOL_BINARY } : {};
+    this.socket = io(url, { autoConnect: false, query, ...socketIoOptions });
+    this.inputEncoder = binary ? new InputEncoder() : null;
 
     this.socket.on('disconnect', () => {
       this.eventEmitter.emit('disconnect', null);
       this.socket.close();
     });
 
-    this.bindSocketEventsToEmitter(['short_sync', 'long_sync']);
+    this.socket.on('short_sync', (data: any) => {
+      this.eventEmitter.emit('short_sync', isBinaryShortSync(data) ? this.shortSyncDecoder.decode(data) : data);
+    });
+    this.bindSocketEventsToEmitter(['long_sync']);
   }
 
   public async connect(timeout = 5000): Promise<void> {
@@ -30,7 +43,9 @@ export class Client {
         this.socket.close();
         reject(new ConnectionFailedError('Connection timed out'));
       }, timeout);
-      this.socket.once('connect', function () {
+      this.socket.once('connect', () => {
+        this.shortSyncDecoder.reset();
+        this.inputEncoder?.reset();
         clearTimeout(connectTimer);
         resolve();
       });
@@ -39,7 +54,7 @@ export class Client {
   }
 
   public sendInput(data: ci.InputDTO): void {
-    this.socket.emit('input', data);
+    this.socket.emit('input', this.inputEncoder ? this.inputEncoder.encode(data) : data);
   }
 
   public async createRoom(data: ci.CreateRoomDTO): Promise<si.CreateRoomDTO> {
@@ -9,3 +9,4 @@ export { Keyboard, Key } from './keyboard';
 export * from './resources';
 export * from './ringBuffer';
 export * from './interpolation';
+export * from './binaryProtocol';